@@ -1,15 +1,50 @@
 """
 Logging module for sessions
+
+Log records are put on a queue by the session and written to the log file by a
+QueueListener thread, so the output loop never waits on the disk.
 """
 
 from datetime import datetime
+import atexit
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 from pathlib import Path
 from rich.text import Text
 
 from abacura import Config
 
+
+def gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def gzip_rotator(source: str, dest: str):
+    """Compress a rotated log file, used as the rotator of a rotating file handler"""
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler for a listener in the same process, records are queued without formatting or copying"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
 class AbacuraLogger:
+    """
+    Session file logger
+
+    Options (session or global): log_dir and log_file (a strftime pattern) enable logging.
+    log_rotate_when (e.g. 'midnight', 'h') rotates by time, otherwise log_rotate_bytes rotates by size.
+    log_backup_count rotated files are kept and log_compress gzips them.
+    """
 
     def __init__(self, name: str, config: Config):
         if config.get_specific_option(name, "log_dir"):
@@ -18,25 +53,61 @@ class AbacuraLogger:
         else:
             self.logfile = None
 
+        self.listener: logging.handlers.QueueListener | None = None
+
         if self.logfile:
-            logging.basicConfig(
-                filename=self.logfile,
-                filemode="a",
-                level=logging.DEBUG
-            )
-            self.logger = logging.getLogger("abacura-kallisti")
+            self.logfile.parent.mkdir(parents=True, exist_ok=True)
+            handler = self.create_file_handler(name, config)
+            handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+            log_queue = queue.SimpleQueue()
+            self.listener = logging.handlers.QueueListener(log_queue, handler)
+            self.listener.start()
+            atexit.register(self.close)
+
+            self.logger = logging.getLogger(f"abacura-kallisti.{name}")
+            self.logger.setLevel(logging.DEBUG)
+            self.logger.propagate = False
+            self.logger.handlers = [LocalQueueHandler(log_queue)]
         else:
             self.logger = None
 
+    def create_file_handler(self, name: str, config: Config) -> logging.FileHandler:
+        when = config.get_specific_option(name, "log_rotate_when", "")
+        max_bytes = int(config.get_specific_option(name, "log_rotate_bytes", 0))
+        backup_count = int(config.get_specific_option(name, "log_backup_count", 10))
+
+        if when:
+            handler = logging.handlers.TimedRotatingFileHandler(self.logfile, when=when, backupCount=backup_count,
+                                                                encoding="UTF-8")
+        elif max_bytes:
+            handler = logging.handlers.RotatingFileHandler(self.logfile, maxBytes=max_bytes, backupCount=backup_count,
+                                                           encoding="UTF-8")
+        else:
+            return logging.FileHandler(self.logfile, mode="a", encoding="UTF-8")
+
+        if config.get_specific_option(name, "log_compress", False):
+            handler.namer = gzip_namer
+            handler.rotator = gzip_rotator
+
+        return handler
+
+    def _log(self, level: int, msg):
+        # makeRecord skips the caller lookup that logger.info would do for every line
+        if self.logger and self.logger.isEnabledFor(level):
+            self.logger.handle(self.logger.makeRecord(self.logger.name, level, "", 0, msg, (), None))
+
     def info(self, msg, **kwargs):
-        if self.logger:
-            self.logger.info(msg, *kwargs)
-       
+        self._log(logging.INFO, msg)
+
     def warn(self, msg, **kwargs):
-        if self.logger:
-            self.logger.warning(msg, *kwargs)
+        self._log(logging.WARNING, msg)
 
     def error(self, msg, **kwargs):
-        if self.logger:
-            self.logger.error(msg, *kwargs)
+        self._log(logging.ERROR, msg)
 
+    def close(self):
+        """Stop the listener after it has written everything queued"""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
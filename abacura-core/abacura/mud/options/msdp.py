@@ -1,13 +1,16 @@
 """MSDP telnet option processor"""
-from dataclasses import dataclass
+from collections import Counter
+from dataclasses import dataclass, field
 import re
-from typing import Any
+import time
+from typing import Any, Callable, Iterable, Optional
 
 from textual import log
 
 from abacura.mud.options import IAC, SE, SB, TelnetOption
 from abacura.mud import OutputMessage
 from abacura.plugins.events import AbacuraMessage
+from abacura.utils.timeseries import TimeSeriesStore
 
 VAR = b'\x01'
 VAL = b'\x02'
@@ -16,9 +19,42 @@ TABLE_CLOSE= b'\x04'
 ARRAY_OPEN = b'\x05'
 ARRAY_CLOSE= b'\x06'
 
+VAR_CHR, VAL_CHR = chr(1), chr(2)
+TABLE_OPEN_CHR = chr(3)
+CONTAINER_CLOSE_CHR = {chr(3): chr(4), chr(5): chr(6)}
+# every byte but the table/array markers, for bytes.translate() to delete
+NOT_MARKERS = bytes(b for b in range(256) if b not in b'\x03\x04\x05\x06')
+
+re_msdp_pair = re.compile('\x01([^\x01\x02]*)\x02([^\x01]*)')
+
 #TODO: Move ansi_escape somewhere else, we'll need it for triggers
 ansi_escape = re.compile(r'\x1b(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
+
+def _strip_ansi(text: str) -> str:
+    return ansi_escape.sub('', text) if '\x1b' in text else text
+
+
+def _decode_latin1_utf8(text: str) -> str:
+    """Decode text read as latin-1 as the UTF-8 it is, stripped of ansi codes"""
+    return _strip_ansi(text.encode("latin-1").decode("UTF-8", "replace"))
+
+
+def _update_table(table: dict, text: str) -> Optional[str]:
+    """Add the VAR name VAL value pairs in text to table, returns the last name or None if there were none"""
+    items = text.replace(VAR_CHR, VAL_CHR).split(VAL_CHR)
+    if text[:1] == VAR_CHR and len(items) == 2 * text.count(VAR_CHR) + 1:
+        # names and values alternate, with nothing before the first name
+        pairs = iter(items)
+        next(pairs)
+        table.update(zip(pairs, pairs))
+        return items[-2]
+
+    pairs = re_msdp_pair.findall(text)
+    table.update(pairs)
+    return pairs[-1][0] if pairs else None
+
+
 @dataclass
 class MSDPMessage(AbacuraMessage):
     """
@@ -34,6 +70,19 @@ class MSDPMessage(AbacuraMessage):
     oldvalue: str = ""
 
 
+@dataclass
+class MSDPBatchMessage(AbacuraMessage):
+    """
+    One message per MSDP subnegotiation, dispatched before the per-variable MSDPMessages
+    :param event_type: defaults to core.msdp.batch
+    :param values: changed MSDP variables and their new values
+    :param oldvalues: the original values of the changed variables
+    """
+    event_type: str = "core.msdp.batch"
+    values: dict = field(default_factory=dict)
+    oldvalues: dict = field(default_factory=dict)
+
+
 # TODO all these need to use the regular socket to trap send instead of calling writer directly
 class MSDP(TelnetOption):
     """Handle MSDP TelnetOptions"""
@@ -47,6 +96,28 @@ class MSDP(TelnetOption):
         self.session = session
         self.values = {}
         self.initialized: bool = False
+        # Variables not listed here only dispatch when their value changes
+        self.change_detection: dict[str, bool] = {}
+        self.delivered: Counter = Counter()
+        self.suppressed: Counter = Counter()
+        # Variables required by name, in addition to those with core.msdp.<VAR> listeners
+        self.required: dict[str, set[str]] = {}
+        self.reported: set[str] = set()
+        self.report_all: bool = False
+        self._listener_version: int = -1
+        # History of numeric variables, one sample per change
+        self.timeseries = TimeSeriesStore()
+        self.parsers: dict[str, Callable[[Any], Any]] = {
+            "REPORTABLE_VARIABLES": self.parse_reportable_variables,
+            "GROUP": self.parse_group,
+            "REMORT_LEVELS": self.parse_group,
+            "ROOM_EXITS": self.parse_exits,
+            "AFFECTS": self.parse_exits,
+        }
+
+    def set_change_detection(self, var: str, enabled: bool = True):
+        """Choose whether unchanged reports of var are suppressed (the default) or always dispatched"""
+        self.change_detection[var] = enabled
 
     def msdpvar(self, buf) -> tuple[bytes, bytes]:
         """Handle MSDP VAR sequences"""
@@ -59,79 +130,208 @@ class MSDP(TelnetOption):
         val, _, remainder = buf.partition(IAC)
         return val, remainder
 
-    # TODO generic handler for MSDP array and tables needed
-    def msdparray(self, buf):
-        """NotImplemented: generic MSDP array parser"""
+    @staticmethod
+    def decode_text(buf) -> str:
+        """Decode names and values to str, stripped of ansi codes"""
+        text = str(buf, "UTF-8", "replace")
+        if '\x1b' in text:
+            text = ansi_escape.sub('', text)
+        return text
+
+    def decode_value(self, buf) -> Any:
+        """Decode a single MSDP value (the bytes following VAL) into str, dict or list"""
+        return self.decode(VAR + VAL + bytes(buf))[0][2]
+
+    def decode(self, sb) -> list[tuple[str, memoryview, Any]]:
+        """
+        Decode every VAR/VAL pair in an SB payload (without the option code)
+
+        The payload is read as latin-1, one character per byte, so offsets into the text are offsets into the
+        bytes.  The table/array markers are picked out with bytes.translate() and found in order with str.find(),
+        and a stack of dicts and lists follows them.  The text between two markers holds nothing but names and
+        values after VAR and VAL, it is decoded as UTF-8 (unless the payload is all ASCII) and split into pairs or
+        values with str.split.  A flat table or array is filled in one step without going on the stack.
+        Returns (name, raw value bytes, decoded value) for each variable outside of any table or array.
+        """
+        data = bytes(sb)
+        if data[-1:] == IAC:
+            data = data[:-1]
+
+        buf = memoryview(data)
+        text = str(data, "latin-1")
+        decode_text = _strip_ansi if text.isascii() else _decode_latin1_utf8
+        markers = str(data.translate(None, NOT_MARKERS), "latin-1")
+
+        if not markers and text.count(VAR_CHR) == 1 and text[:1] == VAR_CHR:
+            # a single plain variable, the most common report
+            name, val, value = text[1:].partition(VAL_CHR)
+            if not val:
+                return []
+            return [(decode_text(name), buf[len(name) + 2:], decode_text(value.partition(VAL_CHR)[0]))]
+
+        # [name, start of the VAR, start of the value, value] for the top level variables
+        found = []
+        # the container being filled, None at the top level, and the VAR name its next value belongs to
+        current = None
+        name = ''
+        stack = []
+        start = 0
+        i = 0
+        last = len(markers)
+        while True:
+            if i < last:
+                marker = markers[i]
+                stop = text.find(marker, start)
+            else:
+                marker = None
+                stop = len(text)
+
+            if start == stop:
+                pass
+            elif current is None:
+                part = text[start:stop]
+                var_start = start + part.find(VAR_CHR)
+                for var in part.split(VAR_CHR)[1:]:
+                    var_name, val, value = var.partition(VAL_CHR)
+                    if val:
+                        found.append([decode_text(var_name), var_start, var_start + len(var_name) + 2,
+                                      decode_text(value.partition(VAL_CHR)[0])])
+                    var_start += len(var) + 1
+            elif type(current) is dict:
+                last_name = _update_table(current, decode_text(text[start:stop]))
+                if last_name is not None:
+                    name = last_name
+            else:
+                current += decode_text(text[start:stop]).split(VAL_CHR)[1:]
+
+            if marker is None:
+                break
+
+            start = stop + 1
+            i += 1
+            close = CONTAINER_CLOSE_CHR.get(marker)
+            if close is None:
+                if not stack:
+                    break
+
+                current = stack.pop()
+                continue
+
+            container = {} if marker == TABLE_OPEN_CHR else []
+            if current is None:
+                if not found:
+                    break
+                found[-1][3] = container
+            elif type(current) is dict:
+                current[name] = container
+            elif current and current[-1] == '':
+                # the VAL before the marker left an empty placeholder
+                current[-1] = container
+            else:
+                current.append(container)
+
+            if i < last and markers[i] == close:
+                stop = text.find(close, start)
+                if start < stop:
+                    if type(container) is dict:
+                        _update_table(container, decode_text(text[start:stop]))
+                    else:
+                        container += decode_text(text[start:stop]).split(VAL_CHR)[1:]
+                start = stop + 1
+                i += 1
+            else:
+                stack.append(current)
+                current = container
+
+        if len(found) == 1:
+            var, _, value_start, value = found[0]
+            return [(var, buf[value_start:], value)]
 
-    def msdptable(self, buf):
-        """NotImplemented: generic MSDP table parser"""
+        ends = [var_start for _, var_start, _, _ in found[1:]] + [len(buf)]
+        return [(var, buf[value_start:end], value) for (var, _, value_start, value), end in zip(found, ends)]
 
     # TODO move this to abacura-kallisti once we have config options for MSDP parser
-    def parse_reportable_variables(self, buf) -> list:
-        """Kallisti-specific parser for REPORTABLE_VARIABLES"""
-        buf = buf[1:-1]
-        return [x.decode("UTF-8") for x in buf.split(VAL) if len(x) > 1]
-
-    def parse_group(self, buf) -> list:
-        """Kallisti-specifc parser for GROUP"""
-
-        def parse_group_member(line) -> dict:
-            items = line.split(b'\x01')
-            member = {}
-            items = items[1:]
-            for item in items:
-                pair = item.split(b'\x02')
-                #try:
-                #    member[pair[0].decode("UTF-8")] = int(pair[1])
-                #except ValueError:
-                member[pair[0].decode("UTF-8")] = ansi_escape.sub('',pair[1].decode("UTF-8"))
-
-            return member
-
-        # Empty group
-        if buf == b'':
+    @staticmethod
+    def parse_reportable_variables(value: Any) -> list:
+        """Kallisti-specific parser for decoded REPORTABLE_VARIABLES"""
+        if not isinstance(value, list):
             return []
+        return [x for x in value if len(x) > 1]
 
-        buf = buf[3:-2]
-        elements = buf.split(b'\x04\x02\x03')
+    @staticmethod
+    def parse_group(value: Any) -> list:
+        """Kallisti-specifc parser for decoded GROUP, an empty group is sent as an empty string"""
+        if not isinstance(value, list):
+            return []
+        return [member for member in value if isinstance(member, dict)]
 
-        log(elements)
+    @staticmethod
+    def parse_exits(value: Any) -> dict:
+        """Kallisti-specific parser for decoded ROOM_EXITS"""
+        if not isinstance(value, dict):
+            return {}
+        return value
 
-        element_list = []
-        for element in elements:
-            log(f"Parsing {element}")
-            element_list.append(parse_group_member(element))
+    def send_command(self, command: str, variables: Iterable[str]) -> None:
+        """Send an MSDP command such as REPORT or UNREPORT with a list of variables"""
+        buf = IAC + SB + self.hexcode + VAR + command.encode("UTF-8")
+        buf += b''.join(VAL + v.encode("UTF-8") for v in sorted(variables))
+        self.writer(buf + IAC + SE, echo_color='')
 
-        log(element_list)
-        return element_list
+    def require(self, owner: str, variables: Iterable[str]) -> None:
+        """Ask for variables to be reported on behalf of owner, replacing anything owner required before"""
+        self.required[owner] = set(variables)
+        self._listener_version = -1
 
-    def parse_exits(self, buf) -> dict:
-        """Kallisti-specific parser for ROOM_EXITS"""
-        if buf == b'':
-            return {}
+    def set_report_all(self, enabled: bool) -> None:
+        """Choose whether every reportable variable is REPORTed, or only those listened for or required"""
+        self.report_all = enabled
+        self._listener_version = -1
+
+    def release(self, owner: str) -> None:
+        """Drop the variables required by owner"""
+        if self.required.pop(owner, None) is not None:
+            self._listener_version = -1
+
+    def wanted_variables(self) -> set[str]:
+        """Reportable variables that have a core.msdp.<VAR> listener or are required by name"""
+        reportable = set(self.values.get("REPORTABLE_VARIABLES") or [])
+        if self.report_all:
+            return reportable
+
+        prefix = "core.msdp."
+        events = self.session.director.event_manager.events
+        wanted = {trigger[len(prefix):] for trigger, pq in events.items() if trigger.startswith(prefix) and pq.queue}
+        for variables in self.required.values():
+            wanted |= variables
 
-        buf = buf[2:-1]
+        return wanted & reportable
 
-        items = buf.split(b'\x01')
+    def sync_reports(self) -> None:
+        """REPORT newly wanted variables and UNREPORT ones nobody listens to any more"""
+        if not self.initialized:
+            return
 
-        exits = {}
-        for item in items:
-            pair = item.split(b'\x02')
-            #try:
-            #    exits[pair[0].decode("UTF-8")] = int(pair[1])
-            #except ValueError:
-            exits[pair[0].decode("UTF-8")] = ansi_escape.sub('',pair[1].decode("UTF-8"))
+        listener_version = self.session.director.event_manager.listener_version
+        if listener_version == self._listener_version:
+            return
 
-        return exits
+        self._listener_version = listener_version
+        wanted = self.wanted_variables()
 
-    def request_all_values(self) -> None:
-        """Automatically request all possible MSDP values"""
-        buf = IAC + SB + self.hexcode + VAR + bytes("REPORT", "UTF-8") + VAL
-        msdp_vals = [VAL + bytes(f, "UTF-8") for f in self.values["REPORTABLE_VARIABLES"]]
-        buf += VAL.join(msdp_vals) + IAC + SE
-        self.writer(buf, echo_color='')
+        if unwanted := self.reported - wanted:
+            self.send_command("UNREPORT", unwanted)
+
+        if added := wanted - self.reported:
+            self.send_command("REPORT", added)
+
+        self.reported = wanted
 
     def will(self):
+        # A new connection starts with nothing reported
+        self.initialized = False
+        self.reported = set()
+        self.values.pop("REPORTABLE_VARIABLES", None)
         self.writer(b"\xff\xfd\x45", echo_color='')
         response = [IAC,SB,self.hexcode,VAR,b"LIST",VAL,b"REPORTABLE_VARIABLES",IAC,SE]
         self.writer(b''.join(response), echo_color='')
@@ -139,44 +339,49 @@ class MSDP(TelnetOption):
     def sb(self, sb):
         log.debug("MSDP SB parsing")
         sb = sb[1:]
-        first = sb[0:1]
-        if first == b'\x01':
-            varname, sb = self.msdpvar(sb)
-            var = varname.decode("UTF-8")
-            value, sb = self.msdpval(sb)
-            oldvalue = self.values.setdefault(var,None)
+        if sb[0:1] != VAR:
+            # TODO this is a candidate for some kind of protocol.log
+            self.handler(f"MSDP: Don't know how to handle {sb}")
+            return
+
+        batch = MSDPBatchMessage()
+        now = time.monotonic()
+        for var, raw, value in self.decode(sb):
+            oldvalue = self.values.setdefault(var, None)
+
+            if var in self.parsers:
+                value = self.parsers[var](value)
+
+            if value == oldvalue and self.change_detection.get(var, True):
+                self.suppressed[var] += 1
+                continue
+
+            self.delivered[var] += 1
+            self.values[var] = value
+            batch.values[var] = value
+            batch.oldvalues.setdefault(var, oldvalue)
+
+            if type(value) is str:
+                self.timeseries.record(var, value, now)
 
             if var == "REPORTABLE_VARIABLES":
-                #self.handler(f"MSDP: Requesting all variables from {var}")
-                self.values[var] = self.parse_reportable_variables(value)
-                if not self.initialized:
-                    self.request_all_values()
-                    self.initialized = True
-            elif var == "GROUP":
-                self.values[var] = self.parse_group(value)
-            elif var == "REMORT_LEVELS":
-                self.values[var] = self.parse_group(value)
-            elif var == "ROOM_EXITS":
-                self.values[var] = self.parse_exits(value)
-            elif var == "AFFECTS":
-                self.values[var] = self.parse_exits(value)
-            else:
-                self.values[var] = ansi_escape.sub('',value.decode("UTF-8"))
-                #try:
-                #    self.values[var] = int(self.values[var])
-                #except ValueError:
-                #    pass
+                self.initialized = True
+                self._listener_version = -1
+                self.sync_reports()
 
             # Write into the output log for debugging timing issues
-            self.session.outputlog(OutputMessage(f"!MSDP_{var}={value.decode()}"))
+            self.session.outputlog(OutputMessage(f"!MSDP_{var}={self.decode_text(raw)}"))
 
+        if not batch.values:
+            return
+
+        # Batch listeners see every change in the burst before any single variable is dispatched
+        self.session.dispatch(batch)
+
+        for var, value in batch.values.items():
             # Two dispatchs here, first is for all-value listeners
-            msg = MSDPMessage(subtype=var, value=self.values[var], oldvalue=oldvalue)
+            msg = MSDPMessage(subtype=var, value=value, oldvalue=batch.oldvalues[var])
             self.session.dispatch(msg)
             # Second dispatch for variable-specific listeners
             msg.event_type = f"core.msdp.{var}"
             self.session.dispatch(msg)
-
-        else:
-            # TODO this is a candidate for some kind of protocol.log
-            self.handler(f"MSDP: Don't know how to handle {sb}")
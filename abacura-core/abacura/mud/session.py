@@ -4,9 +4,10 @@ from __future__ import annotations
 import asyncio
 import re
 import time
+from dataclasses import dataclass, field
 from datetime import datetime
 from importlib import import_module
-from typing import TYPE_CHECKING, Optional, Union, Any, Generator
+from typing import TYPE_CHECKING, Optional, Union, Any, Generator, List
 
 from rich.segment import Segment, Segments
 from rich.style import Style
@@ -25,6 +26,7 @@ from abacura.plugins.director import Director
 from abacura.plugins.loader import PluginLoader
 from abacura.plugins.task_queue import TaskManager
 from abacura.screens import SessionScreen
+from abacura.utils.db_maintenance import db_maintenance
 from abacura.utils.fifo_buffer import FIFOBuffer
 from abacura.utils.ring_buffer import RingBufferLogSql
 from abacura.utils.renderables import AbacuraPanel, tabulate
@@ -35,7 +37,24 @@ if TYPE_CHECKING:
     from asyncio import StreamWriter
 
 speedwalk_pattern = r'^(\d*[neswud])+$'
-speedwalk_step_pattern = r'\d*[neswud]'
+speedwalk_step_pattern = r'(\d*)([neswud])'
+input_token_pattern = r'[^\\;]+|\\(.?)|;'
+
+
+@dataclass(slots=True)
+class InputCommand:
+    """
+    One command parsed out of a line of player input
+
+    :param kind: one of 'command' (client command), 'speedwalk', 'alias', or 'send'
+    :param text: the command text with trailing whitespace removed
+    :param cmd: the first word of the text
+    :param steps: expanded directions for a speedwalk
+    """
+    kind: str
+    text: str
+    cmd: str = ''
+    steps: List[str] = field(default_factory=list)
 
 
 def load_class(class_name: str, default=None):
@@ -79,12 +98,18 @@ class Session(BaseSession):
 
         self.speedwalk_re = re.compile(speedwalk_pattern)
         self.speedwalk_step_re = re.compile(speedwalk_step_pattern)
+        self.input_token_re = re.compile(input_token_pattern, re.DOTALL)
 
         self.logger = AbacuraLogger(self.name, self.config)
 
         ring_filename = self.config.ring_log(name) or ":memory:"
         ring_size = self.config.get_specific_option(name, "ring_size", 10000)
-        self.ring_buffer = RingBufferLogSql(ring_filename, ring_size)
+        ring_fts = self.config.get_specific_option(name, "ring_fts", False)
+        ring_partition_seconds = self.config.get_specific_option(name, "ring_partition_seconds", 3600)
+        ring_retention_seconds = self.config.get_specific_option(name, "ring_retention_seconds", 0)
+        self.ring_buffer = RingBufferLogSql(ring_filename, ring_size, fts=ring_fts,
+                                            partition_seconds=ring_partition_seconds,
+                                            retention_seconds=ring_retention_seconds)
 
         self.director: Director = Director(session=self)
         self.director.register_object(obj=self)
@@ -150,24 +175,47 @@ class Session(BaseSession):
             log(f"Session: {self.name} created in disconnected state due to no host or port")
 
     def input_splitter(self, line) -> Generator[str, Any, Any]:
-        buf: str = ""
-
-        while line:
-            token: str = line[0]
-            line = line[1:]
-
-            if token == '\\':
-                if len(line) > 0:
-                    buf += str(line[0])
-                    line = line[1:]
-            elif token == ';':
-                yield buf
-                buf = ""
+        """Split a line on ';', a backslash escapes the next character"""
+        buf: List[str] = []
+
+        for m in self.input_token_re.finditer(line):
+            token = m.group()
+            if token == ';':
+                yield "".join(buf)
+                buf = []
+            elif token[0] == '\\':
+                buf.append(m.group(1))
             else:
-                buf += token
+                buf.append(token)
+
+        remainder = "".join(buf)
+        if len(remainder) > 0:
+            yield remainder
+
+    def parse_input(self, line: str) -> Generator[InputCommand, Any, Any]:
+        """
+        Split a line of input into typed commands in a single pass
+
+        Each command is typed as it is reached, so earlier commands of the line, such as #alias or #connect,
+        take effect before the commands after them are typed.
+        """
+        get_alias = self.director.alias_manager.get_alias_by_command
+
+        for sl in self.input_splitter(line):
+            sl = sl.rstrip()
+            words = sl.split(maxsplit=1)
+            cmd = words[0] if words else ""
 
-        if len(buf) > 0:
-            yield buf
+            if cmd.startswith(self.command_char):
+                yield InputCommand("command", sl, cmd)
+            elif self.connected and self.speedwalk_re.match(sl):
+                steps = [direction for count, direction in self.speedwalk_step_re.findall(sl)
+                         for _ in range(int(count) if count else 1)]
+                yield InputCommand("speedwalk", sl, cmd, steps)
+            elif get_alias(cmd) is not None:
+                yield InputCommand("alias", sl, cmd)
+            else:
+                yield InputCommand("send", sl, cmd)
 
     def player_input(self, line, gag: bool = False, echo_color: str = "white") -> None:
         """This is entry point of the inputbar on the screen"""        
@@ -176,37 +224,29 @@ class Session(BaseSession):
         if sl == "":
             self.send("\n")
             return
-        for sl in self.input_splitter(line):
-            sl = sl.rstrip()
-            if sl == "":
-                cmd = sl
-            else:
-                cmd = sl.split()[0]
 
-            if cmd.startswith(self.command_char):
-                self.echo_command(sl, color="green")
-                self.director.command_manager.execute_command(sl)
+        for ic in self.parse_input(line):
+            if ic.kind == "command":
+                self.echo_command(ic.text, color="green")
+                self.director.command_manager.execute_command(ic.text)
                 continue
 
-            if self.speedwalk_re.match(sl) and self.connected:
-                for walk in self.speedwalk_step_re.findall(sl):
-                    # We're keeping delimiters so without a preceding number, first part is ''
-                    parts = re.split('([neswud])', walk)
-                    if parts[0] == '':
-                        self.send(parts[1] + "\n", echo_color=echo_color)
-                    else:
-                        for _ in range(int(parts[0])):
-                            self.send(parts[1] + "\n", echo_color='')
+            if ic.kind == "speedwalk":
+                # One write for the whole walk, echo what was typed rather than every step, nothing for 0n
+                if ic.steps:
+                    self.send("\n".join(ic.steps) + "\n", echo_color="")
+                if echo_color:
+                    self.echo_command(ic.text, echo_color)
                 continue
 
-            if self.director.alias_manager.handle(cmd, sl):
+            if ic.kind == "alias" and self.director.alias_manager.handle(ic.cmd, ic.text):
                 continue
 
             if self.connected:
-                self.send(sl + "\n", echo_color=echo_color)
+                self.send(ic.text + "\n", echo_color=echo_color)
                 continue
 
-            self.output(f"[bold red]# NO SESSION CONNECTED - pi {sl}", markup=True)
+            self.output(f"[bold red]# NO SESSION CONNECTED - pi {ic.text}", markup=True)
 
     # TODO raw can come out now that we isinstance
     def send(self, msg: Union[str, bytes], raw: bool = False, echo_color: str = "orange1") -> None:
@@ -278,6 +318,7 @@ class Session(BaseSession):
         """Write to long-term logger and short-term ring buffer"""
         self.logger.info(message.message)
         self.ring_buffer.log(message)
+        db_maintenance.note_activity()
 
     def output(self, msg,
                markup: bool = False, highlight: bool = False, ansi: bool = False, actionable: bool = True,
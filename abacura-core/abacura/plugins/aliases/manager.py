@@ -4,22 +4,70 @@ import csv
 import io
 import os
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional, TYPE_CHECKING
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
 import tomlkit
 
+from abacura.utils.file_writer import file_writer
+
 if TYPE_CHECKING:
     from abacura.mud.session import Session
 
 
+re_param = re.compile(r'^%([0-9]+)')
+
+
+class AliasTemplate:
+    """Alias value compiled into one format string per command with %N slots as positional fields"""
+
+    def __init__(self, value: str):
+        self.formats: List[str] = []
+        self.arity: int = 0
+
+        try:
+            command_list = csv.reader(io.StringIO(value), delimiter=';', escapechar='\\')
+            lines = next(command_list)
+        except StopIteration:
+            return
+
+        for alias_line in lines:
+            parts = next(csv.reader(io.StringIO(alias_line), delimiter=' '), None)
+            if parts is None:
+                # an empty command ends the alias
+                break
+
+            segments = []
+            for token in parts:
+                m = re_param.match(token)
+                if m:
+                    slot = int(m.group(1))
+                    self.arity = max(self.arity, slot + 1)
+                    segments.append('{%d}' % slot)
+                else:
+                    segments.append(token.replace('{', '{{').replace('}', '}}'))
+
+            self.formats.append(' '.join(segments))
+
+    def expand(self, args: List[str]) -> List[str]:
+        """Substitute args into the template, missing arguments become empty strings"""
+        if len(args) < self.arity:
+            args = args + [''] * (self.arity - len(args))
+
+        return [f.format(*args) for f in self.formats]
+
+
 @dataclass
 class Alias:
     category: str
     cmd: str
     value: str
     temporary: bool = False
+    template: AliasTemplate = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.template = AliasTemplate(self.value)
 
 
 class AliasManager:
@@ -29,7 +77,8 @@ class AliasManager:
         super().__init__()
         self.session = session
         self.aliases: List[Alias] = []
-        self.re_param = re.compile(r'^%([0-9]+)')
+        self.commands: Dict[str, Alias] = {}
+        self.names: Dict[Tuple[str, str], Alias] = {}
 
     @staticmethod
     def parse_alias(alias) -> (str, str):
@@ -41,11 +90,10 @@ class AliasManager:
 
     def get_alias(self, alias: str) -> Optional[Alias]:
         cmd, category = self.parse_alias(alias)
-        for a in self.aliases:
-            if a.cmd == cmd and (a.category == category or category is None):
-                return a
+        if category is None:
+            return self.commands.get(cmd, None)
 
-        return None    
+        return self.names.get((category, cmd), None)
 
     def get_categories(self) -> List[str]:
         unique_categories = {a.category for a in self.aliases}
@@ -55,30 +103,42 @@ class AliasManager:
         return [ali for ali in self.aliases if ali.category.lower() == category.lower()]
     
     def get_alias_by_command(self, cmd: str) -> Alias | None:
+        return self.commands.get(cmd, None)
+
+    def reindex(self):
+        """Rebuild the lookups, the first alias defined for a command wins"""
+        self.commands = {}
+        self.names = {}
         for a in self.aliases:
-            if a.cmd == cmd:
-                return a
-        return None
+            self.commands.setdefault(a.cmd, a)
+            self.names[(a.category, a.cmd)] = a
 
     def delete_alias(self, alias: str):
         existing_alias = self.get_alias(alias)
-        self.aliases = [ali for ali in self.aliases if ali != existing_alias]
-        self.save()
+        self.aliases = [ali for ali in self.aliases if ali is not existing_alias]
+        self.reindex()
+        if existing_alias is not None and not existing_alias.temporary:
+            self.save()
 
     def add_alias(self, alias: str, value: str, temporary: bool = False):
         name, category = self.parse_alias(alias)
 
         if self.get_alias(alias) is None:
-            self.aliases.append(Alias(category, name, value, temporary))
-            self.save()
+            new_alias = Alias(category, name, value, temporary)
+            self.aliases.append(new_alias)
+            self.commands.setdefault(new_alias.cmd, new_alias)
+            self.names[(new_alias.category, new_alias.cmd)] = new_alias
+            if not temporary:
+                self.save()
 
     def save(self):
-        toml_structure = {}
-        for c in self.get_categories():
-            toml_structure[c] = {ali.cmd: ali.value for ali in self.get_category(c) if not ali.temporary}
+        """Snapshot the persistent aliases and hand them to the background writer"""
+        toml_structure = {c: {} for c in self.get_categories()}
+        for ali in self.aliases:
+            if not ali.temporary:
+                toml_structure[ali.category][ali.cmd] = ali.value
 
-        with open(self.alias_filepath, 'w') as f:
-            tomlkit.dump(toml_structure, f)        
+        file_writer.schedule(self.alias_filepath, lambda: tomlkit.dumps(toml_structure))
 
     def load(self, file: str):
         self.alias_filepath = Path(os.path.join(self.session.config.data_directory(self.session.name), f"{file}"))
@@ -95,36 +155,15 @@ class AliasManager:
                 aliases += [Alias(c, k, v) for k, v in toml_structure[c].items()]
 
             self.aliases = aliases
+            self.reindex()
 
     def handle(self, cmd, line):
         """Handle aliases, return True if success, False if missing"""
-        alias = self.get_alias_by_command(cmd)
-        if alias:
-            args = line.split()
-            try:
-                command_list = csv.reader(io.StringIO(alias.value), delimiter=';', escapechar='\\')
-                lines = command_list.__next__()
-                for alias_line in lines:
-
-                    file_like = io.StringIO(alias_line)
-                    parts = next(csv.reader(file_like, delimiter=' '))
-                    # self.session.output(f"[bold yellow] PREPARSE: {list(parts)}", markup = True)
-                    parsed = []
-                    for token in parts:
-                        m = self.re_param.match(token)
-                        if m:
-                            parsed.append(args[int(m.group(1))] if int(m.group(1)) < len(args) else r'')
-                        else:
-                            parsed.append(token)
-                    # self.session.output(f"Parsed: {parsed}")
-                    parsed_alias = ' '.join(parsed)
-
-                    # SEND
-                    # self.session.output(f"[bold yellow] SEND: {parsed_alias}", markup = True)
-                    self.session.player_input(parsed_alias)
-
-            except StopIteration:
-                pass
-
-            return True
-        return False
+        alias = self.commands.get(cmd, None)
+        if alias is None:
+            return False
+
+        for parsed_alias in alias.template.expand(line.split()):
+            self.session.player_input(parsed_alias)
+
+        return True
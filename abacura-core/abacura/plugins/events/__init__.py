@@ -41,6 +41,8 @@ class EventManager:
         log("Booting EventManager")
         self.events: Dict[str, PriorityQueue] = {}
         self.event_counts = Counter()
+        # Incremented whenever listeners are added or removed so others can cheaply detect changes
+        self.listener_version: int = 0
 
     def register_object(self, obj: object):
         """Find and register all events in an object"""
@@ -57,6 +59,8 @@ class EventManager:
         for trigger, pq in self.events.items():
             pq.queue[:] = [e for e in pq.queue if e.source != obj]
 
+        self.listener_version += 1
+
     def add_listener(self, listener: Callable, source: object = None):
         """Add an event listener"""
         trigger: str = getattr(listener, "event_trigger")
@@ -64,6 +68,7 @@ class EventManager:
                          priority=getattr(listener, "event_priority"))
 
         self.events.setdefault(trigger, PriorityQueue()).put(task)
+        self.listener_version += 1
 
     def dispatch(self, message: AbacuraMessage):
         """Dispatch events"""
@@ -4,15 +4,40 @@ from rich.panel import Panel
 from rich.pretty import Pretty
 
 from abacura.plugins import Plugin, command, CommandError
+from abacura.screens import AbacuraWindow
+from abacura.utils.db_maintenance import db_maintenance
 from abacura.utils.renderables import tabulate, AbacuraPanel
+from abacura.utils.timeseries import TimeSeriesStore
+from abacura.widgets.plot import Plot
+
+
+class MSDPPlotWindow(AbacuraWindow):
+    """Plot the recorded history of a numeric MSDP variable, refreshed every second"""
+
+    def __init__(self, store: TimeSeriesStore, variable: str, seconds: float):
+        super().__init__(title=f"MSDP {variable}")
+        self.store = store
+        self.variable = variable
+        self.seconds = seconds
+        self.plot = Plot(*store.query(variable, seconds))
+        self.plot.title = f"{variable} (seconds ago)"
+        self.plot.styles.height = "1fr"
+
+    def compose(self):
+        yield self.plot
+
+    def on_mount(self):
+        self.set_interval(1, self.update_plot)
+
+    def update_plot(self):
+        self.plot.set_data(*self.store.query(self.variable, self.seconds))
 
 
 class SessionHelper(Plugin):
     """Provides commands related to the session"""
     def __init__(self):
         super().__init__()
-        if self.session.ring_buffer:
-            self.add_ticker(1, self.session.ring_buffer.commit, name="ring-autocommit")
+        self.add_ticker(1, self.core_msdp.sync_reports, name="msdp-reports")
 
     """Session specific commands"""
     @command(name="echo")
@@ -38,21 +63,77 @@ class SessionHelper(Plugin):
         self.session.output(text, markup=True)
 
     @command(name="msdp")
-    def msdp_command(self, variable: str = '') -> None:
+    def msdp_command(self, variable: str = '', stats: bool = False, plot: bool = False, minutes: int = 10,
+                     report_all: bool = False) -> None:
         """
         Dump MSDP values for debugging
 
         :param variable: The name of a variable to view, leave blank for all
+        :param stats: Show delivered and suppressed (unchanged) update counts
+        :param plot: Plot the history of a numeric variable
+        :param minutes: How many minutes of history to plot
+        :param report_all: Toggle REPORTing every reportable variable instead of only those listened for
         """
         if "REPORTABLE_VARIABLES" not in self.core_msdp.values:
             raise CommandError("MSDP not loaded")
 
+        if report_all:
+            self.core_msdp.set_report_all(not self.core_msdp.report_all)
+            state = "every reportable variable" if self.core_msdp.report_all else "only variables listened for"
+            self.output(f"[bold]MSDP now reports {state}", markup=True)
+            return
+
+        if plot:
+            variable = variable.upper()
+            if variable not in self.core_msdp.timeseries:
+                raise CommandError(f"No history for '{variable}'")
+
+            window = MSDPPlotWindow(self.core_msdp.timeseries, variable, minutes * 60)
+            self.session.screen.mount(window)
+            return
+
+        if stats:
+            msdp = self.core_msdp
+            names = sorted(set(msdp.delivered) | set(msdp.suppressed))
+            rows = [(name, msdp.delivered[name], msdp.suppressed[name], msdp.change_detection.get(name, True))
+                    for name in names if name.startswith(variable.upper())]
+            caption = f"{msdp.delivered.total()} delivered, {msdp.suppressed.total()} suppressed"
+            tbl = tabulate(rows, headers=["Variable", "Delivered", "Suppressed", "Change Detection"],
+                           caption=caption)
+            self.output(AbacuraPanel(tbl, title="MSDP Updates"), actionable=False, highlight=True)
+            return
+
         if not variable:
             panel = Panel(Pretty(self.core_msdp.values), highlight=True)
         else:
             panel = Panel(Pretty(self.core_msdp.values.get(variable, None)), highlight=True)
         self.session.output(panel, highlight=True, actionable=False)
 
+    @command(name="db")
+    def db_command(self, checkpoint: bool = False):
+        """
+        Show WAL size and background checkpoint statistics for each database
+
+        :param checkpoint: Checkpoint and optimize every database now instead of waiting for an idle moment
+        """
+        if checkpoint:
+            db_maintenance.run_now()
+            self.output("[bold]Database maintenance requested", markup=True)
+            return
+
+        now = time.monotonic()
+        rows = []
+        for stats in db_maintenance.databases.values():
+            last_run = f"{now - stats.last_run:.0f}s ago" if stats.last_run else "never"
+            rows.append((stats.name, f"{stats.current_wal_bytes / 1024:,.0f} KB", stats.checkpoints,
+                         stats.checkpoints_busy, f"{stats.last_checkpoint_ms:.1f}", f"{stats.max_checkpoint_ms:.1f}",
+                         stats.analyzes, last_run, stats.errors))
+
+        caption = f"Maintenance after {db_maintenance.idle_seconds}s idle, every {db_maintenance.interval}s"
+        tbl = tabulate(rows, headers=["Database", "WAL", "Checkpoints", "Busy", "Last ms", "Max ms",
+                                      "Analyzes", "Last Run", "Errors"], caption=caption)
+        self.output(AbacuraPanel(tbl, title="Database Maintenance"), actionable=False, highlight=True)
+
     @command(name="workers")
     def workers(self, group: str = ""):
         """
@@ -1,4 +1,8 @@
+import re
+import sqlite3
 import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
 
 from rich.text import Text
 from textual import on
@@ -6,6 +10,7 @@ from textual.app import ComposeResult
 from textual.containers import Grid, Horizontal
 from textual.timer import Timer
 from textual.widgets import Button, Input, Label, RichLog, Select, Checkbox
+from textual.worker import get_current_worker
 
 from abacura.screens import AbacuraWindow
 from abacura.plugins import Plugin, command, CommandError
@@ -13,23 +18,116 @@ from abacura.utils.ring_buffer import RingBufferLogSql
 from abacura.utils.renderables import tabulate, AbacuraPropertyGroup, AbacuraPanel, Group, OutputColors
 
 
+re_query_filter = re.compile(r'(?:^|\s)(ctx|since|until|msdp):(\S+)')
+re_age = re.compile(r'^(\d+)([smhd]?)$')
+AGE_UNITS = {'': 60, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@dataclass
+class LogQuery:
+    """A parsed log search, see parse() for the syntax"""
+    like: str = '%'
+    regex: str = ''
+    context: str = ''
+    since_ns: int = 0
+    until_ns: int = 0
+    msdp_variable: str = ''
+    show_msdp: bool = False
+
+    @staticmethod
+    def age_to_epoch_ns(age: str) -> int:
+        match = re_age.match(age)
+        if not match:
+            raise ValueError(f"Invalid age '{age}', use a number with optional s, m, h or d")
+
+        return time.time_ns() - int(match.group(1)) * AGE_UNITS[match.group(2)] * 1_000_000_000
+
+    @classmethod
+    def parse(cls, text: str, show_msdp: bool = False) -> "LogQuery":
+        """
+        Parse search text into a query
+
+        Text uses sql LIKE wildcards, ^ and $ anchor the start and end, or /text/ searches by regex.
+        Filters may appear anywhere: ctx:<like pattern>, since:<age>, until:<age> and msdp:<VARIABLE>.
+        Ages are like 90s, 10m, 2h or 1d, minutes without a unit.
+        """
+        query = cls(show_msdp=show_msdp)
+
+        for name, value in re_query_filter.findall(text):
+            if name == 'ctx':
+                query.context = value
+            elif name == 'since':
+                query.since_ns = cls.age_to_epoch_ns(value)
+            elif name == 'until':
+                query.until_ns = cls.age_to_epoch_ns(value)
+            elif name == 'msdp':
+                query.msdp_variable = value.upper()
+
+        text = re_query_filter.sub('', text).strip()
+
+        if len(text) > 1 and text[0] == '/' and text[-1] == '/':
+            query.regex = text[1:-1]
+            try:
+                re.compile(query.regex)
+            except re.error as exc:
+                raise ValueError(f"Invalid regex: {exc}")
+            return query
+
+        like = text[1:] if len(text) and text[0] == "^" else "%" + text
+        query.like = like[:-1] if len(like) and like[-1] == "$" else like + "%"
+        return query
+
+    def clause(self) -> Tuple[str, tuple]:
+        """Return the extra sql clause and its parameters for the filters"""
+        clauses, params = [], []
+        if self.msdp_variable:
+            clauses.append("stripped like ?")
+            params.append(f"!MSDP_{self.msdp_variable}=%")
+        elif not self.show_msdp:
+            clauses.append("stripped not like '!MSDP%'")
+
+        if self.regex:
+            clauses.append("stripped regexp ?")
+            params.append(self.regex)
+
+        if self.context:
+            clauses.append("context like ?")
+            params.append(self.context)
+
+        return "".join(f" and {c}" for c in clauses), tuple(params)
+
+
 class LogSearcher:
     def __init__(self, ring_buffer: RingBufferLogSql):
         self.ring_buffer = ring_buffer
 
     def search_logs(self, like: str = "", limit: int = 100, minutes_ago: int = 0, show_msdp: bool = False) -> list:
-        like = like[1:] if len(like) and like[0] == "^" else "%" + like
-        like = like[:-1] if len(like) and like[-1] == "$" else like + "%"
+        query = LogQuery.parse(like, show_msdp)
+        if minutes_ago:
+            query.since_ns = LogQuery.age_to_epoch_ns(f"{int(minutes_ago)}m")
 
-        ns_ago = int(minutes_ago) * 60 * 1000 * 1000 * 1000
-        epoch_start = 0 if not minutes_ago else (time.time_ns() - ns_ago)
+        logs = next(self.pages(query, page_size=limit, limit=limit), [])
+        return list(reversed(logs))
 
-        clauses = [] if show_msdp else [r"stripped not like '!MSDP%'"]
-        clauses = [""] + clauses if len(clauses) else []
-        exclude_clause = " and ".join(clauses)
+    def pages(self, query: LogQuery, page_size: int = 100, limit: int = 1000,
+              cancelled: Optional[Callable[[], bool]] = None) -> Iterator[List[Tuple[str, str, str]]]:
+        """
+        Yield pages of (time, context, message) newest first, fetching each page as it is needed
+        Reading a page raises sqlite3.OperationalError once cancelled returns True.
+        """
+        clause, params = query.clause()
+        before = None
+        remaining = limit
+        while remaining > 0:
+            rows = self.ring_buffer.select_rows(query.like, clause, params, limit=min(page_size, remaining),
+                                                epoch_start=query.since_ns, epoch_end=query.until_ns, before=before,
+                                                cancelled=cancelled)
+            if not rows:
+                return
 
-        logs = self.ring_buffer.query(like, clause=exclude_clause, limit=limit, epoch_start=epoch_start)
-        return logs
+            yield [(self.ring_buffer.format_epoch(ns), ctx, message) for message, _, ns, ctx in rows]
+            remaining -= len(rows)
+            before = (rows[-1][2], rows[-1][1])
 
 
 class LogSearchWindow(AbacuraWindow):
@@ -47,7 +145,7 @@ class LogSearchWindow(AbacuraWindow):
         super().__init__(title="Log Search")
         self.searcher = searcher
         self.richlog = RichLog(id="logsearch-log")
-        self.input = Input(id="logsearch-input", placeholder="search text")
+        self.input = Input(id="logsearch-input", placeholder="search text, /regex/, ctx: since: until: msdp:")
         if find != "%":
             self.input.value = find
         row_options = [(" 100 rows", 100), ("1000 rows", 1000)]
@@ -55,35 +153,68 @@ class LogSearchWindow(AbacuraWindow):
         self.msdp_checkbox = Checkbox("MSDP", value=show_msdp)
         self.footer: Label = Label("", id="logsearch-footer")
 
+        self.search_id: int = 0
         self.call_after_refresh(self.run_search, find)
         self.populate_timer: Timer | None = None
 
         self.richlog.can_focus = False
+        self.richlog.auto_scroll = False
         self.msdp_checkbox.can_focus = False
         self.row_limit.can_focus = False
 
     async def run_search(self, find: str = '%'):
         if self.populate_timer:
             self.populate_timer.stop()
+
+        # Results of an older search still arriving from its worker are ignored
+        self.search_id += 1
+        self.richlog.clear()
+
+        try:
+            query = LogQuery.parse(find, show_msdp=self.msdp_checkbox.value)
+        except ValueError as exc:
+            self.footer.update(Text(str(exc), style="red"))
+            return
+
+        search_id = self.search_id
+        limit = self.row_limit.value
+        self.run_worker(lambda: self.stream_results(search_id, query, limit),
+                        group="logsearch", exclusive=True, thread=True, exit_on_error=False)
+
+    def stream_results(self, search_id: int, query: LogQuery, limit: int):
+        """Runs in a worker thread, sending each page to the window as soon as it is read"""
+        worker = get_current_worker()
         start = time.monotonic()
-        results = self.searcher.search_logs(find, limit=self.row_limit.value, show_msdp=self.msdp_checkbox.value)
-        elapsed = time.monotonic() - start
-        self.call_later(self.display_results, results, elapsed)
+        found = 0
+        try:
+            for page in self.searcher.pages(query, page_size=100, limit=limit, cancelled=lambda: worker.is_cancelled):
+                if worker.is_cancelled:
+                    return
+                found += len(page)
+                self.app.call_from_thread(self.display_results, search_id, page, found, time.monotonic() - start)
+        except sqlite3.Error as exc:
+            if worker.is_cancelled:
+                # a newer search interrupted this one
+                return
+            self.app.call_from_thread(self.footer.update, Text(f"Search failed: {exc}", style="red"))
+            return
+
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self.display_results, search_id, [], found, time.monotonic() - start, True)
+
+    def display_results(self, search_id: int, results: list, found: int, elapsed: float, done: bool = False):
+        if search_id != self.search_id:
+            return
 
-    async def display_results(self, results: list, elapsed: float = 0):
-        self.footer.refresh()
-        # with self.app.batch_update():
         with self.screen.app.batch_update():
-            self.richlog.clear()
-            self.richlog.auto_scroll = True
-            if len(results):
-                for lt, lc, ll in results:
-                    self.richlog.write(Text.from_ansi(f"{lt:15} {lc:>6} {ll[:300]}"))
-            else:
+            for lt, lc, ll in results:
+                self.richlog.write(Text.from_ansi(f"{lt:15} {lc:>6} {ll[:300]}"))
+
+            if done and found == 0:
                 self.richlog.write(Text("No results found", style="red"))
 
-            self.footer.renderable = Text(f"{len(results)} lines returned in {elapsed:5.3f}s")
-            self.footer.refresh()
+            status = "returned" if done else "found so far"
+            self.footer.update(Text(f"{found} lines {status} in {elapsed:5.3f}s, newest first"))
 
     def compose(self) -> ComposeResult:
         with Grid(id="logsearch-grid") as g:
@@ -145,7 +276,7 @@ class LogSearch(Plugin):
         """
         Search output log and show results in a window
 
-        :param find: Search for text using sql % wildcard style
+        :param find: Search for text using sql % wildcard style, /regex/, and ctx:, since:, until:, msdp: filters
         :param limit: limit the number of log entries returned
         :param msdp: Show msdp values
         :param dump: dump output to mud instead of bringing up new window
@@ -161,7 +292,11 @@ class LogSearch(Plugin):
             self.session.screen.mount(window)
             return
 
-        logs = ls.search_logs(find, limit, show_msdp=msdp)
+        try:
+            logs = ls.search_logs(find, limit, show_msdp=msdp)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
         logs = [(t, c, Text.from_ansi(l).markup) for t, c, l in logs]
 
         pview = AbacuraPropertyGroup({"Find": find, "Limit": limit, "MSDP": msdp}, title="Properties")
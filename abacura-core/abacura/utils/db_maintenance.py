@@ -0,0 +1,183 @@
+"""
+Background maintenance of WAL mode sqlite databases
+
+Databases that register here turn off sqlite's automatic checkpoint, which would otherwise run on
+whichever commit crosses the threshold, often on the UI thread.  A daemon thread instead runs a
+PASSIVE wal_checkpoint and PRAGMA optimize on its own connection once the session has been idle,
+plus a bounded ANALYZE every few hours.  A WAL file that grows past wal_limit is checkpointed PASSIVE
+even if the session never goes quiet, and with TRUNCATE to give the space back once it does, retried
+no more than every wal_retry_seconds while readers keep it from being truncated.
+"""
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from textual import log
+
+
+@dataclass
+class DatabaseStats:
+    name: str
+    filename: str
+    maintenance_runs: int = 0
+    checkpoints: int = 0
+    checkpoints_busy: int = 0
+    truncations: int = 0
+    wal_bytes: int = 0
+    wal_frames: int = 0
+    frames_checkpointed: int = 0
+    last_checkpoint_ms: float = 0
+    max_checkpoint_ms: float = 0
+    analyzes: int = 0
+    last_analyze_ms: float = 0
+    last_run: float = 0
+    last_analyze: float = 0
+    errors: int = 0
+    last_error: str = ''
+
+    @property
+    def current_wal_bytes(self) -> int:
+        try:
+            return os.path.getsize(self.filename + "-wal")
+        except OSError:
+            return 0
+
+
+class DatabaseMaintenance:
+    """Checkpoint, optimize and analyze registered databases on a daemon thread at idle times"""
+
+    def __init__(self, interval: float = 30, idle_seconds: float = 2, analyze_interval: float = 6 * 3600,
+                 wal_limit: int = 16 * 1024 * 1024, analysis_limit: int = 1000, wal_retry_seconds: float = 10):
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.analyze_interval = analyze_interval
+        self.wal_limit = wal_limit
+        self.wal_retry_seconds = wal_retry_seconds
+        self.analysis_limit = analysis_limit
+        self.databases: Dict[str, DatabaseStats] = {}
+        self.last_activity: float = time.monotonic()
+        self._connections: Dict[str, sqlite3.Connection] = {}
+        self._force: bool = False
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, filename: Union[str, Path], conn: Optional[sqlite3.Connection] = None,
+                 name: str = '') -> Optional[DatabaseStats]:
+        """
+        Maintain the database in filename, turning off automatic checkpoints on conn if given
+
+        In-memory databases are ignored.  Registering the same file again returns its existing stats.
+        """
+        if not filename or str(filename) == ':memory:':
+            return None
+
+        filename = str(Path(filename).expanduser().resolve())
+        if conn is not None:
+            conn.execute("PRAGMA wal_autocheckpoint=0")
+
+        with self._condition:
+            if filename not in self.databases:
+                # the first ANALYZE waits for analyze_interval like the rest, rather than running at startup
+                self.databases[filename] = DatabaseStats(name or Path(filename).name, filename,
+                                                         last_analyze=time.monotonic())
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="abacura-db-maintenance", daemon=True)
+                self._thread.start()
+
+            return self.databases[filename]
+
+    def note_activity(self):
+        """Called for session activity, maintenance waits until there has been none for idle_seconds"""
+        self.last_activity = time.monotonic()
+
+    def run_now(self):
+        """Maintain every database on the next pass, whether or not the session is idle"""
+        with self._condition:
+            self._force = True
+            self._condition.notify()
+
+    def _idle(self, now: float) -> bool:
+        return now - self.last_activity >= self.idle_seconds
+
+    def _due(self, stats: DatabaseStats, now: float, force: bool) -> bool:
+        if force:
+            return True
+
+        # a large WAL is truncated as soon as the session is idle, and checkpointed every interval until then,
+        # a truncate that readers kept from finishing is tried again after wal_retry_seconds
+        idle = self._idle(now)
+        if stats.current_wal_bytes >= self.wal_limit:
+            return now - stats.last_run >= (min(self.wal_retry_seconds, self.interval) if idle else self.interval)
+
+        return now - stats.last_run >= self.interval and idle
+
+    def _connection(self, stats: DatabaseStats) -> sqlite3.Connection:
+        conn = self._connections.get(stats.filename)
+        if conn is None:
+            conn = sqlite3.connect(stats.filename, timeout=1, isolation_level=None)
+            conn.execute(f"PRAGMA analysis_limit={int(self.analysis_limit)}")
+            self._connections[stats.filename] = conn
+
+        return conn
+
+    def maintain(self, stats: DatabaseStats, idle: bool = True):
+        """
+        Checkpoint and optimize one database, and analyze it if analyze_interval has passed
+
+        While the session is active, only a PASSIVE checkpoint is run, which never waits on readers or writers.
+        """
+        now = time.monotonic()
+        stats.last_run = now
+        stats.maintenance_runs += 1
+
+        try:
+            conn = self._connection(stats)
+
+            stats.wal_bytes = stats.current_wal_bytes
+            mode = "TRUNCATE" if idle and stats.wal_bytes >= self.wal_limit else "PASSIVE"
+            start = time.perf_counter()
+            busy, frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+            stats.last_checkpoint_ms = (time.perf_counter() - start) * 1000
+            stats.max_checkpoint_ms = max(stats.max_checkpoint_ms, stats.last_checkpoint_ms)
+            stats.checkpoints += 1
+            stats.checkpoints_busy += busy
+            stats.truncations += mode == "TRUNCATE" and not busy
+            stats.wal_frames = frames
+            stats.frames_checkpointed = checkpointed
+
+            if not idle:
+                return
+
+            if now - stats.last_analyze >= self.analyze_interval:
+                start = time.perf_counter()
+                conn.execute("ANALYZE")
+                stats.last_analyze_ms = (time.perf_counter() - start) * 1000
+                stats.last_analyze = now
+                stats.analyzes += 1
+            else:
+                conn.execute("PRAGMA optimize")
+
+        except sqlite3.Error as exc:
+            stats.errors += 1
+            stats.last_error = repr(exc)
+            log.error(f"Unable to maintain {stats.filename}: {exc!r}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait(1)
+                force, self._force = self._force, False
+                databases = list(self.databases.values())
+
+            now = time.monotonic()
+            for stats in databases:
+                if self._due(stats, now, force):
+                    self.maintain(stats, idle=force or self._idle(now))
+
+
+db_maintenance = DatabaseMaintenance()
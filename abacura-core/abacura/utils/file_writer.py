@@ -0,0 +1,120 @@
+"""
+Write-behind file persistence
+
+Callers hand over a serializer for a snapshot of their data and return immediately.
+A background thread waits for a quiet period before writing, so a burst of updates
+to the same file results in a single write, though never for more than max_wait after
+the first of them.  Files are replaced atomically.
+"""
+import atexit
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Tuple, Union
+
+from textual import log
+
+
+def atomic_write(path: Union[str, Path], text: Union[str, bytes], encoding: str = "UTF-8"):
+    """Write text (or bytes) to a temporary file next to path and rename it over the original"""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        binary = isinstance(text, bytes)
+        with os.fdopen(fd, "wb" if binary else "w", encoding=None if binary else encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+class DebouncedFileWriter:
+    """Coalesce writes per file and perform them on a daemon thread"""
+
+    def __init__(self, delay: float = 0.5, max_wait: float = 5):
+        self.delay = delay
+        self.max_wait = max_wait
+        # (when to write, when first scheduled, serializer) for each path
+        self.pending: Dict[Path, Tuple[float, float, Callable[[], str]]] = {}
+        self.files_written: int = 0
+        self.writes_coalesced: int = 0
+        self._condition = threading.Condition()
+        self._writing = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def schedule(self, path: Union[str, Path], serializer: Callable[[], str]):
+        """
+        Schedule path to be written with the output of serializer
+
+        The serializer runs on the writer thread, so it must only reference a snapshot of the data.
+        A newer schedule for the same path replaces the older one and restarts the delay, but the write
+        is not put off for more than max_wait after the path was first scheduled.
+        """
+        path = Path(path)
+        now = time.monotonic()
+        with self._condition:
+            first_scheduled = now
+            if path in self.pending:
+                self.writes_coalesced += 1
+                first_scheduled = self.pending[path][1]
+
+            self.pending[path] = (min(now + self.delay, first_scheduled + self.max_wait), first_scheduled, serializer)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="abacura-file-writer", daemon=True)
+                self._thread.start()
+
+            self._condition.notify()
+
+    def flush(self):
+        """Write all pending files immediately on the calling thread"""
+        with self._writing:
+            with self._condition:
+                pending, self.pending = self.pending, {}
+
+            for path, (_, _, serializer) in pending.items():
+                self._write(path, serializer)
+
+    def _write(self, path: Path, serializer: Callable[[], str]):
+        try:
+            atomic_write(path, serializer())
+            self.files_written += 1
+        except Exception as exc:
+            log.error(f"Unable to write {path}: {exc!r}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self.pending:
+                        self._condition.wait()
+                        continue
+
+                    wait_time = min(v[0] for v in self.pending.values()) - time.monotonic()
+                    if wait_time <= 0:
+                        break
+
+                    self._condition.wait(wait_time)
+
+            # flush() may have written everything while we were waiting for the lock
+            with self._writing:
+                with self._condition:
+                    now = time.monotonic()
+                    due = {p: v for p, v in self.pending.items() if v[0] <= now}
+                    for path in due:
+                        del self.pending[path]
+
+                for path, (_, _, serializer) in due.items():
+                    self._write(path, serializer)
+
+
+file_writer = DebouncedFileWriter()
+atexit.register(file_writer.flush)
@@ -1,39 +1,232 @@
+import atexit
+import contextlib
+import re
 import sqlite3
+import threading
+from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
 from abacura.mud import OutputMessage
-from typing import Callable, Optional
+from abacura.utils.db_maintenance import db_maintenance
+from typing import Callable, Iterator, List, Optional, Tuple
 import time
 
+from textual import log as textual_log
+
+# LIKE wildcards split a pattern into literal fragments that FTS can look for
+re_like_wildcards = re.compile(r'[%_]+')
+
+
+@lru_cache(maxsize=32)
+def _compile_regexp(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+def sql_regexp(pattern: str, value: Optional[str]) -> bool:
+    """Implementation of the sqlite REGEXP operator, X REGEXP Y calls regexp(Y, X)"""
+    return value is not None and _compile_regexp(pattern).search(value) is not None
+
+
+@dataclass
+class RingLogPartition:
+    """An append-only table holding a contiguous range of ring numbers"""
+    partition_id: int
+    first_ring_number: int
+    start_ns: int
+    end_ns: int
+
+    @property
+    def table(self) -> str:
+        return f"ring_log_p{self.partition_id}"
+
 
 class RingBufferLogSql:
+    """
+    Ring of the most recent output lines in sqlite
+
+    log() only queues the row; a writer thread inserts queued rows in batches of up to batch_size,
+    waiting at most batch_interval seconds for a batch to fill.  Rows are dropped (and counted)
+    if more than max_pending are waiting, so a slow disk never blocks the caller.
+
+    Rows are appended to partition tables, each holding up to partition_rows rows (a tenth of the ring by
+    default) from at most partition_seconds.  Once there are max_partitions partitions, new partitions only
+    start by row count, so a quiet session does not pile up hourly partitions.  Retention drops whole
+    partitions, the oldest first, once the newer partitions hold ring_size rows, the partition is older than
+    retention_seconds (if set), or there are more than max_partitions.
+    ring_number increases forever and orders the log.
+
+    Queries read the partitions they need directly, max_partitions keeps a grouped query over all of them
+    below sqlite's limit on compound selects.
+
+    Checkpoints of the WAL are left to db_maintenance.
+
+    With fts, each partition has a trigram FTS5 index over the stripped text, used to narrow down LIKE searches.
+
+    Searches of a file database read on a connection of their own thread, which WAL lets read alongside the
+    writer, so a long scan holds up neither the writer nor searches on other threads.
+    """
     def __init__(self, db_filename: str = ':memory:', ring_size: int = 10000,
-                 wal: bool = True, commit_interval: int = 10):
+                 wal: bool = True, batch_size: int = 500, batch_interval: float = 0.1, max_pending: int = 20000,
+                 fts: bool = False, partition_rows: int = 0, partition_seconds: int = 3600,
+                 retention_seconds: int = 0, max_partitions: int = 100):
 
         self.db_filename = db_filename
         self.ring_size = ring_size
-        self.commit_interval = commit_interval
-        self.conn = sqlite3.connect(db_filename)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_pending = max_pending
+        self.fts = fts
+        self.partition_rows = partition_rows or max(1, ring_size // 10)
+        self.partition_ns = partition_seconds * 1_000_000_000
+        self.retention_ns = retention_seconds * 1_000_000_000
+        self.max_partitions = max(2, max_partitions)
+        self.conn = sqlite3.connect(db_filename, check_same_thread=False)
+        self.conn.create_function("regexp", 2, sql_regexp, deterministic=True)
         self.rows_logged = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.batches_written = 0
+        self.partitions_dropped = 0
         self.log_context_provider: Optional[Callable] = None
 
+        self.pending: List[Tuple] = []
+        self._condition = threading.Condition()
+        # Held while using the connection, writes happen while holding it so flush() sees every row
+        self._db_lock = threading.Lock()
+        self._readers = threading.local()
+
         if wal:
             self.conn.execute("PRAGMA journal_mode=WAL")
+            db_maintenance.register(db_filename, self.conn)
 
-        # sql = "drop table if exists ring_log"
-        # self.conn.execute(sql)
-        sql = "create table if not exists ring_log(ring_number not null primary key, epoch_ns, context, message, stripped)"
-        self.conn.execute(sql)
-        self.conn.execute("create index if not exists ring_log_n1 on ring_log(epoch_ns)")
-
+        self.conn.execute("""create table if not exists ring_log_partitions(partition_id integer primary key,
+                                                                            first_ring_number, start_ns, end_ns)""")
+        self.partitions: List[RingLogPartition] = self.load_partitions()
         self.ring_number = self.get_current_ring_number()
+        self.migrate_ring_log()
+        with self.conn:
+            self.apply_retention(self.ring_number, time.time_ns())
+
+        self._thread = threading.Thread(target=self._run, name="abacura-ring-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def load_partitions(self) -> List[RingLogPartition]:
+        sql = "select partition_id, first_ring_number, start_ns, end_ns from ring_log_partitions order by 1"
+        partitions = [RingLogPartition(*row) for row in self.conn.execute(sql)]
+
+        for partition in partitions:
+            has_fts = self.conn.execute("select 1 from sqlite_master where name = ?",
+                                        (partition.table + "_fts",)).fetchone()
+            if self.fts and not has_fts:
+                self.create_partition_fts(partition)
+                self.conn.execute(f"insert into {partition.table}_fts({partition.table}_fts) values ('rebuild')")
+            elif has_fts and not self.fts:
+                # Without the trigger an existing index would go stale
+                self.conn.execute(f"drop trigger if exists {partition.table}_fts_ai")
+                self.conn.execute(f"drop table {partition.table}_fts")
+
+        self.conn.commit()
+        return partitions
+
+    def get_current_ring_number(self) -> int:
+        if not self.partitions:
+            return 0
+
+        sql = f"select ifnull(max(ring_number), ?) from {self.partitions[-1].table}"
+        return self.conn.execute(sql, (self.partitions[-1].first_ring_number - 1,)).fetchone()[0] + 1
+
+    def migrate_ring_log(self):
+        """Move rows from the single ring_log table used before partitioning"""
+        if not self.conn.execute("select 1 from sqlite_master where type = 'table' and name = 'ring_log'").fetchone():
+            return
+
+        cursor = self.conn.execute("select epoch_ns, context, message, stripped from ring_log order by epoch_ns")
+        while rows := cursor.fetchmany(10000):
+            numbered = [(self.ring_number + i, *row) for i, row in enumerate(rows)]
+            self.ring_number += len(rows)
+            with self.conn:
+                self._insert_rows(numbered)
+
+        self.conn.executescript("""
+            drop trigger if exists ring_log_fts_ai;
+            drop trigger if exists ring_log_fts_ad;
+            drop table if exists ring_log_fts;
+            drop table ring_log;
+        """)
+
+    def create_partition_fts(self, partition: RingLogPartition):
+        t = partition.table
+        self.conn.execute(f"""create virtual table {t}_fts
+                                 using fts5(stripped, content='{t}', content_rowid='ring_number', tokenize='trigram')""")
+        self.conn.execute(f"""create trigger {t}_fts_ai after insert on {t} begin
+                                  insert into {t}_fts(rowid, stripped) values (new.ring_number, new.stripped);
+                              end""")
+
+    def create_partition(self, first_ring_number: int, start_ns: int) -> RingLogPartition:
+        partition_id = self.partitions[-1].partition_id + 1 if self.partitions else 1
+        partition = RingLogPartition(partition_id, first_ring_number, start_ns, start_ns)
+        self.conn.execute(f"""create table {partition.table}(ring_number integer primary key,
+                                                             epoch_ns, context, message, stripped)""")
+        if self.fts:
+            self.create_partition_fts(partition)
+
+        self.partitions.append(partition)
+        return partition
+
+    def drop_partition(self, partition: RingLogPartition):
+        self.conn.execute(f"drop table if exists {partition.table}_fts")
+        self.conn.execute(f"drop table {partition.table}")
+        self.conn.execute("delete from ring_log_partitions where partition_id = ?", (partition.partition_id,))
+        self.partitions.remove(partition)
+        self.partitions_dropped += 1
+
+    def _insert_rows(self, rows: List[Tuple]):
+        """Append rows to the current partition, starting new partitions as needed, and apply retention"""
+        # caller must hold _db_lock and be inside a transaction
+        start = 0
+        while start < len(rows):
+            ring_number, epoch_ns = rows[start][0], rows[start][1]
+            current = self.partitions[-1] if self.partitions else None
+            by_time = len(self.partitions) < self.max_partitions
+            if (current is None or ring_number - current.first_ring_number >= self.partition_rows
+                    or by_time and epoch_ns - current.start_ns >= self.partition_ns):
+                current = self.create_partition(ring_number, epoch_ns)
+                by_time = len(self.partitions) < self.max_partitions
+
+            end = min(len(rows), start + self.partition_rows - (ring_number - current.first_ring_number))
+            # rows from a later partition period start a new partition
+            while by_time and end > start + 1 and rows[end - 1][1] - current.start_ns >= self.partition_ns:
+                end -= 1
+
+            self.conn.executemany(f"insert into {current.table} values(?, ?, ?, ?, ?)", rows[start:end])
+            current.end_ns = max(current.end_ns, rows[end - 1][1])
+            self.conn.execute("insert or replace into ring_log_partitions values(?, ?, ?, ?)",
+                              (current.partition_id, current.first_ring_number, current.start_ns, current.end_ns))
+            start = end
+
+        self.apply_retention(rows[-1][0] + 1, rows[-1][1])
 
-    def get_current_ring_number(self):
-        sql = """select ifnull(max(ring_number), 0) 
-                   from ring_log 
-                  where epoch_ns = (select max(epoch_ns) from ring_log)"""
-        cur = self.conn.execute(sql)
-        rows = cur.fetchall()
-        return rows[0][0] if len(rows) else 0
+    def apply_retention(self, next_ring_number: int, now_ns: int):
+        while len(self.partitions) > 1:
+            oldest = self.partitions[0]
+            newer_rows = next_ring_number - self.partitions[1].first_ring_number
+            expired = self.retention_ns and oldest.end_ns < now_ns - self.retention_ns
+            if newer_rows < self.ring_size and not expired and len(self.partitions) <= self.max_partitions:
+                break
+
+            self.drop_partition(oldest)
+
+    @staticmethod
+    def fts_match_for_like(like: str) -> str:
+        """
+        Convert a LIKE pattern into an FTS5 query that every matching row also matches
+
+        Returns '' when no literal fragment is long enough for the trigram index, LIKE alone must be used then.
+        """
+        fragments = [f for f in re_like_wildcards.split(like) if len(f) >= 3]
+        return " AND ".join('"%s"' % f.replace('"', '""') for f in fragments)
 
     def set_log_context_provider(self, context_provider: Optional[Callable]):
         # Pass a function to use to provide additional logging context
@@ -51,46 +244,193 @@ class RingBufferLogSql:
             log_context = ''
 
         values = (self.ring_number, log_epoch_ns, log_context, message.message, message.stripped)
-        self.conn.execute("insert or replace into ring_log values(?, ?, ?, ?, ?)", values)
 
-        self.ring_number = (self.ring_number + 1) % self.ring_size
+        with self._condition:
+            if len(self.pending) >= self.max_pending:
+                self.rows_dropped += 1
+                return
 
+            self.pending.append(values)
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self._condition.notify()
+
+        self.ring_number += 1
         self.rows_logged += 1
-        if self.rows_logged % self.commit_interval == 0:
-            self.conn.commit()
+
+    def _write_pending(self):
+        # caller must hold _db_lock
+        with self._condition:
+            rows, self.pending = self.pending, []
+
+        if not rows:
+            return
+
+        try:
+            with self.conn:
+                self._insert_rows(rows)
+            self.rows_written += len(rows)
+            self.batches_written += 1
+        except sqlite3.Error as exc:
+            self.rows_dropped += len(rows)
+            textual_log.error(f"Unable to write {len(rows)} ring log rows: {exc!r}")
+            # the rollback undid any partitions created or dropped for these rows
+            self.partitions = self.load_partitions()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self.pending:
+                    self._condition.wait()
+
+                deadline = time.monotonic() + self.batch_interval
+                while len(self.pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+            with self._db_lock:
+                self._write_pending()
+
+    def flush(self):
+        """Write all queued rows now on the calling thread"""
+        with self._db_lock:
+            self._write_pending()
+
+    def _read_connection(self) -> Optional[sqlite3.Connection]:
+        """Return a read only connection for the calling thread, or None for an in memory database"""
+        if self.db_filename == ':memory:':
+            return None
+
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            uri = Path(self.db_filename).absolute().as_uri() + "?mode=ro"
+            conn = self._readers.conn = sqlite3.connect(uri, uri=True)
+            conn.create_function("regexp", 2, sql_regexp, deterministic=True)
+
+        return conn
+
+    def select_rows(self, like: str = '%', clause: str = '', clause_params: tuple = (), limit: int = 100,
+                    epoch_start: int = 0, before: Optional[Tuple[int, int]] = None, epoch_end: int = 0,
+                    cancelled: Optional[Callable[[], bool]] = None) -> List[Tuple]:
+        """
+        Return up to limit (message, ring_number, epoch_ns, context) rows, newest first
+
+        clause is extra sql starting with 'and' using clause_params for its placeholders.
+        Pass the (epoch_ns, ring_number) of the last row returned as before to fetch the next page.
+        Only partitions overlapping epoch_start to epoch_end are read.
+        A scan is interrupted with sqlite3.OperationalError once cancelled returns True.
+        """
+        if before is not None:
+            clause = " and ring_number < ?" + clause
+            clause_params = (before[1],) + tuple(clause_params)
+
+        if epoch_end:
+            clause = " and epoch_ns <= ?" + clause
+            clause_params = (epoch_end,) + tuple(clause_params)
+
+        match = self.fts_match_for_like(like) if self.fts else ''
+
+        reader = self._read_connection()
+        with self._db_lock:
+            self._write_pending()
+            partitions = list(self.relevant_partitions(epoch_start, epoch_end, before))
+
+        results = []
+        with self._db_lock if reader is None else contextlib.nullcontext():
+            conn = reader or self.conn
+            if cancelled is not None:
+                conn.set_progress_handler(cancelled, 10000)
+
+            try:
+                for partition in partitions:
+                    t = partition.table
+                    if match:
+                        sql = f"""select message, ring_number, epoch_ns, context
+                                    from (select rowid as fts_rowid from {t}_fts where {t}_fts match ?)
+                                    join {t} on ring_number = fts_rowid
+                                   where stripped like ?
+                                     and epoch_ns > ?
+                                         {clause}
+                                   order by fts_rowid desc
+                                   limit ?"""
+                        params = (match, like, epoch_start, *clause_params, limit - len(results))
+                    else:
+                        sql = f"""select message, ring_number, epoch_ns, context
+                                    from {t}
+                                   where stripped like ?
+                                     and epoch_ns > ?
+                                         {clause}
+                                   order by ring_number desc
+                                   limit ?"""
+                        params = (like, epoch_start, *clause_params, limit - len(results))
+
+                    try:
+                        results += conn.execute(sql, params).fetchall()
+                    except sqlite3.OperationalError as exc:
+                        # dropped by retention, or not committed yet, since the partitions were listed
+                        if "no such table" not in str(exc):
+                            raise
+
+                    if len(results) >= limit:
+                        break
+            finally:
+                if cancelled is not None:
+                    conn.set_progress_handler(None, 0)
+
+        return results
+
+    def relevant_partitions(self, epoch_start: int = 0, epoch_end: int = 0,
+                            before: Optional[Tuple[int, int]] = None) -> Iterator[RingLogPartition]:
+        """Partitions that may hold rows in the time range and before the keyset position, newest first"""
+        for partition in reversed(self.partitions):
+            if epoch_start and partition.end_ns <= epoch_start:
+                return
+
+            if epoch_end and partition.start_ns > epoch_end:
+                continue
+
+            if before is not None and partition.first_ring_number >= before[1]:
+                continue
+
+            yield partition
+
+    @staticmethod
+    def format_epoch(ns: int) -> str:
+        dt: datetime = datetime.fromtimestamp(ns / 1e9)
+        return dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
 
     def query(self, like: str = '', clause: str = '', limit: int = 100, epoch_start: int = 0, grouped: bool = False):
-        select = "message, ring_number, epoch_ns, context"
-        group_by = ""
         if grouped:
-            select = "message, max(ring_number), max(epoch_ns), last_value(context) over (order by epoch_ns desc)"
-            group_by = "group by message"
-
-        sql = """select %s
-                   from ring_log
-                  where stripped like ?
-                    and epoch_ns > ? 
-                        %s 
-                        %s
-                  order by 3 desc 
-                  limit ? 
-              """ % (select, clause, group_by)
-        c = self.conn.execute(sql, (like, epoch_start, limit))
-        results = c.fetchall()
-
-        logs = []
-        for message, rb, ns, ctx in reversed(results):
-            dt: datetime = datetime.fromtimestamp(ns / 1e9)
-            dts = dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
-            logs.append((dts, ctx, message))
-
-        return logs
+            with self._db_lock:
+                self._write_pending()
+                tables = [p.table for p in self.relevant_partitions(epoch_start)]
+                if not tables:
+                    return []
+
+                ring_log = " union all ".join(f"select * from {t}" for t in tables)
+                sql = """select message, max(ring_number), max(epoch_ns), last_value(context) over (order by epoch_ns desc)
+                           from (%s)
+                          where stripped like ?
+                            and epoch_ns > ? 
+                                %s 
+                          group by message
+                          order by 3 desc 
+                          limit ? 
+                      """ % (ring_log, clause)
+                results = self.conn.execute(sql, (like, epoch_start, limit)).fetchall()
+        else:
+            results = self.select_rows(like, clause, limit=limit, epoch_start=epoch_start)
+
+        return [(self.format_epoch(ns), ctx, message) for message, rb, ns, ctx in reversed(results)]
 
     def commit(self):
-        self.conn.commit()
+        self.flush()
 
     def checkpoint(self, method: str = 'truncate'):
-        self.commit()
         if method.lower() not in ['truncate', 'passive', 'full', 'restart']:
             raise ValueError('Invalid checkpoint method %s' % method)
-        self.conn.execute("pragma wal_checkpoint(%s)" % method)
+
+        with self._db_lock:
+            self._write_pending()
+            self.conn.execute("pragma wal_checkpoint(%s)" % method)
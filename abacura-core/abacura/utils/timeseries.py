@@ -0,0 +1,143 @@
+"""
+Fixed size time series held in preallocated NumPy ring arrays
+
+Samples are (monotonic time, value) pairs.  Values only arrive when they change, so a value is
+treated as held until the next sample when computing windows and aggregates.
+"""
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class TimeSeries:
+    """Ring of the most recent samples for one variable"""
+
+    def __init__(self, capacity: int = 4096, dtype=np.int64):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=dtype)
+        self.samples: int = 0
+
+    def __len__(self) -> int:
+        return min(self.samples, self.capacity)
+
+    def append(self, value, when: Optional[float] = None):
+        i = self.samples % self.capacity
+        self.times[i] = time.monotonic() if when is None else when
+        self.values[i] = value
+        self.samples += 1
+
+    @property
+    def last(self):
+        if self.samples == 0:
+            return None
+
+        return self.values[(self.samples - 1) % self.capacity].item()
+
+    def _ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.samples <= self.capacity:
+            return self.times[:self.samples], self.values[:self.samples]
+
+        i = self.samples % self.capacity
+        return np.roll(self.times, -i), np.roll(self.values, -i)
+
+    def window(self, seconds: Optional[float] = None, now: Optional[float] = None,
+               hold: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return copies of (times, values) in time order, optionally limited to the last seconds
+
+        With hold, the sample in effect at the start of the window is included with its time
+        moved to the window start.
+        """
+        times, values = self._ordered()
+        if seconds is not None and len(times):
+            start_time = (time.monotonic() if now is None else now) - seconds
+            start = int(np.searchsorted(times, start_time, side='left'))
+            if hold and start > 0:
+                start -= 1
+                times, values = times[start:].copy(), values[start:].copy()
+                times[0] = start_time
+                return times, values
+
+            times, values = times[start:], values[start:]
+
+        return times.copy(), values.copy()
+
+    def minimum(self, seconds: Optional[float] = None, now: Optional[float] = None):
+        _, values = self.window(seconds, now)
+        return values.min().item() if len(values) else None
+
+    def maximum(self, seconds: Optional[float] = None, now: Optional[float] = None):
+        _, values = self.window(seconds, now)
+        return values.max().item() if len(values) else None
+
+    def rate(self, seconds: Optional[float] = None, now: Optional[float] = None) -> float:
+        """Average change per second over the window, with the last value held until now"""
+        now = time.monotonic() if now is None else now
+        times, values = self.window(seconds, now)
+        if len(values) == 0 or now <= times[0]:
+            return 0.0
+
+        return float(values[-1] - values[0]) / (now - times[0])
+
+    def ewma(self, halflife: float, now: Optional[float] = None) -> Optional[float]:
+        """Exponentially weighted average over time, each sample weighted by how long it was held"""
+        now = time.monotonic() if now is None else now
+        times, values = self.window(None, now)
+        if len(values) == 0:
+            return None
+
+        decay = math.log(2) / halflife
+        ends = np.append(times[1:], now)
+        weights = np.exp(-decay * (now - ends)) - np.exp(-decay * (now - times))
+        total = weights.sum()
+        if total <= 0:
+            return float(values[-1])
+
+        return float(np.dot(weights, values) / total)
+
+
+class TimeSeriesStore:
+    """Time series for each numeric variable that has been recorded"""
+
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.series: Dict[str, TimeSeries] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.series
+
+    def names(self) -> List[str]:
+        return sorted(self.series)
+
+    def get(self, name: str) -> Optional[TimeSeries]:
+        return self.series.get(name)
+
+    def record(self, name: str, value: str, when: Optional[float] = None) -> bool:
+        """Record value if it is an integer, returns True if it was recorded, other values are ignored"""
+        try:
+            number = int(value)
+        except ValueError:
+            return False
+
+        if not -2 ** 63 <= number < 2 ** 63:
+            return False
+
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = TimeSeries(self.capacity)
+
+        series.append(number, when)
+        return True
+
+    def query(self, name: str, seconds: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (seconds before now, values) for name, ready to pass to a Plot"""
+        series = self.series.get(name)
+        if series is None:
+            return np.zeros(0), np.zeros(0)
+
+        now = time.monotonic()
+        times, values = series.window(seconds, now)
+        return times - now, values
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of the MSDP decoder on GROUP and AFFECTS payloads as sent by Legends of Kallisti
+
+Compares the generic decoder with the split based parsers it replaced (minus their per-element logging),
+on the values alone and on whole SB payloads, which the old sb() split into name and value first.
+
+    python benchmarks/msdp_decode.py [iterations]
+"""
+import re
+import sys
+import timeit
+
+from abacura.mud.options.msdp import MSDP
+
+ansi_escape = re.compile(r'\x1b(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+
+def table(pairs) -> bytes:
+    return b'\x03' + b''.join(b'\x01' + k.encode() + b'\x02' + v.encode() for k, v in pairs) + b'\x04'
+
+
+def group_member(i: int) -> bytes:
+    return table([("name", f"\x1b[1;33mMember{i}\x1b[0m"), ("class", "Paladin"), ("level", str(40 + i)),
+                  ("position", "Standing"), ("flags", "Sanc" if i % 2 else ""), ("health", str(900 + i)),
+                  ("mana", "450"), ("stamina", "300"), ("is_leader", "1" if i == 0 else "0"),
+                  ("is_subleader", "0"), ("with_leader", "1"), ("with_you", "1")])
+
+
+GROUP = b'\x05' + b''.join(b'\x02' + group_member(i) for i in range(8)) + b'\x06'
+AFFECTS = table([(name, str(hours)) for hours, name in
+                 enumerate(["sanctuary", "armor", "bless", "haste", "stoneskin", "fly", "detect invisible",
+                            "infravision", "protection from evil", "divine armor", "regeneration", "blur"])])
+
+GROUP_SB = b'\x01GROUP\x02' + GROUP + b'\xff'
+AFFECTS_SB = b'\x01AFFECTS\x02' + AFFECTS + b'\xff'
+
+
+def legacy_parse_group(buf) -> list:
+    def parse_group_member(line) -> dict:
+        items = line.split(b'\x01')[1:]
+        member = {}
+        for item in items:
+            pair = item.split(b'\x02')
+            member[pair[0].decode("UTF-8")] = ansi_escape.sub('', pair[1].decode("UTF-8"))
+        return member
+
+    buf = buf[3:-2]
+    return [parse_group_member(element) for element in buf.split(b'\x04\x02\x03')]
+
+
+def legacy_parse_exits(buf) -> dict:
+    exits = {}
+    for item in buf[2:-1].split(b'\x01'):
+        pair = item.split(b'\x02')
+        exits[pair[0].decode("UTF-8")] = ansi_escape.sub('', pair[1].decode("UTF-8"))
+    return exits
+
+
+def legacy_sb(msdp: MSDP, sb: bytes, parser) -> tuple:
+    name, remainder = msdp.msdpvar(sb)
+    value, _ = msdp.msdpval(remainder)
+    return name.decode("UTF-8"), parser(value)
+
+
+def main(iterations: int = 20000):
+    msdp = MSDP(print, print, None)
+
+    assert msdp.parse_group(msdp.decode_value(GROUP)) == legacy_parse_group(GROUP)
+    assert msdp.parse_exits(msdp.decode_value(AFFECTS)) == legacy_parse_exits(AFFECTS)
+
+    cases = [("GROUP legacy", lambda: legacy_parse_group(GROUP)),
+             ("GROUP decoder", lambda: msdp.parse_group(msdp.decode_value(GROUP))),
+             ("AFFECTS legacy", lambda: legacy_parse_exits(AFFECTS)),
+             ("AFFECTS decoder", lambda: msdp.parse_exits(msdp.decode_value(AFFECTS))),
+             ("GROUP SB legacy", lambda: legacy_sb(msdp, GROUP_SB, legacy_parse_group)),
+             ("GROUP SB decode", lambda: msdp.decode(GROUP_SB)),
+             ("AFFECTS SB legacy", lambda: legacy_sb(msdp, AFFECTS_SB, legacy_parse_exits)),
+             ("AFFECTS SB decode", lambda: msdp.decode(AFFECTS_SB))]
+
+    print(f"GROUP payload {len(GROUP)} bytes, AFFECTS payload {len(AFFECTS)} bytes, {iterations} iterations")
+    for name, fn in cases:
+        elapsed = min(timeit.repeat(fn, number=iterations, repeat=3))
+        print(f"{name:18} {1e6 * elapsed / iterations:8.2f} us/payload")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
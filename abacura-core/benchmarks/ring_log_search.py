@@ -0,0 +1,66 @@
+"""
+Benchmark ring log searches with and without the FTS5 trigram index
+
+Fills a ring log file of the given ring size with one and a half times that many lines of synthetic
+mud output, so the ring wraps, then times reopening it and the searches the log window and kill
+tracking run, once with LIKE only and once narrowed by FTS.
+
+    python benchmarks/ring_log_search.py [ring_size] [directory]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from abacura.mud import OutputMessage
+from abacura.utils.ring_buffer import RingBufferLogSql
+
+MOBS = ["an orc warrior", "a goblin shaman", "the black dragon", "a cave troll", "a wild boar", "a town guard"]
+LINES = ["You hit {mob} hard.", "{mob} misses you.", "{mob} is dead!  R.I.P.",
+         "You receive your reward for the kill, {n} experience points.", "There were {n} coins.",
+         "{mob} arrives from the north.", "You gossip, 'anyone seen {mob}?'",
+         "!MSDP_HEALTH={n}", "!MSDP_ROOM_VNUM={n}", "Obvious exits: north south east"]
+
+SEARCHES = ["%dragon%", "%is dead!  R.I.P%", "%gossip%troll%", "%experience points%", "%zzzz%", "%rc%"]
+
+
+def fill(ring_buffer: RingBufferLogSql, rows: int):
+    rnd = random.Random(1)
+    for i in range(rows):
+        line = rnd.choice(LINES).format(mob=rnd.choice(MOBS), n=rnd.randint(1, 99999))
+        ring_buffer.log(OutputMessage(line))
+        if i % 50000 == 0:
+            ring_buffer.flush()
+    ring_buffer.flush()
+
+
+def run(rows: int, directory: str, fts: bool):
+    filename = os.path.join(directory, f"ring_bench_{'fts' if fts else 'like'}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(filename + suffix):
+            os.unlink(filename + suffix)
+
+    ring_buffer = RingBufferLogSql(filename, ring_size=rows, fts=fts, max_pending=rows * 2)
+    start = time.perf_counter()
+    fill(ring_buffer, rows * 3 // 2)
+    print(f"{'fts' if fts else 'like':5} fill {rows * 3 // 2} rows {time.perf_counter() - start:7.2f}s "
+          f"({os.path.getsize(filename) / 1e6:.0f} MB + wal)")
+
+    start = time.perf_counter()
+    ring_buffer = RingBufferLogSql(filename, ring_size=rows, fts=fts)
+    print(f"{'fts' if fts else 'like':5} reopen {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for like in SEARCHES:
+        start = time.perf_counter()
+        for _ in range(5):
+            results = ring_buffer.query(like, clause=" and stripped not like '!MSDP%'", limit=100)
+        elapsed = (time.perf_counter() - start) / 5
+        print(f"{'fts' if fts else 'like':5} {like:22} {len(results):4} rows {elapsed * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    bench_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory(dir=sys.argv[2] if len(sys.argv) > 2 else None) as tmp:
+        run(bench_rows, tmp, fts=False)
+        run(bench_rows, tmp, fts=True)
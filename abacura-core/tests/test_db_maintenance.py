@@ -0,0 +1,48 @@
+from abacura.utils.db_maintenance import DatabaseMaintenance, DatabaseStats
+
+
+def make_stats(tmp_path, wal_bytes: int) -> DatabaseStats:
+    filename = (tmp_path / "test.db").as_posix()
+    (tmp_path / "test.db-wal").write_bytes(b"\0" * wal_bytes)
+    return DatabaseStats("test.db", filename)
+
+
+def test_large_wal_is_retried_after_wal_retry_seconds_when_idle(tmp_path):
+    maintenance = DatabaseMaintenance(interval=30, idle_seconds=2, wal_limit=100, wal_retry_seconds=10)
+    stats = make_stats(tmp_path, 200)
+    maintenance.last_activity = 0
+    stats.last_run = 100
+
+    assert not maintenance._due(stats, 101, False)
+    assert not maintenance._due(stats, 109, False)
+    assert maintenance._due(stats, 110, False)
+
+
+def test_large_wal_is_checkpointed_every_interval_while_active(tmp_path):
+    maintenance = DatabaseMaintenance(interval=30, idle_seconds=2, wal_limit=100, wal_retry_seconds=10)
+    stats = make_stats(tmp_path, 200)
+    stats.last_run = 100
+    maintenance.last_activity = 119
+
+    assert not maintenance._due(stats, 120, False)
+    maintenance.last_activity = 129
+    assert maintenance._due(stats, 130, False)
+
+
+def test_small_wal_waits_for_interval_and_idle(tmp_path):
+    maintenance = DatabaseMaintenance(interval=30, idle_seconds=2, wal_limit=100)
+    stats = make_stats(tmp_path, 50)
+    stats.last_run = 100
+    maintenance.last_activity = 0
+
+    assert not maintenance._due(stats, 110, False)
+    assert maintenance._due(stats, 130, False)
+
+
+def test_first_analyze_waits_for_analyze_interval(tmp_path):
+    maintenance = DatabaseMaintenance()
+    stats = maintenance.register(tmp_path / "test.db")
+    maintenance.maintain(stats)
+
+    assert stats.analyzes == 0
+    assert stats.errors == 0
@@ -0,0 +1,37 @@
+import time
+
+from abacura.utils.file_writer import DebouncedFileWriter
+
+
+def test_repeated_schedules_are_coalesced(tmp_path):
+    writer = DebouncedFileWriter(delay=0.05)
+    path = tmp_path / "out.txt"
+    for i in range(10):
+        writer.schedule(path, lambda i=i: f"{i}")
+
+    time.sleep(0.3)
+    assert path.read_text() == "9"
+    assert writer.files_written == 1
+    assert writer.writes_coalesced == 9
+
+
+def test_pending_write_is_not_put_off_past_max_wait(tmp_path):
+    writer = DebouncedFileWriter(delay=0.2, max_wait=0.3)
+    path = tmp_path / "out.txt"
+    start = time.monotonic()
+    while not path.exists() and time.monotonic() - start < 2:
+        writer.schedule(path, lambda: "data")
+        time.sleep(0.02)
+
+    assert path.exists()
+    assert time.monotonic() - start < 1
+
+
+def test_flush_writes_pending_files(tmp_path):
+    writer = DebouncedFileWriter(delay=60)
+    path = tmp_path / "out.txt"
+    writer.schedule(path, lambda: "data")
+    writer.flush()
+
+    assert path.read_text() == "data"
+    assert writer.pending == {}
@@ -0,0 +1,57 @@
+from abacura.utils.ring_buffer import RingBufferLogSql
+
+HOUR_NS = 3600 * 1_000_000_000
+
+
+def write_batch(ring_buffer: RingBufferLogSql, epoch_ns: int, count: int):
+    rows = [(ring_buffer.ring_number + i, epoch_ns + i, '', f"line {ring_buffer.ring_number + i}",
+             f"line {ring_buffer.ring_number + i}") for i in range(count)]
+    ring_buffer.ring_number += count
+    with ring_buffer._condition:
+        ring_buffer.pending += rows
+    ring_buffer.flush()
+
+
+def test_quiet_session_caps_hourly_partitions(tmp_path):
+    ring_buffer = RingBufferLogSql((tmp_path / "ring.db").as_posix(), ring_size=1_000_000)
+
+    for hour in range(600):
+        write_batch(ring_buffer, (hour + 1) * HOUR_NS, 20)
+
+    assert ring_buffer.rows_dropped == 0
+    assert ring_buffer.rows_written == 12000
+    assert len(ring_buffer.partitions) <= ring_buffer.max_partitions
+
+    tables = ring_buffer.conn.execute("select count(*) from sqlite_master "
+                                      "where type = 'table' and name glob 'ring_log_p[0-9]*'").fetchone()[0]
+    assert tables == len(ring_buffer.partitions)
+
+    # nothing was dropped by retention, the ring is far from full
+    assert ring_buffer.partitions_dropped == 0
+    assert len(ring_buffer.query(like='%', limit=12000)) == 12000
+    assert len(ring_buffer.query(like='line 1199_', grouped=True)) == 10
+
+
+def test_too_many_partitions_are_dropped_on_open(tmp_path):
+    filename = (tmp_path / "ring.db").as_posix()
+    ring_buffer = RingBufferLogSql(filename, ring_size=1_000_000, max_partitions=600)
+    for hour in range(550):
+        write_batch(ring_buffer, (hour + 1) * HOUR_NS, 2)
+    assert len(ring_buffer.partitions) == 550
+    ring_buffer.conn.close()
+
+    ring_buffer = RingBufferLogSql(filename, ring_size=1_000_000)
+    assert len(ring_buffer.partitions) == ring_buffer.max_partitions
+    assert ring_buffer.query(like='%', grouped=True, limit=1)[0][2] == "line 1099"
+
+
+def test_failed_write_keeps_partitions_in_step(tmp_path):
+    ring_buffer = RingBufferLogSql((tmp_path / "ring.db").as_posix(), ring_size=100, partition_rows=10)
+    write_batch(ring_buffer, HOUR_NS, 10)
+    ring_buffer.conn.execute("create table ring_log_p2(x)")
+    ring_buffer.conn.commit()
+
+    write_batch(ring_buffer, HOUR_NS, 5)
+
+    assert ring_buffer.rows_dropped == 5
+    assert [p.partition_id for p in ring_buffer.partitions] == [1]
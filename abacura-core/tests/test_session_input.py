@@ -0,0 +1,39 @@
+import re
+from types import SimpleNamespace
+
+from abacura.mud.session import Session, input_token_pattern, speedwalk_pattern, speedwalk_step_pattern
+
+
+def make_session() -> Session:
+    session = Session.__new__(Session)
+    session.connected = True
+    session.command_char = "#"
+    session.speedwalk_re = re.compile(speedwalk_pattern)
+    session.speedwalk_step_re = re.compile(speedwalk_step_pattern)
+    session.input_token_re = re.compile(input_token_pattern, re.DOTALL)
+    session.director = SimpleNamespace(alias_manager=SimpleNamespace(get_alias_by_command=lambda cmd: None))
+    session.sent = []
+    session.send = lambda msg, echo_color="orange1": session.sent.append(msg)
+    session.echo_command = lambda cmd, color="white": None
+    return session
+
+
+def test_speedwalk_sends_steps_in_one_write():
+    session = make_session()
+    session.player_input("2n3e")
+
+    assert session.sent == ["n\nn\ne\ne\ne\n"]
+
+
+def test_empty_speedwalk_sends_nothing():
+    session = make_session()
+    session.player_input("0n;0e")
+
+    assert session.sent == []
+
+
+def test_empty_speedwalk_does_not_stop_later_commands():
+    session = make_session()
+    session.player_input("0n;look")
+
+    assert session.sent == ["look\n"]
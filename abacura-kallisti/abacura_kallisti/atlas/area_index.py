@@ -0,0 +1,210 @@
+"""
+Rooms by area, and which rooms of an area tour can reach each other
+
+A tour of an area may enter the rooms in its vnum ranges that belong to it or the areas it includes, less those
+excluded at the character's level, and takes unlocked exits between them.  Those rooms and exits are grouped
+into strongly connected components, rooms that can all reach each other, so the rooms reachable from a room
+are those of the components below its own.  The components are kept until one of their rooms changes its
+exits or area, or a room joins or leaves the areas they cover, and the rooms of each area are kept up to date.
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set
+
+from .room import Area
+from .wilderness_layer import WILDERNESS_AREA
+
+
+class AreaComponents:
+    """The rooms a tour may enter and the exits between them, grouped into strongly connected components"""
+
+    def __init__(self, rooms, nodes: Set[str], areas: Set[str], consider_locks_reachable: bool = False):
+        self.rooms = rooms
+        self.nodes = nodes
+        self.areas = areas
+        self.consider_locks_reachable = consider_locks_reachable
+        self.neighbours: Dict[str, List[str]] = {vnum: self._exits_to_nodes(vnum) for vnum in nodes}
+
+        self.component: Dict[str, int] = {}
+        self.members: List[List[str]] = []
+        # components each component has exits to
+        self.below: List[Set[int]] = []
+        self._find_components()
+
+    def next_rooms(self, vnum: str) -> List[str]:
+        """Return the rooms of the tour that exits from vnum lead to"""
+        neighbours = self.neighbours.get(vnum)
+        return neighbours if neighbours is not None else self._exits_to_nodes(vnum)
+
+    def _exits_to_nodes(self, vnum: str) -> List[str]:
+        room = self.rooms.get(vnum)
+        if room is None:
+            return []
+
+        return [e.to_vnum for e in room.exits.values()
+                if e.to_vnum in self.nodes and (self.consider_locks_reachable or not e.locks)]
+
+    def _find_components(self):
+        """Tarjan's algorithm, without recursion since one way paths through an area can be long"""
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+
+        for root in self.neighbours:
+            if root in index:
+                continue
+
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.neighbours[root]))]
+
+            while work:
+                vnum, to_vnums = work[-1]
+                for to_vnum in to_vnums:
+                    if to_vnum not in index:
+                        index[to_vnum] = low[to_vnum] = len(index)
+                        stack.append(to_vnum)
+                        on_stack.add(to_vnum)
+                        work.append((to_vnum, iter(self.neighbours[to_vnum])))
+                        break
+
+                    if to_vnum in on_stack:
+                        low[vnum] = min(low[vnum], index[to_vnum])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[vnum])
+
+                    if low[vnum] == index[vnum]:
+                        members = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            self.component[member] = len(self.members)
+                            members.append(member)
+                            if member == vnum:
+                                break
+
+                        self.members.append(members)
+
+        for c, members in enumerate(self.members):
+            below = {self.component[to_vnum] for vnum in members for to_vnum in self.neighbours[vnum]}
+            below.discard(c)
+            self.below.append(below)
+
+    def unchanged(self, vnum: str, area_name: str) -> bool:
+        """Return True if vnum is still a room of the tour in area_name with the same exits to its rooms"""
+        return (vnum in self.nodes and area_name in self.areas
+                and self._exits_to_nodes(vnum) == self.neighbours[vnum])
+
+    def reachable(self, vnum: str) -> Set[str]:
+        """Return the rooms of the tour that can be reached from vnum, and vnum itself"""
+        if vnum in self.component:
+            todo = [self.component[vnum]]
+        else:
+            todo = list({self.component[to_vnum] for to_vnum in self.next_rooms(vnum)})
+
+        seen = set(todo)
+        found = {vnum}
+        while todo:
+            c = todo.pop()
+            found.update(self.members[c])
+            for below in self.below[c]:
+                if below not in seen:
+                    seen.add(below)
+                    todo.append(below)
+
+        return found
+
+
+class AreaIndex:
+    """Rooms by area, and the components of area tours, kept up to date as rooms are saved and deleted"""
+
+    def __init__(self, world):
+        self.world = world
+        self.rooms_by_area: Dict[str, Set[str]] = defaultdict(set)
+        self._area_of: Dict[str, str] = {}
+        self._components: Dict[tuple, AreaComponents] = {}
+        self._room_count: int = -1
+        self.builds: int = 0
+        # tours find their steps on worker threads, see TourGuide.get_next_step_async()
+        self._lock = threading.RLock()
+
+    def room_changed(self, vnum: str):
+        """Called when a room is saved or deleted, to move it between areas and drop the components it changes"""
+        with self._lock:
+            if self._room_count < 0:
+                return
+
+            rooms = self.world.rooms
+            old_area = self._area_of.pop(vnum, None)
+            if old_area is not None:
+                self.rooms_by_area[old_area].discard(vnum)
+
+            new_area = None
+            room = rooms.regular.get(vnum)
+            if room is not None:
+                new_area = room.area_name
+                self._area_of[vnum] = new_area
+                self.rooms_by_area[new_area].add(vnum)
+            elif vnum in rooms.wilderness:
+                new_area = WILDERNESS_AREA
+
+            changed = {old_area, new_area}
+            if rooms.wilderness.point(vnum) is not None:
+                changed.add(WILDERNESS_AREA)
+
+            self._room_count = len(rooms.regular)
+            # a room that stays in the tour with the same exits leaves its components as they are
+            self._components = {key: c for key, c in self._components.items()
+                                if not c.areas & changed or c.unchanged(vnum, new_area)}
+
+    def _update(self):
+        """Index the rooms by area again if rooms were added or removed without being saved"""
+        regular = self.world.rooms.regular
+        if len(regular) == self._room_count:
+            return
+
+        self.rooms_by_area.clear()
+        self._area_of.clear()
+        self._components.clear()
+        # copied, as rooms can be added while this runs on a worker thread
+        for vnum, room in list(regular.items()):
+            self._area_of[vnum] = room.area_name
+            self.rooms_by_area[room.area_name].add(vnum)
+
+        self._room_count = len(regular)
+
+    def _area_vnums(self, area_name: str) -> Iterable[str]:
+        if area_name == WILDERNESS_AREA:
+            return self.world.rooms.wilderness.vnums()
+
+        return self.rooms_by_area.get(area_name, ())
+
+    def rooms_in_area(self, area_name: str) -> Set[str]:
+        """Return the vnums of the rooms in an area"""
+        with self._lock:
+            self._update()
+            return set(self._area_vnums(area_name))
+
+    def get_components(self, area: Area, level: int, consider_locks_reachable: bool = False) -> AreaComponents:
+        """Return the components of the rooms a tour of area may enter at level, built once until they change"""
+        include_areas = tuple(area.include_areas or ())
+        excluded = frozenset(area.get_excluded_room_vnums(level))
+        key = (area.name, include_areas, area.room_range, excluded, consider_locks_reachable)
+
+        with self._lock:
+            self._update()
+            components = self._components.get(key)
+            if components is None:
+                areas = {area.name, *include_areas}
+                nodes = {vnum for name in areas for vnum in list(self._area_vnums(name))
+                         if area.is_allowed_vnum(vnum, level)}
+                components = AreaComponents(self.world.rooms, nodes, areas, consider_locks_reachable)
+                self._components[key] = components
+                self.builds += 1
+
+            return components
@@ -0,0 +1,307 @@
+"""
+Routes between areas over the exits that cross them, to narrow room searches to a corridor of areas
+
+The graph is over the rooms where paths enter and leave areas.  Leaving crosses an exit into another area,
+and getting from where an area was entered to where it is left costs the cheapest walk inside it, which is
+found with Dijkstra over the area's rooms and kept until a room in the area changes.  Searching that graph
+picks the areas a path goes through without looking at the rooms inside them, and TravelGuide then searches
+rooms only within those areas.
+
+The wilderness is too big to walk from every room that enters it, so crossing it costs the landmark bound
+(or the Manhattan distance) instead, a lower bound.  The corridor is then the cheapest by the area graph,
+and the path found in it may not always be the cheapest of all.
+"""
+import heapq
+import threading
+from collections import defaultdict
+from math import inf
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .terrain import TERRAIN
+from .wilderness_layer import WILDERNESS_AREA
+
+# search states: entered an area at a room, ready to leave an area from a room, or at the goal
+ENTER, LEAVE, GOAL = 0, 1, 2
+
+
+class AreaRouter:
+    """Picks the areas a path goes through from the exits between areas"""
+
+    def __init__(self, world):
+        self.world = world
+        self.grid = world.rooms.wilderness.grid
+
+        # vnum -> vnums in other areas it has unlocked exits to, and area -> vnums with such exits
+        self.crossings: Dict[str, Set[str]] = defaultdict(set)
+        self.leaving: Dict[str, Set[str]] = defaultdict(set)
+        self.area_rooms: Dict[str, List[str]] = defaultdict(list)
+
+        # cheapest cost from a room to the others in its area, by area so they are dropped when it changes
+        self.area_costs: Dict[str, Dict[str, Dict[str, float]]] = defaultdict(dict)
+        self._signatures: Dict[str, tuple] = {}
+        self._terrain: Optional[np.ndarray] = None
+        self._room_count: int = -1
+        self.dirty: bool = True
+        self.builds: int = 0
+        self.metrics = {}
+        # searches on worker threads route too, see TravelGuide.path_async()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _signature(room) -> tuple:
+        """What about a room matters for routing, its area, cost and persisted exits"""
+        exits = tuple((e.direction, e.to_vnum, bool(e.locks)) for e in room._exits.values())
+        return room.area_name, room.terrain.weight, room.deathtrap or room.terrain.impassable, exits
+
+    def room_changed(self, vnum: str):
+        """Called when a room is saved or deleted, so routes see any change to its exits or area"""
+        rooms = self.world.rooms
+        layer = rooms.wilderness
+        point = layer.point(vnum)
+
+        if point is not None and self._terrain is not None and (vnum in layer or vnum not in rooms.regular):
+            # wilderness costs are bounds, so only exits off the grid and rooms next to other areas matter
+            x, y = point
+            new_room = self._terrain[y, x] < 0 <= layer.terrain[y, x]
+            exits = layer.exits.get(vnum, {})
+            signature = tuple((e.direction, e.to_vnum, bool(e.locks)) for e in exits.values())
+            if signature != self._signatures.get(vnum, ()) or new_room:
+                self.dirty = True
+            return
+
+        room = rooms.regular.get(vnum)
+        signature = self._signature(room) if room is not None else None
+        old_signature = self._signatures.get(vnum)
+        if signature == old_signature:
+            return
+
+        self.dirty = True
+        for s in (signature, old_signature):
+            if s is not None:
+                self.area_costs.pop(s[0], None)
+
+    # Building
+
+    def _area_of(self, vnum: str) -> Optional[str]:
+        room = self.world.rooms.regular.get(vnum)
+        if room is not None:
+            return room.area_name
+
+        return WILDERNESS_AREA if vnum in self.world.rooms.wilderness else None
+
+    def _add_crossing(self, from_vnum: str, to_vnum: str, from_area: str):
+        self.crossings[from_vnum].add(to_vnum)
+        self.leaving[from_area].add(from_vnum)
+
+    def build(self):
+        """Index the exits between areas, and the rooms of each area"""
+        rooms = self.world.rooms
+        layer = rooms.wilderness
+
+        self.crossings.clear()
+        self.leaving.clear()
+        self.area_rooms.clear()
+        old_signatures, self._signatures = self._signatures, {}
+        self._terrain = layer.terrain.copy()
+        self._room_count = len(rooms)
+
+        # copied, as rooms can be added while this runs for a search on a worker thread
+        for vnum, room in list(rooms.regular.items()):
+            signature = self._signatures[vnum] = self._signature(room)
+            if signature != old_signatures.get(vnum):
+                # changed without being saved, such as when rooms are loaded
+                self.area_costs.pop(room.area_name, None)
+
+            self.area_rooms[room.area_name].append(vnum)
+            blocked = room.deathtrap or room.terrain.impassable
+
+            for e in room.exits.values():
+                to_area = self._area_of(e.to_vnum)
+                if to_area is None or to_area == room.area_name or e.locks:
+                    continue
+
+                if not blocked:
+                    self._add_crossing(vnum, e.to_vnum, room.area_name)
+
+            # the wilderness rooms around a room on the grid have exits to it, as Room.exits adds them
+            if vnum.isdigit() and int(vnum) >= 70000:
+                for from_vnum in self.grid.get_exits(vnum).values():
+                    from_room = layer.get_room(from_vnum)
+                    if from_room is not None and not (from_room.deathtrap or from_room.terrain.impassable):
+                        self._add_crossing(from_vnum, vnum, WILDERNESS_AREA)
+
+        for vnum, exits in list(layer.exits.items()):
+            self._signatures[vnum] = tuple((e.direction, e.to_vnum, bool(e.locks)) for e in exits.values())
+            room = layer.get_room(vnum)
+            if room is None or room.deathtrap or room.terrain.impassable:
+                continue
+
+            x, y = layer.point(vnum)
+            for e in exits.values():
+                to_area = self._area_of(e.to_vnum)
+                if to_area is None or e.locks:
+                    continue
+
+                # an exit to a cell that is not next to it is a way across the wilderness, like leaving it
+                to_point = layer.point(e.to_vnum)
+                if to_area != WILDERNESS_AREA or abs(to_point[0] - x) + abs(to_point[1] - y) > 1:
+                    self._add_crossing(vnum, e.to_vnum, WILDERNESS_AREA)
+
+        self.dirty = False
+        self.builds += 1
+
+    def update(self):
+        """Index the exits again if any room changed since they were indexed"""
+        with self._lock:
+            if self.dirty or len(self.world.rooms) != self._room_count:
+                self.build()
+
+    def _area_costs(self, vnum: str) -> Dict[str, float]:
+        """Return the cheapest cost from a regular room to every room in its area, without leaving it"""
+        regular = self.world.rooms.regular
+        area = regular[vnum].area_name
+        costs = self.area_costs[area].get(vnum)
+        if costs is not None:
+            return costs
+
+        costs = {vnum: 0}
+        frontier = [(0, vnum)]
+        while frontier:
+            cost, current_vnum = heapq.heappop(frontier)
+            if cost > costs[current_vnum]:
+                continue
+
+            room = regular[current_vnum]
+            if room.deathtrap or room.terrain.impassable:
+                continue
+
+            for e in room.exits.values():
+                to_room = regular.get(e.to_vnum)
+                if to_room is None or to_room.area_name != area or e.locks:
+                    continue
+
+                new_cost = cost + to_room.terrain.weight
+                if new_cost < costs.get(e.to_vnum, inf):
+                    costs[e.to_vnum] = new_cost
+                    heapq.heappush(frontier, (new_cost, e.to_vnum))
+
+        self.area_costs[area][vnum] = costs
+        return costs
+
+    # Routing
+
+    def _wilderness_bounds(self, vnum: str, to_vnums: List[str], min_weight: float) -> List[float]:
+        """Lower bounds on the cost from a wilderness room to others, by landmarks and Manhattan distance"""
+        layer = self.world.rooms.wilderness
+        x, y = layer.point(vnum)
+        points = np.array([layer.point(to_vnum) for to_vnum in to_vnums]).reshape(-1, 2)
+        bounds = (np.abs(points[:, 0] - x) + np.abs(points[:, 1] - y)) * min_weight
+
+        landmarks = self.world.landmarks
+        costs = landmarks.current_costs()
+        if costs is not None:
+            node = landmarks.node(vnum)
+            nodes = [landmarks.node(to_vnum) for to_vnum in to_vnums]
+            forward, backward = costs
+            with np.errstate(invalid='ignore'):
+                alt = np.fmax.reduce(np.fmax(forward[:, nodes] - forward[:, [node]],
+                                             backward[:, [node]] - backward[:, nodes]), axis=0)
+            bounds = np.fmax(bounds, alt)
+
+        return bounds.tolist()
+
+    def get_corridor(self, start_vnum: str, goal_vnum: str, special_exits: Iterable = ()) -> Optional[Set[str]]:
+        """
+        Return the areas of the cheapest route from start to goal by the area graph
+
+        Returns None if both are in the same area or either is unknown, or no route was found.
+        special_exits are the recall and home exits of TravelGuide, taken from rooms whose check allows them.
+        """
+        with self._lock:
+            self.update()
+            return self._get_corridor(start_vnum, goal_vnum, special_exits)
+
+    def _get_corridor(self, start_vnum: str, goal_vnum: str, special_exits: Iterable) -> Optional[Set[str]]:
+        rooms = self.world.rooms
+        start_area, goal_area = self._area_of(start_vnum), self._area_of(goal_vnum)
+        if start_area is None or goal_area is None or start_area == goal_area:
+            return None
+
+        layer = rooms.wilderness
+        weights = [TERRAIN[name].weight for name in layer.terrain_names]
+        min_weight = min(weights, default=0)
+        special_exits = [se for se in special_exits if se.exit.to_vnum in rooms]
+        # rooms of each area that each special exit can be taken from
+        special_rooms: Dict[str, List[List[str]]] = {}
+
+        def enter_edges(vnum: str, area: str) -> Iterable[Tuple[int, str, float]]:
+            to_goal = area == goal_area
+            if area == WILDERNESS_AREA:
+                leaving = list(self.leaving[area])
+                bounds = self._wilderness_bounds(vnum, leaving + [goal_vnum] * to_goal, min_weight)
+                yield from zip([LEAVE] * len(leaving) + [GOAL] * to_goal, leaving + [goal_vnum] * to_goal, bounds)
+                return
+
+            costs = self._area_costs(vnum)
+            for leave_vnum in self.leaving[area]:
+                if leave_vnum in costs:
+                    yield LEAVE, leave_vnum, costs[leave_vnum]
+
+            if to_goal and goal_vnum in costs:
+                yield GOAL, goal_vnum, costs[goal_vnum]
+
+            if area not in special_rooms:
+                area_rooms = [rooms.regular[v] for v in self.area_rooms[area]]
+                special_rooms[area] = [[r.vnum for r in area_rooms if se.check(r)] for se in special_exits]
+
+            for se, allowed in zip(special_exits, special_rooms[area]):
+                cost = min((costs[v] for v in allowed if v in costs), default=inf)
+                if cost < inf:
+                    yield ENTER, se.exit.to_vnum, cost + rooms[se.exit.to_vnum].terrain.weight
+
+        start = (ENTER, start_vnum)
+        came_from = {start: None}
+        best = {start: 0}
+        frontier = [(0, ENTER, start_vnum)]
+        expanded = 0
+
+        while frontier:
+            cost, kind, vnum = heapq.heappop(frontier)
+            state = (kind, vnum)
+            if cost > best[state]:
+                continue
+
+            expanded += 1
+            if kind == GOAL:
+                break
+
+            if kind == ENTER:
+                area = self._area_of(vnum)
+                edges = enter_edges(vnum, area) if area is not None else ()
+            else:
+                edges = ((ENTER, to_vnum, rooms[to_vnum].terrain.weight) for to_vnum in self.crossings[vnum]
+                         if to_vnum in rooms)
+
+            for to_kind, to_vnum, step in edges:
+                to_state = (to_kind, to_vnum)
+                if cost + step < best.get(to_state, inf):
+                    best[to_state] = cost + step
+                    came_from[to_state] = state
+                    heapq.heappush(frontier, (cost + step, to_kind, to_vnum))
+
+        self.metrics = {'portals expanded': expanded}
+        state = (GOAL, goal_vnum)
+        if state not in came_from:
+            return None
+
+        corridor = set()
+        while state is not None:
+            corridor.add(self._area_of(state[1]))
+            state = came_from[state]
+
+        corridor.discard(None)
+
+        self.metrics['corridor areas'] = len(corridor)
+        return corridor
@@ -0,0 +1,218 @@
+"""
+Lower bounds on travel cost, used by TravelGuide to guide its A* search
+
+A heuristic is called with a vnum and returns a cost that is never more than the cost of the cheapest
+path from that room to the nearest goal, or inf if no goal can be reached from it.  Each heuristic is
+also consistent, the bound never drops by more than the cost of a step, so the first path A* finds to
+each goal is the cheapest and goals are found in order of cost, as with Dijkstra.
+"""
+from math import inf
+from typing import Iterable, Optional, Set
+
+import numpy as np
+
+from .landmarks import Landmarks
+from .terrain import TERRAIN
+from .world import World
+
+
+def manhattan_distances(mask: np.ndarray) -> np.ndarray:
+    """Return the Manhattan distance from every cell of a 2d mask to its nearest True cell, inf if there are none"""
+    distances = np.where(mask, 0.0, inf)
+
+    # the L1 distance transform separates into a forward and backward pass along each axis
+    for axis in (1, 0):
+        shape = [1, 1]
+        shape[axis] = distances.shape[axis]
+        offset = np.arange(distances.shape[axis], dtype=float).reshape(shape)
+        forward = np.minimum.accumulate(distances - offset, axis=axis) + offset
+        backward = np.flip(np.minimum.accumulate(np.flip(distances + offset, axis), axis=axis), axis) - offset
+        distances = np.minimum(forward, backward)
+
+    return distances
+
+
+class WildernessHeuristic:
+    """
+    Manhattan distance on the wilderness grid to the nearest goal, times the lowest terrain weight
+
+    Walking the grid moves one cell per step, but a path can also leave it and come back somewhere else,
+    through an area, a portal or a recall.  Every room on the grid that has an exit off of it, or to a cell
+    that is not next to it, is a way out, and every room such an exit leads to is a way back in.  The bound
+    for a grid room is then the lowest of walking straight to a goal on the grid, walking to a way out and
+    from the way in nearest a goal, or just walking to a way out if there are goals off the grid.
+
+    Rooms off the grid are bounded by the walk from the way in nearest a goal, if all goals are on the grid.
+    """
+    name = 'wilderness'
+
+    def __init__(self, world: World, goal_vnums: Set[str], extra_vnums_in: Iterable[str] = ()):
+        """
+        :param world: The world with all known rooms
+        :param goal_vnums: The rooms to find paths to
+        :param extra_vnums_in: Rooms that can be reached from anywhere, such as the targets of recall and home
+        """
+        self.layer = world.rooms.wilderness
+        self.grid = self.layer.grid
+        self.width = self.grid.WIDTH
+        self.upper_left = self.grid.UPPER_LEFT
+        self.cells = self.grid.WIDTH * self.grid.HEIGHT
+        shape = (self.grid.HEIGHT, self.grid.WIDTH)
+
+        ways_out = np.zeros(shape, dtype=bool)
+        ways_in = np.zeros(shape, dtype=bool)
+        weights = {TERRAIN[name].weight for name in self.layer.terrain_names}
+
+        # copied, as rooms can be added while this runs for a search on a worker thread
+        for vnum, room in list(world.rooms.regular.items()):
+            point = self.layer.point(vnum)
+            if point is not None:
+                # rooms outside of The Wilderness can have any exits, or be the target of any exit
+                ways_out[point[1], point[0]] = ways_in[point[1], point[0]] = True
+                weights.add(room.terrain.weight)
+                continue
+
+            for e in room.exits.values():
+                to_point = self.layer.point(e.to_vnum)
+                if to_point is not None:
+                    ways_in[to_point[1], to_point[0]] = True
+
+        for vnum, exits in list(self.layer.exits.items()):
+            x, y = self.layer.point(vnum)
+            for e in exits.values():
+                to_point = self.layer.point(e.to_vnum)
+                if to_point is None or abs(to_point[0] - x) + abs(to_point[1] - y) > 1:
+                    ways_out[y, x] = True
+                    if to_point is not None:
+                        ways_in[to_point[1], to_point[0]] = True
+
+        # the bottom row has a south exit off of the grid
+        for x in range(self.grid.WIDTH):
+            if self.grid.get_vnum_at_point(x, self.grid.HEIGHT) in world.rooms.regular:
+                ways_out[-1, x] = True
+
+        for vnum in extra_vnums_in:
+            point = self.layer.point(vnum)
+            if point is not None:
+                ways_in[point[1], point[0]] = True
+
+        goals_on_grid = np.zeros(shape, dtype=bool)
+        goals_off_grid = False
+        for vnum in goal_vnums:
+            point = self.layer.point(vnum)
+            if point is None:
+                goals_off_grid = True
+            else:
+                goals_on_grid[point[1], point[0]] = True
+
+        self.min_weight = min(weights, default=0)
+        to_goal = manhattan_distances(goals_on_grid)
+        to_way_out = manhattan_distances(ways_out)
+        way_in_to_goal = to_goal[ways_in].min(initial=inf)
+
+        bound = np.minimum(to_goal, to_way_out + way_in_to_goal)
+        if goals_off_grid:
+            bound = np.minimum(bound, to_way_out)
+
+        self.grid_bounds = (bound * self.min_weight).ravel()
+        self.bounds = self.grid_bounds.tolist()
+        self.off_grid: float = 0 if goals_off_grid else way_in_to_goal * self.min_weight
+
+    @classmethod
+    def for_query(cls, world: World, start_vnum: str, goal_vnums: Set[str],
+                  extra_vnums_in: Iterable[str] = ()) -> Optional["WildernessHeuristic"]:
+        """Return a heuristic if the start or any goal is on the wilderness grid, otherwise None"""
+        layer = world.rooms.wilderness
+        if layer.point(start_vnum) is None and all(layer.point(vnum) is None for vnum in goal_vnums):
+            return None
+
+        heuristic = cls(world, goal_vnums, extra_vnums_in)
+        return heuristic if heuristic.min_weight > 0 else None
+
+    def __call__(self, vnum: str) -> float:
+        # same as WildernessLayer.point, inline since it is called for every room A* queues
+        try:
+            v = int(vnum)
+        except (TypeError, ValueError):
+            return self.off_grid
+
+        d = v + (v >= 87523) - self.upper_left
+        if 0 <= d < self.cells:
+            return self.bounds[d]
+
+        return self.off_grid
+
+
+class LandmarkHeuristic:
+    """
+    Lower bounds from the costs to and from landmark rooms, by the triangle inequality
+
+    For a landmark L, the cost from a room to a goal is at least cost(L, goal) - cost(L, room) and at least
+    cost(room, L) - cost(goal, L).  The bound is the highest of those over all landmarks, and over the
+    wilderness heuristic if there is one, since the highest of consistent heuristics is also consistent.
+
+    The landmark costs are for walking exits only, so the bound is capped at the lowest bound of the rooms
+    that can be reached from anywhere, since a recall or home could be the first step.
+    """
+    name = 'landmarks'
+
+    def __init__(self, landmarks: Landmarks, goal_vnums: Set[str], extra_vnums_in: Iterable[str] = (),
+                 wilderness: Optional[WildernessHeuristic] = None):
+        """
+        :param landmarks: The landmark costs, ready to use
+        :param goal_vnums: The rooms to find paths to
+        :param extra_vnums_in: Rooms that can be reached from anywhere, such as the targets of recall and home
+        :param wilderness: A wilderness heuristic for the same query to combine with
+        """
+        self.landmarks = landmarks
+        self.ids = landmarks.ids
+        self.upper_left = landmarks.grid.UPPER_LEFT
+        self.cells = landmarks.cells
+
+        goals = [node for node in (landmarks.node(vnum) for vnum in goal_vnums) if node is not None]
+        forward, backward = landmarks.costs
+
+        # costs are inf for rooms a landmark can't reach, or that can't reach it, which tell nothing
+        with np.errstate(invalid='ignore'):
+            to_goal = forward[:, goals].min(axis=1, keepdims=True)
+            from_goal = backward[:, goals].max(axis=1, keepdims=True)
+            bound = np.fmax.reduce(np.fmax(to_goal - forward, backward - from_goal), axis=0)
+        bound[~(bound > 0)] = 0
+
+        extra = [node for node in (landmarks.node(vnum) for vnum in extra_vnums_in) if node is not None]
+        if extra:
+            np.minimum(bound, bound[extra].min(), out=bound)
+
+        bound = bound.astype(float)
+        if wilderness is not None:
+            self.name = 'landmarks+wilderness'
+            np.maximum(bound[:self.cells], wilderness.grid_bounds, out=bound[:self.cells])
+            np.maximum(bound[self.cells:], wilderness.off_grid, out=bound[self.cells:])
+
+        self.bounds = bound.tolist()
+
+    @classmethod
+    def for_query(cls, world: World, goal_vnums: Set[str], extra_vnums_in: Iterable[str] = (),
+                  wilderness: Optional[WildernessHeuristic] = None) -> Optional["LandmarkHeuristic"]:
+        """Return a heuristic if the landmark costs are ready and know at least one goal, otherwise None"""
+        landmarks = world.landmarks
+        if not landmarks.ready() or all(landmarks.node(vnum) is None for vnum in goal_vnums):
+            return None
+
+        return cls(landmarks, goal_vnums, extra_vnums_in, wilderness)
+
+    def __call__(self, vnum: str) -> float:
+        # same as Landmarks.node, inline since it is called for every room A* queues
+        try:
+            v = int(vnum)
+        except (TypeError, ValueError):
+            v = -1
+
+        d = v + (v >= 87523) - self.upper_left
+        if not 0 <= d < self.cells:
+            d = self.ids.get(vnum)
+            # rooms numbered since the bounds were computed are unknown to them
+            if d is None or d >= len(self.bounds):
+                return 0
+
+        return self.bounds[d]
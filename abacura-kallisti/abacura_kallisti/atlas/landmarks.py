@@ -0,0 +1,507 @@
+"""
+Landmark (ALT) distances for lower bounds on travel cost
+
+The cost from every room to and from a few landmark rooms gives a lower bound on the cost between any two
+rooms by the triangle inequality.  The landmarks are picked far apart, each the room farthest from those
+already picked, and their costs are computed on a background thread and kept in the world database.
+
+The bounds only need the costs to be consistent along every exit, no room's cost from a landmark more than
+an exit from another room plus that exit's cost.  Removing an exit or making a room dearer keeps that true,
+so only new rooms, new exits and cheaper rooms need their costs lowered.  World.save_room() records the rooms
+that changed, and a copy of the costs is repaired on the background thread, searches go without landmarks
+until it is done.  A repair that spreads too far is given up and the costs are computed again instead.
+
+Rooms on the wilderness grid use their cell as node id, other rooms are numbered after the grid.
+"""
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from math import inf
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from textual import log
+
+from .terrain import TERRAIN
+
+
+class Landmarks:
+    """Costs to and from landmark rooms for every room in a World"""
+
+    def __init__(self, world, count: int = 16, repair_limit: int = 20000):
+        self.world = world
+        self.count = count
+        self.repair_limit = repair_limit
+        self.grid = world.rooms.wilderness.grid
+        self.cells = self.grid.WIDTH * self.grid.HEIGHT
+
+        # node ids of rooms off the wilderness grid, and their vnums in node order
+        self.ids: Dict[str, int] = {}
+        self.vnums: List[str] = []
+        self.weight = np.full(self.cells, inf)
+        # persisted exits into each vnum, to find what leads to a room whose cost went down
+        self.into: Dict[str, Set[str]] = defaultdict(set)
+
+        self.landmarks: List[str] = []
+        # [landmark, node] costs from and to each landmark, replaced as a pair for searches on other threads
+        self.costs: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+        self.loaded: bool = False
+        self.dirty: bool = False
+        self.changed: Set[str] = set()
+        self.computed_at: float = 0
+        self.compute_seconds: float = 0
+        self.repairs: int = 0
+        self.rooms_repaired: int = 0
+        self._computed: Optional[Tuple[List[str], np.ndarray, np.ndarray]] = None
+        # rooms changed while computing, to repair in the computed costs
+        self._compute_changes: Optional[Set[str]] = None
+        # the copy of the costs being repaired, and the repaired costs, or () if the repair was given up
+        self._repairing: Optional[List[np.ndarray]] = None
+        self._repaired: Optional[tuple] = None
+        self._thread: Optional[threading.Thread] = None
+        # searches on worker threads get ready too, see TravelGuide.path_async()
+        self._lock = threading.Lock()
+
+    @property
+    def computing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def node(self, vnum: str, create: bool = False) -> Optional[int]:
+        try:
+            v = int(vnum)
+        except (TypeError, ValueError):
+            v = -1
+
+        # same as WildernessLayer.point, everything is shifted due to the hole
+        d = v + (v >= 87523) - self.grid.UPPER_LEFT
+        if 0 <= d < self.cells:
+            return d
+
+        node = self.ids.get(vnum)
+        if node is None and create:
+            node = self.ids[vnum] = self.cells + len(self.vnums)
+            self.vnums.append(vnum)
+            self._grow(node + 1)
+
+        return node
+
+    def node_vnum(self, node: int) -> str:
+        if node < self.cells:
+            return self.grid.get_vnum_at_point(node % self.grid.WIDTH, node // self.grid.WIDTH)
+
+        return self.vnums[node - self.cells]
+
+    def room_changed(self, vnum: str):
+        """Called when a room or its exits are saved, so its costs are repaired before the next search"""
+        self.changed.add(vnum)
+        if self._compute_changes is not None:
+            self._compute_changes.add(vnum)
+
+    def ready(self) -> bool:
+        """
+        Return True if the costs can be used for a search
+
+        Otherwise they are loaded, or computing or repairing them is started on the background thread.
+        """
+        with self._lock:
+            if not self.world.wilderness_loaded:
+                # the costs cover the whole world, so wait until the wilderness is entered and loaded
+                return False
+
+            if not self.loaded:
+                self.load()
+
+            if self.computing:
+                return False
+
+            if self._computed is not None:
+                self._apply_computed()
+
+            if self._repaired is not None:
+                self._apply_repaired()
+
+            if self.costs is None:
+                self.start_compute()
+                return False
+
+            if self.changed:
+                self.start_repair()
+                return False
+
+            return True
+
+    def current_costs(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Return the costs if no room changed since they were computed or repaired, without loading or repairing"""
+        if self.changed or self._repairing is not None:
+            return None
+
+        return self.costs
+
+    # Graph
+
+    def _grid_neighbours(self, vnum: str) -> List[str]:
+        """Vnums of the cells next to vnum, the targets and sources of wilderness exits"""
+        try:
+            if int(vnum) < self.grid.UPPER_LEFT:
+                return []
+        except ValueError:
+            return []
+
+        x, y = self.grid.get_point(vnum)
+        points = [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
+        return [self.grid.get_vnum_at_point(px, py) for px, py in points if 0 <= px < self.grid.WIDTH and py >= 0]
+
+    def _out_nodes(self, vnum: str) -> List[int]:
+        rooms = self.world.rooms
+        room = rooms.get(vnum)
+        # copied, as repairs run on the background thread
+        targets = [e.to_vnum for e in list(room.exits.values())] if room is not None else []
+        return [self.node(t, create=True) for t in targets + self._grid_neighbours(vnum) if t in rooms]
+
+    def _in_nodes(self, vnum: str) -> List[int]:
+        rooms = self.world.rooms
+        sources = list(self.into.get(vnum, ())) + self._grid_neighbours(vnum)
+        return [self.node(s, create=True) for s in sources if s in rooms]
+
+    def _grow(self, nodes: int):
+        """Make room for more off grid nodes, whose weights and costs are unknown until repaired"""
+        size = len(self.weight)
+        if nodes > size:
+            size = max(nodes, size + size // 4)
+            self.weight = np.concatenate([self.weight, np.full(size - len(self.weight), inf)])
+
+        if self.costs is not None and self.costs[0].shape[1] < size:
+            self.costs = tuple(self._pad(costs, size) for costs in self.costs)
+
+        if self._repairing is not None and self._repairing[0].shape[1] < size:
+            self._repairing[:] = [self._pad(costs, size) for costs in self._repairing]
+
+    @staticmethod
+    def _pad(costs: np.ndarray, size: int) -> np.ndarray:
+        pad = np.full((len(costs), size - costs.shape[1]), inf, dtype=np.float32)
+        return np.concatenate([costs, pad], axis=1)
+
+    def build_graph(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (from node, to node) arrays of every exit, assigning node ids to rooms as needed
+
+        This includes exits a search may not take, locked or above your level, which only loosens the bounds.
+        """
+        layer = self.world.rooms.wilderness
+        grid = self.grid
+
+        weights = np.array([TERRAIN[name].weight for name in layer.terrain_names] + [inf])
+        self.weight[:self.cells] = weights[layer.terrain.ravel()]
+
+        # copied, as rooms can be added while this runs for a search on a worker thread
+        regular = list(self.world.rooms.regular.items())
+        wilderness_exits = list(layer.exits.items())
+
+        sources, targets = [], []
+        self.into.clear()
+        for vnum, exits in wilderness_exits:
+            for e in exits.values():
+                self.into[e.to_vnum].add(vnum)
+
+        for vnum, room in regular:
+            node = self.node(vnum, create=True)
+            self.weight[node] = room.terrain.weight
+
+        for vnum, room in regular:
+            node = self.node(vnum)
+            for e in room.exits.values():
+                if not e.temporary:
+                    self.into[e.to_vnum].add(vnum)
+                to_node = self.node(e.to_vnum)
+                if to_node is not None and self.weight[to_node] < inf:
+                    sources.append(node)
+                    targets.append(to_node)
+
+        for vnum, exits in wilderness_exits:
+            for e in exits.values():
+                to_node = self.node(e.to_vnum)
+                if to_node is not None and self.weight[to_node] < inf:
+                    sources.append(self.node(vnum))
+                    targets.append(to_node)
+
+        # wilderness exits join every pair of rooms next to each other on the grid
+        occupied = (self.weight[:self.cells] < inf).reshape(grid.HEIGHT, grid.WIDTH)
+        cell = np.arange(self.cells).reshape(occupied.shape)
+        pairs = [(cell[:, :-1][occupied[:, :-1] & occupied[:, 1:]], 1),
+                 (cell[:-1, :][occupied[:-1, :] & occupied[1:, :]], grid.WIDTH)]
+        grid_from = np.concatenate([np.concatenate([a, a + step]) for a, step in pairs])
+        grid_to = np.concatenate([np.concatenate([a + step, a]) for a, step in pairs])
+
+        return (np.concatenate([np.array(sources, dtype=np.int64), grid_from]),
+                np.concatenate([np.array(targets, dtype=np.int64), grid_to]))
+
+    # Computing
+
+    @staticmethod
+    def _csr(heads: np.ndarray, tails: np.ndarray, nodes: int,
+             step: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        order = np.argsort(heads, kind='stable')
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(heads, minlength=nodes))])
+        return indptr, tails[order], step[order]
+
+    @staticmethod
+    def _costs_from(indptr: np.ndarray, indices: np.ndarray, step: np.ndarray, source: int) -> np.ndarray:
+        """
+        Cost from source to every node, where following edge i costs step[i]
+
+        The edges out of every node whose cost went down are relaxed together with NumPy until no cost goes down,
+        so the background thread spends little time holding the GIL.
+        """
+        costs = np.full(len(indptr) - 1, inf)
+        costs[source] = 0
+        frontier = np.array([source])
+        while len(frontier):
+            starts = indptr[frontier]
+            counts = indptr[frontier + 1] - starts
+            edges = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            to_nodes = indices[edges]
+            new_costs = np.repeat(costs[frontier], counts) + step[edges]
+
+            better = new_costs < costs[to_nodes]
+            to_nodes, new_costs = to_nodes[better], new_costs[better]
+            # the lowest cost is assigned last when a node is reached more than once
+            order = np.argsort(new_costs)[::-1]
+            costs[to_nodes[order]] = new_costs[order]
+            frontier = np.unique(to_nodes)
+
+        return costs.astype(np.float32)
+
+    def compute(self, sources: np.ndarray, targets: np.ndarray, weight: np.ndarray) -> Tuple[list, list, list]:
+        """Pick landmarks and return their (nodes, costs from, costs to), each the farthest from those before"""
+        nodes = len(weight)
+        # entering a room costs its weight, so following an exit either way costs the weight of its target
+        step = weight[targets]
+        out_graph = self._csr(sources, targets, nodes, step)
+        in_graph = self._csr(targets, sources, nodes, step)
+
+        rooms = np.flatnonzero((weight < inf) & (np.bincount(sources, minlength=nodes) > 0))
+        if len(rooms) == 0:
+            return [], [], []
+
+        landmarks, forward, backward = [], [], []
+        nearest = self._costs_from(*out_graph, int(rooms[0]))
+        for _ in range(min(self.count, len(rooms))):
+            reachable = np.where(np.isfinite(nearest), nearest, -1)
+            reachable[landmarks] = -1
+            landmark = int(np.argmax(reachable))
+            if reachable[landmark] <= 0:
+                break
+
+            landmarks.append(landmark)
+            forward.append(self._costs_from(*out_graph, landmark))
+            backward.append(self._costs_from(*in_graph, landmark))
+            nearest = forward[0] if len(forward) == 1 else np.minimum(nearest, forward[-1])
+
+        return landmarks, forward, backward
+
+    def start_compute(self):
+        """Pick landmarks and compute their costs on a background thread, from the rooms and exits as they are now"""
+        if self.computing:
+            return
+
+        # costs computed from the rooms as they are now replace any repair not used yet
+        self._repairing = self._repaired = None
+        sources, targets = self.build_graph()
+        weight = self.weight.copy()
+        vnums = list(self.vnums)
+        self.changed.clear()
+        self._compute_changes = set()
+
+        def run():
+            start = time.monotonic()
+            landmarks, forward, backward = self.compute(sources, targets, weight)
+            self.compute_seconds = time.monotonic() - start
+            if not landmarks:
+                return
+
+            landmark_vnums = [self.node_vnum(node) if node < self.cells else vnums[node - self.cells]
+                              for node in landmarks]
+            computed = (landmark_vnums, np.array(forward), np.array(backward))
+            self._save(vnums, *computed)
+            self._computed = computed
+
+        self._start(run)
+
+    def start_repair(self, forward: Set[int] = (), backward: Set[int] = (),
+                     costs: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        """Repair a copy of the costs, or the costs given, for the rooms changed so far on a background thread"""
+        changed, self.changed = self.changed, set()
+        self._repairing = list(costs) if costs is not None else [c.copy() for c in self.costs]
+        self._repaired = None
+
+        def run():
+            repaired = self.repair(changed, forward, backward)
+            self._repaired = tuple(self._repairing) if repaired else ()
+
+        self._start(run)
+
+    def _start(self, run: Callable[[], None]):
+        self._thread = threading.Thread(target=run, name="abacura-landmarks", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float = None):
+        """Wait for a background computation to finish"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _apply_computed(self):
+        self.landmarks, forward, backward = self._computed
+        self.costs = forward, backward
+        self._computed = None
+        self.computed_at = time.time()
+        self._grow(len(self.weight))
+        self.changed |= self._compute_changes or set()
+        self._compute_changes = None
+
+    def _apply_repaired(self):
+        repaired, self._repaired, self._repairing = self._repaired, None, None
+        self.costs = repaired or None
+
+    # Repairing
+
+    def repair(self, vnums: Set[str], forward: Set[int] = (), backward: Set[int] = ()) -> bool:
+        """
+        Lower the costs being repaired around changed rooms until they are consistent along every exit again
+
+        This runs on the background thread, see start_repair().
+        forward and backward are nodes whose exits to, or from, other rooms are known to need checking.
+        Returns False if more than repair_limit rooms needed repairs.
+        """
+        self.repairs += 1
+        # new nodes grow the arrays in this list, so they are looked up again after finding nodes
+        costs = self._repairing
+        forward_queue, backward_queue = deque(forward), deque(backward)
+
+        for vnum in vnums:
+            room = self.world.rooms.get(vnum)
+            if room is None:
+                continue
+
+            node = self.node(vnum, create=True)
+            self.weight[node] = room.terrain.weight
+
+            for e in list(room.exits.values()):
+                if not e.temporary:
+                    self.into[e.to_vnum].add(vnum)
+
+            # pull costs from the rooms around it, then push them on to the rest
+            in_nodes, out_nodes = self._in_nodes(vnum), self._out_nodes(vnum)
+            forward_costs, backward_costs = costs
+            for in_node in in_nodes:
+                np.minimum(forward_costs[:, node], forward_costs[:, in_node] + self.weight[node],
+                           out=forward_costs[:, node])
+            for out_node in out_nodes:
+                np.minimum(backward_costs[:, node], backward_costs[:, out_node] + self.weight[out_node],
+                           out=backward_costs[:, node])
+
+            forward_queue.append(node)
+            backward_queue.append(node)
+
+        repaired = 0
+        while forward_queue or backward_queue:
+            repaired += 1
+            if repaired > self.repair_limit:
+                return False
+
+            if forward_queue:
+                node = forward_queue.popleft()
+                out_nodes = self._out_nodes(self.node_vnum(node))
+                forward_costs = costs[0]
+                for out_node in out_nodes:
+                    cost = forward_costs[:, node] + self.weight[out_node]
+                    if (cost < forward_costs[:, out_node]).any():
+                        np.minimum(forward_costs[:, out_node], cost, out=forward_costs[:, out_node])
+                        forward_queue.append(out_node)
+
+            if backward_queue:
+                node = backward_queue.popleft()
+                in_nodes = self._in_nodes(self.node_vnum(node))
+                backward_costs = costs[1]
+                cost = backward_costs[:, node] + self.weight[node]
+                for in_node in in_nodes:
+                    if (cost < backward_costs[:, in_node]).any():
+                        np.minimum(backward_costs[:, in_node], cost, out=backward_costs[:, in_node])
+                        backward_queue.append(in_node)
+
+        self.rooms_repaired += repaired
+        self.dirty = self.dirty or repaired > 0
+        return True
+
+    # Persistence
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection):
+        conn.execute("create table if not exists landmark_nodes(node integer primary key, vnum)")
+        conn.execute("create table if not exists landmarks(position integer primary key, vnum, forward, backward)")
+
+    def _save(self, vnums: List[str], landmarks: List[str], forward: np.ndarray, backward: np.ndarray):
+        conn = sqlite3.connect(self.world.db_path)
+        try:
+            with conn:
+                self._create_tables(conn)
+                conn.execute("delete from landmark_nodes")
+                conn.execute("delete from landmarks")
+                conn.executemany("insert into landmark_nodes values(?, ?)",
+                                 ((self.cells + i, vnum) for i, vnum in enumerate(vnums)))
+                conn.executemany("insert into landmarks values(?, ?, ?, ?)",
+                                 ((i, vnum, forward[i].tobytes(), backward[i].tobytes())
+                                  for i, vnum in enumerate(landmarks)))
+        except sqlite3.Error as exc:
+            log.error(f"Unable to save landmarks: {exc!r}")
+        finally:
+            conn.close()
+
+    def save(self):
+        """Save the costs if they were repaired since they were loaded or computed"""
+        if self.dirty and self.costs is not None:
+            nodes = self.cells + len(self.vnums)
+            forward, backward = self.costs
+            self._save(self.vnums, self.landmarks, forward[:, :nodes], backward[:, :nodes])
+            self.dirty = False
+
+    def load(self):
+        """Load the costs from the database, and start repairing them for any rooms or exits saved without them"""
+        self.loaded = True
+        self.world.flush()
+        try:
+            self._create_tables(self.world.db_conn)
+            nodes = self.world.db_conn.execute("select node, vnum from landmark_nodes order by node").fetchall()
+            rows = self.world.db_conn.execute("select vnum, forward, backward from landmarks order by position")
+            rows = rows.fetchall()
+        except sqlite3.Error as exc:
+            log.error(f"Unable to load landmarks: {exc!r}")
+            return
+
+        for node, vnum in nodes:
+            self.node(vnum, create=True)
+
+        sources, targets = self.build_graph()
+        stored = self.cells + len(nodes)
+        if not rows or any(len(forward) != stored * 4 for _, forward, _ in rows):
+            self.changed.clear()
+            return
+
+        self.landmarks = [row[0] for row in rows]
+        forward = np.full((len(rows), len(self.weight)), inf, dtype=np.float32)
+        backward = forward.copy()
+        for i, (_, forward_bytes, backward_bytes) in enumerate(rows):
+            forward[i, :stored] = np.frombuffer(forward_bytes, dtype=np.float32)
+            backward[i, :stored] = np.frombuffer(backward_bytes, dtype=np.float32)
+
+        # repair any exit the stored costs are not consistent along
+        step = self.weight[targets]
+        bad_forward = (forward[:, sources] + step < forward[:, targets]).any(axis=0)
+        bad_backward = (backward[:, targets] + step < backward[:, sources]).any(axis=0)
+        self.changed.clear()
+        if bad_forward.any() or bad_backward.any():
+            self.start_repair(set(sources[bad_forward].tolist()), set(targets[bad_backward].tolist()),
+                              costs=(forward, backward))
+        else:
+            self.costs = forward, backward
@@ -1,10 +1,12 @@
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from collections import Counter
 
 import tomlkit
 
+from abacura.utils.file_writer import file_writer
+
 
 @dataclass
 class Location:
@@ -18,17 +20,34 @@ class LocationList:
 
     def __init__(self, loc_file: str):
         self.locations: List[Location] = []
+        self.names: Dict[str, Location] = {}
+        self.categorized_names: Dict[Tuple[str, str], Location] = {}
+        self.vnums: Dict[str, List[Location]] = {}
         self.loc_filepath = Path(loc_file)
 
         self.load()
 
+    def reindex(self):
+        """Rebuild the lookups, the first location defined for a name wins"""
+        self.names = {}
+        self.categorized_names = {}
+        self.vnums = {}
+        for loc in self.locations:
+            self._index(loc)
+
+    def _index(self, loc: Location):
+        self.names.setdefault(loc.name, loc)
+        self.categorized_names[(loc.category, loc.name)] = loc
+        self.vnums.setdefault(loc.vnum, []).append(loc)
+
     def save(self):
-        toml_structure = {}
-        for c in self.get_categories().keys():
-            toml_structure[c] = {loc.name: loc.vnum for loc in self.get_category(c) if not loc.temporary}
+        """Snapshot the persistent locations and hand them to the background writer"""
+        toml_structure = {c: {} for c in self.get_categories().keys()}
+        for loc in self.locations:
+            if not loc.temporary:
+                toml_structure[loc.category][loc.name] = loc.vnum
 
-        with open(self.loc_filepath, 'w') as f:
-            tomlkit.dump(toml_structure, f)
+        file_writer.schedule(self.loc_filepath, lambda: tomlkit.dumps(toml_structure))
 
     def load(self):
 
@@ -43,9 +62,10 @@ class LocationList:
                 locations += [Location(c, k, v) for k, v in toml_structure[c].items()]
 
             self.locations = locations
+            self.reindex()
 
     def get_locations_for_vnum(self, vnum: str) -> List[Location]:
-        return [a for a in self.locations if a.vnum == vnum]
+        return list(self.vnums.get(vnum, []))
 
     @staticmethod
     def parse_location(location) -> (str, str):
@@ -57,23 +77,27 @@ class LocationList:
 
     def get_location(self, location: str) -> Optional[Location]:
         name, category = self.parse_location(location)
-        for a in self.locations:
-            if a.name == name and (a.category == category or category is None):
-                return a
+        if category is None:
+            return self.names.get(name, None)
 
-        return None
+        return self.categorized_names.get((category, name), None)
 
     def add_location(self, location: str, vnum: str, temporary: bool = False):
         name, category = self.parse_location(location)
 
         if self.get_location(location) is None:
-            self.locations.append(Location(category, name, vnum, temporary))
-            self.save()
+            new_location = Location(category, name, vnum, temporary)
+            self.locations.append(new_location)
+            self._index(new_location)
+            if not temporary:
+                self.save()
 
     def delete_location(self, location: str):
         existing_location = self.get_location(location)
-        self.locations = [loc for loc in self.locations if loc != existing_location]
-        self.save()
+        self.locations = [loc for loc in self.locations if loc is not existing_location]
+        self.reindex()
+        if existing_location is not None and not existing_location.temporary:
+            self.save()
 
     def get_categories(self) -> Counter:
         return Counter([a.category for a in self.locations])
@@ -50,7 +50,7 @@ class Exit:
         return [self.direction[0]]
 
 
-@dataclass(slots=True)
+@dataclass(slots=True, weakref_slot=True)
 class Room:
     vnum: str = ""
     name: str = ""
@@ -103,6 +103,10 @@ class Room:
         if v < 70000:
             return self._exits
 
+        # the cached dict is shared, so don't modify what this returns
+        if not self._exits:
+            return self.get_wilderness_temp_exits(self.vnum)
+
         result = self._exits.copy()
         result.update(self.get_wilderness_temp_exits(self.vnum))
         return result
@@ -1,8 +1,11 @@
+import asyncio
+import copy
 import random
 from dataclasses import dataclass, field
-from typing import Optional
+from math import inf
+from typing import List, Optional
 
-from abacura_kallisti.atlas.travel_guide import TravelGuide, TravelPath
+from abacura_kallisti.atlas.travel_guide import DistanceField, TravelGuide, TravelPath
 from abacura_kallisti.atlas.room import Area, Exit, ScannedRoom
 from abacura_kallisti.atlas.world import World
 from abacura_kallisti.mud.player import PlayerCharacter
@@ -51,11 +54,16 @@ class TourGuide:
 
         self.telluria_region = 'start'
         self.telluria_moves = []
+        # costs from the room of the last step, reused while the tour follows its paths
+        self.distance_field: Optional[DistanceField] = None
 
         self.started: bool = False
+        # steps are found one at a time, as each changes the tour, see get_next_step_async()
+        self._lock = asyncio.Lock()
 
     def _start(self, scanned_room: ScannedRoom):
         self.visited_rooms: set = set()
+        self.distance_field = None
         self.reachable_rooms: set = self.travel_guide.get_reachable_rooms_in_known_area(scanned_room.vnum, self.area)
         if len(self.area.rooms_to_scout):
             self.unvisited_rooms = {vnum for vnum in self.unvisited_rooms if vnum in self.area.rooms_to_scout}
@@ -65,6 +73,47 @@ class TourGuide:
 
         self.started = True
 
+    # what get_next_step() changes as the tour goes on
+    TOUR_STATE = ('started', 'reachable_rooms', 'visited_rooms', 'unvisited_rooms', 'telluria_region',
+                  'telluria_moves', 'distance_field')
+
+    def _copy_for_thread(self) -> "TourGuide":
+        """Return a copy of the tour to find a step on a worker thread, with its own rooms and travel guide"""
+        tour = copy.copy(self)
+        tour.reachable_rooms = self.reachable_rooms.copy()
+        tour.visited_rooms = self.visited_rooms.copy()
+        tour.unvisited_rooms = self.unvisited_rooms.copy()
+        tour.travel_guide = self.travel_guide._copy_for_thread()
+        if tour.distance_field is not None:
+            # searches carried on from the distance field stop when this step is cancelled
+            tour.distance_field.guide = tour.travel_guide
+        return tour
+
+    async def get_next_step_async(self, scanned_room: ScannedRoom) -> TourGuideResponse:
+        """
+        Return the next step from get_next_step() on a worker thread, so input and output carry on meanwhile
+
+        The step is found on a copy of the tour, and what it changed is applied back here on the event loop.
+        Cancelling the task awaiting this stops its searches and leaves the tour as it was.
+        """
+        async with self._lock:
+            tour = self._copy_for_thread()
+            try:
+                response = await asyncio.to_thread(tour.get_next_step, scanned_room)
+            except BaseException:
+                # the copy may have moved the distance field before it was stopped
+                self.distance_field = None
+                raise
+            finally:
+                # the thread carries on when the task awaiting it is cancelled, until the search sees this
+                tour.travel_guide.cancelled.set()
+
+            for name in self.TOUR_STATE:
+                setattr(self, name, getattr(tour, name))
+            self.travel_guide.metrics = tour.travel_guide.metrics
+
+        return response
+
     def get_next_step(self, scanned_room: ScannedRoom) -> TourGuideResponse:
 
         if not self.started:
@@ -107,11 +156,24 @@ class TourGuide:
         response.reachable_rooms = self.reachable_rooms
         return response
 
+    def _get_nearest_unvisited(self, vnum: str, avoid: set, count: int = 1,
+                               cost_range: float = inf) -> List[TravelPath]:
+        """Return paths to the nearest unvisited rooms, from the distance field while it still tells which"""
+        distances = self.distance_field
+        nearest = None
+        if distances is not None and distances.move_to(vnum):
+            nearest = distances.nearest(self.unvisited_rooms, count, cost_range)
+
+        if nearest is None:
+            distances = self.distance_field = self.travel_guide.get_distance_field(vnum, avoid, self.reachable_rooms)
+            nearest = distances.nearest(self.unvisited_rooms, count, cost_range)
+
+        return [distances.path_to(v) for v in nearest]
+
     def _next_step_nu(self, scanned_room: ScannedRoom) -> TourGuideResponse:
         """Choose exit to head towards the nearest unvisited room"""
         avoid = self.area.get_excluded_room_vnums(self.level)
-        found = self.travel_guide.get_nearest_rooms_in_set(scanned_room.vnum,
-                                                           self.unvisited_rooms, avoid, self.reachable_rooms)
+        found = self._get_nearest_unvisited(scanned_room.vnum, avoid)
         if len(found) == 0:
             return TourGuideResponse(error=f"NU: No rooms found {scanned_room.vnum}")
 
@@ -134,20 +196,13 @@ class TourGuide:
 
         # print("avoid", avoid)
         near = []
-        best_cost = 9999
 
-        for path in self.travel_guide.get_nearest_rooms_in_set(scanned_room.vnum, self.unvisited_rooms,
-                                                               avoid, self.reachable_rooms, max_rooms=scan_rooms):
+        # the nearest rooms, and none more than cost_range dearer than the nearest
+        for path in self._get_nearest_unvisited(scanned_room.vnum, avoid, scan_rooms, cost_range):
             if len(path.steps) == 0:
                 continue
 
             cost = path.get_travel_cost()
-            if cost > best_cost + cost_range:
-                break
-
-            # print("%5s: %4d/%4d [%3d steps]" % (cur_vnum, cost, best_cost, len(path.steps)))
-            best_cost = min(cost, best_cost)
-
             pocket = self.travel_guide.get_reachable_rooms_in_known_area(path.destination.vnum, self.area,
                                                                          self.unvisited_rooms, max_pocket_size)
             pocket_size = len(pocket)
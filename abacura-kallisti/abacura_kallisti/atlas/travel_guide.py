@@ -1,8 +1,18 @@
+import asyncio
+import copy
 import heapq
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
-from typing import Dict, Set, List, Generator, Callable
+from math import inf
+from typing import Dict, Set, List, Generator, Callable, Optional
 from itertools import groupby
 
+from textual import log
+
+from abacura_kallisti.atlas.heuristics import LandmarkHeuristic, WildernessHeuristic
 from abacura_kallisti.atlas.wilderness import WildernessGrid
 from abacura_kallisti.atlas.world import World
 from abacura_kallisti.atlas.room import Exit, Room, Area
@@ -73,9 +83,244 @@ class SpecialExit:
     exit: Exit
 
 
-class TravelGuide:
+class PathCache:
+    """
+    The most recently found paths of a World, dropped whenever World.version changes
+
+    The paths are copied in and out, as callers truncate them while traveling, and searches on worker
+    threads share it, so it is locked.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.version: int = -1
+        self.hits: int = 0
+        self.misses: int = 0
+        self._paths: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _copy(path: TravelPath) -> TravelPath:
+        new_path = TravelPath(path.destination)
+        new_path.steps = list(path.steps)
+        return new_path
+
+    def get(self, key: tuple, version: int) -> Optional[TravelPath]:
+        with self._lock:
+            if version != self.version:
+                self._paths.clear()
+                self.version = version
+
+            path = self._paths.get(key)
+            if path is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._paths.move_to_end(key)
+            return self._copy(path)
+
+    def put(self, key: tuple, version: int, path: TravelPath):
+        with self._lock:
+            if version != self.version:
+                return
+
+            self._paths[key] = self._copy(path)
+            if len(self._paths) > self.size:
+                self._paths.popitem(last=False)
+
+
+class DistanceField:
+    """
+    The cheapest costs and paths from a room to the rooms it can reach, by a Dijkstra search that is carried
+    on only as far as each question needs
+
+    Moving to a room along the paths keeps the costs of the rooms whose paths go through it exact, less the
+    cost of getting there, and the costs of the others become lower bounds.  The nearest rooms are still
+    known while they have exact costs, so the same field serves every step towards them.
+    """
+
+    def __init__(self, guide: "TravelGuide", start_vnum: str, avoid_vnums: Set[str] = None,
+                 allowed_vnums: Set[str] = None):
+        self.guide = guide
+        self.world = guide.world
+        self.version = self.world.version
+        self.start = start_vnum
+        self.avoid_vnums = avoid_vnums or set()
+        self.allowed_vnums = allowed_vnums
+        self.special_exits = guide._get_special_exits()
+
+        self.frontier = [(0, start_vnum)]
+        self.came_from: Dict[str, (str, Exit, int)] = {start_vnum: (start_vnum, Exit(), 0)}
+        # the cost from the first start, final for settled rooms
+        self.costs: Dict[str, float] = {start_vnum: 0}
+        self.settled: Set[str] = set()
+        # settled rooms whose paths go through the start
+        self.exact: Set[str] = set()
+        self.children: Dict[str, List[str]] = defaultdict(list)
+        # False once the search stopped early, so costs may be missing
+        self.complete = True
+
+    def cost(self, vnum: str) -> float:
+        """Return the cost from the start to a settled vnum, a lower bound if it is not exact, else inf"""
+        return self.costs[vnum] - self.costs[self.start] if vnum in self.settled else inf
+
+    def move_to(self, vnum: str) -> bool:
+        """Start from vnum, a room with an exact cost, returns False if it isn't or the rooms changed since"""
+        if not self.complete or self.world.version != self.version or vnum not in self.exact:
+            return False
+
+        if vnum != self.start:
+            self.start = vnum
+            self.exact = set()
+            below = [vnum]
+            while below:
+                vnum = below.pop()
+                self.exact.add(vnum)
+                below.extend(self.children.get(vnum, ()))
+
+        return True
+
+    def _queued_cost(self) -> float:
+        """The lowest cost of the rooms not settled yet"""
+        while self.frontier and self.frontier[0][1] in self.settled:
+            heapq.heappop(self.frontier)
+
+        return self.frontier[0][0] if self.frontier else inf
+
+    def _settle_until(self, vnums: Set[str]) -> bool:
+        """Settle rooms until one of vnums is, returns False if the search ran out of rooms first"""
+        guide = self.guide
+        rooms = self.world.rooms
 
-    def __init__(self, world: World, pc: PlayerCharacter, level: int = 0, avoid_home: bool = False):
+        while self.frontier:
+            if guide.cancelled.is_set() or len(self.settled) > guide.max_expansions:
+                self.complete = False
+                return False
+
+            current_cost, current_vnum = heapq.heappop(self.frontier)
+            if current_vnum in self.settled:
+                continue
+
+            self.settled.add(current_vnum)
+            from_vnum = self.came_from[current_vnum][0]
+            if current_vnum == self.start or from_vnum in self.exact:
+                self.exact.add(current_vnum)
+            if from_vnum != current_vnum:
+                self.children[from_vnum].append(current_vnum)
+
+            self._expand(rooms.get(current_vnum), current_cost)
+            if current_vnum in vnums:
+                return True
+
+        return False
+
+    def _expand(self, current_room: Optional[Room], current_cost: float):
+        """Queue the rooms the exits of current_room lead to, by the same rules as TravelGuide._gen_astar()"""
+        if current_room is None or current_room.vnum in self.avoid_vnums:
+            return
+
+        if self.allowed_vnums and current_room.vnum not in self.allowed_vnums:
+            return
+
+        if current_room.deathtrap or current_room.terrain.impassable:
+            return
+
+        level = self.guide.level
+        room_se = [se.exit for se in self.special_exits
+                   if se.exit.to_vnum not in self.settled and se.check(current_room)]
+
+        for room_exit in chain(list(current_room.exits.values()), room_se):
+            to_vnum = room_exit.to_vnum
+            if to_vnum in self.settled or room_exit.locks:
+                continue
+
+            if not (room_exit.max_level >= level >= room_exit.min_level):
+                continue
+
+            to_room = self.world.rooms.get(to_vnum)
+            if to_room is None:
+                continue
+
+            new_cost = current_cost + to_room.terrain.weight
+            if to_vnum in self.costs and new_cost >= self.costs[to_vnum]:
+                continue
+
+            heapq.heappush(self.frontier, (new_cost, to_vnum))
+            self.costs[to_vnum] = new_cost
+            self.came_from[to_vnum] = (current_room.vnum, room_exit, new_cost)
+
+    def nearest(self, vnums: Set[str], count: int = 1, cost_range: float = inf) -> Optional[List[str]]:
+        """
+        Return up to count of vnums that are cheapest to reach, nearest first, and within cost_range of the nearest
+
+        Returns None if a room without an exact cost could be among them, then a new field is needed.
+        """
+        more = True
+        while True:
+            # exact costs first among equal ones, a lower bound that ties is no nearer
+            found = heapq.nsmallest(count, (v for v in vnums if v in self.settled),
+                                    key=lambda v: (self.costs[v], v not in self.exact))
+            if any(v not in self.exact for v in found):
+                return None
+
+            # rooms not settled yet cost at least as much as the cheapest queued
+            queued = self._queued_cost()
+            if found and (len(found) == count and self.costs[found[-1]] <= queued
+                          or self.costs[found[0]] + cost_range < queued):
+                break
+
+            if not more:
+                break
+
+            more = self._settle_until(vnums)
+
+        if found:
+            limit = self.costs[found[0]] + cost_range
+            found = [v for v in found if self.costs[v] <= limit]
+
+        return found
+
+    def path_to(self, vnum: str) -> TravelPath:
+        """Return the path from the start to vnum, with no destination if it has no exact cost"""
+        if vnum not in self.exact:
+            return TravelPath()
+
+        path = TravelPath(self.world.rooms.get(vnum))
+        while vnum != self.start:
+            from_vnum, room_exit, cost = self.came_from[vnum]
+            path.add_step(TravelStep(from_vnum, room_exit, cost - self.costs[from_vnum]))
+            vnum = from_vnum
+
+        path.reverse()
+        return path
+
+
+class TravelGuide:
+    """
+    Finds the cheapest paths from a room to one or more goal rooms
+
+    With astar=True this is an A* search, guided by a heuristic lower bound on the remaining cost where one
+    applies, which expands rooms in the same order as Dijkstra otherwise.  With astar=False it is the original
+    search, which adds a penalty to the cost of moving away from a single goal in the wilderness instead.
+    By default (astar=None) A* is used once the World's landmarks are ready, and the original search until then,
+    as without landmarks A* expands far more rooms crossing the wilderness.
+
+    With hierarchical=True, an A* path to a room in another area is first routed between areas by the World's
+    area router, and rooms are searched only within the areas on that route, falling back to searching
+    all rooms if there is no path through them.  The route is not always the cheapest, since crossing the
+    wilderness is estimated, so it is off by default.  The metrics of the last search are kept in metrics.
+
+    Paths found by get_path_to_room() are kept in a PathCache shared by all guides of the same World, until
+    a change to the World's rooms bumps its version.
+
+    path_async() runs the search on a worker thread instead, for callers on the event loop.  A search stops
+    early, returning what it found so far, once its cancelled event is set.
+    """
+    _path_caches: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def __init__(self, world: World, pc: PlayerCharacter, level: int = 0, avoid_home: bool = False,
+                 astar: Optional[bool] = None, max_expansions: int = 60000, hierarchical: bool = False):
         super().__init__()
         self.world: World = world
         self.wilderness_grid = WildernessGrid()
@@ -84,19 +329,128 @@ class TravelGuide:
         self.pc: PlayerCharacter = pc
         self.level = level
         self.avoid_home = avoid_home
+        self.astar = astar
+        self.max_expansions = max_expansions
+        self.hierarchical = hierarchical
         self.metrics = {}
+        # set from another thread to stop a search, see path_async()
+        self.cancelled = threading.Event()
+
+    @property
+    def path_cache(self) -> PathCache:
+        path_cache = self._path_caches.get(self.world)
+        if path_cache is None:
+            path_cache = self._path_caches[self.world] = PathCache()
+
+        return path_cache
+
+    def use_astar(self) -> bool:
+        """Return True if searches are A*, by default once the landmarks are ready to guide them"""
+        return self.world.landmarks.ready() if self.astar is None else self.astar
 
     def get_path_to_room(self, start_vnum: str, goal_vnum: str,
                          avoid_vnums: Set[str], allowed_vnums: Set[str] = None) -> TravelPath:
+        if avoid_vnums or allowed_vnums:
+            return self._get_path_to_room(start_vnum, goal_vnum, avoid_vnums, allowed_vnums)
+
+        # the special exits depend on where home, egress and recall are
+        key = (start_vnum, goal_vnum, self.level, self.avoid_home, self.use_astar(), self.max_expansions,
+               self.pc.home_vnum, self.pc.egress_vnum, self.pc.recall_vnum)
+        version = self.world.version
+        path = self.path_cache.get(key, version)
+        if path is not None:
+            self.metrics = {'search': 'cached', 'rooms expanded': 0, 'cache hits': self.path_cache.hits}
+            return path
+
+        path = self._get_path_to_room(start_vnum, goal_vnum, avoid_vnums, allowed_vnums)
+        if not self.cancelled.is_set():
+            self.path_cache.put(key, version, path)
+        return path
+
+    def _copy_for_thread(self, **changes) -> "TravelGuide":
+        """Return a copy of this guide to search on a worker thread, with its own metrics and cancelled event"""
+        guide = copy.copy(self)
+        guide.__dict__.update(changes)
+        guide.metrics = {}
+        guide.cancelled = threading.Event()
+        return guide
+
+    async def path_async(self, start_vnum: str, goal_vnum: str, avoid_vnums: Set[str] = None,
+                         timeout: float = 5) -> TravelPath:
+        """
+        Find a path as get_path_to_room() does, on a worker thread so input and output carry on meanwhile
+
+        Cancelling the task awaiting this stops the search, so a worker run with exclusive=True for a newer
+        request replaces the one before.  An A* search still running after three quarters of timeout seconds is
+        stopped, and the original search (astar=False), which heads straight for the goal in the wilderness, is
+        given the rest of the time instead.  An empty path is returned if neither finishes in time.
+        """
+        avoid_vnums = set() if avoid_vnums is None else avoid_vnums
+        deadline = time.monotonic() + timeout
+
+        # update what searches share here on the event loop, where the rooms don't change under them
+        astar = self.use_astar()
+        if self.hierarchical and astar:
+            self.world.area_router.update()
+
+        search = self._copy_for_thread(astar=astar)
+        search_timeout = timeout * 0.75 if astar else timeout
+        try:
+            try:
+                path = await asyncio.wait_for(asyncio.to_thread(search.get_path_to_room, start_vnum, goal_vnum,
+                                                                avoid_vnums), search_timeout)
+            except asyncio.TimeoutError:
+                search.cancelled.set()
+                log.warning(f"Path search from {start_vnum} to {goal_vnum} stopped after {search_timeout:.1f}s")
+                if not astar:
+                    return TravelPath()
+
+                search = self._copy_for_thread(astar=False)
+                try:
+                    path = await asyncio.wait_for(asyncio.to_thread(search.get_path_to_room, start_vnum, goal_vnum,
+                                                                    avoid_vnums), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    log.warning(f"No path from {start_vnum} to {goal_vnum} found within {timeout}s")
+                    path = TravelPath()
+                search.metrics['timed out'] = search_timeout
+        finally:
+            # the thread carries on when the task awaiting it is cancelled, until the search sees this
+            search.cancelled.set()
+            self.metrics = search.metrics
+
+        return path
+
+    def _get_path_to_room(self, start_vnum: str, goal_vnum: str,
+                          avoid_vnums: Set[str], allowed_vnums: Set[str] = None) -> TravelPath:
         try:
             if start_vnum not in self.world.rooms:
                 return TravelPath()
 
+            if self.hierarchical and self.use_astar():
+                path = self._get_path_in_corridor(start_vnum, goal_vnum, avoid_vnums, allowed_vnums)
+                if path is not None:
+                    return path
+
             path = next(self._gen_nearest_rooms(start_vnum, {goal_vnum}, avoid_vnums, allowed_vnums))
             return path
         except StopIteration:
             return TravelPath()
 
+    def _get_path_in_corridor(self, start_vnum: str, goal_vnum: str, avoid_vnums: Set[str],
+                              allowed_vnums: Set[str] = None) -> Optional[TravelPath]:
+        """Return the path found within the areas routed through, or None if there is no route or path"""
+        router = self.world.area_router
+        start_time = time.perf_counter()
+        corridor = router.get_corridor(start_vnum, goal_vnum, self._get_special_exits())
+        route_ms = round((time.perf_counter() - start_time) * 1000, 1)
+        if corridor is None:
+            return None
+
+        path = next(self._gen_astar(start_vnum, {goal_vnum}, avoid_vnums, allowed_vnums, corridor), None)
+        self.metrics.update(router.metrics)
+        self.metrics['area route ms'] = route_ms
+        return path
+
     def get_nearest_rooms_in_set(self, start_vnum: str, goal_vnums: Set[str],
                                  avoid_vnums: Set[str] = None, allowed_vnums: Set[str] = None,
                                  max_rooms: int = 1) -> List[TravelPath]:
@@ -112,6 +466,11 @@ class TravelGuide:
 
         return found
 
+    def get_distance_field(self, start_vnum: str, avoid_vnums: Set[str] = None,
+                           allowed_vnums: Set[str] = None) -> DistanceField:
+        """Return the costs and paths from start to other rooms, by the exits get_nearest_rooms_in_set() takes"""
+        return DistanceField(self, start_vnum, avoid_vnums, allowed_vnums)
+
     def _convert_came_from_to_path(self, dest_vnum: str, came_from: Dict) -> TravelPath:
         if dest_vnum not in self.world.rooms:
             return TravelPath()
@@ -181,6 +540,102 @@ class TravelGuide:
 
     def _gen_nearest_rooms(self, start_vnum: str, goal_vnums: Set[str], avoid_vnums: Set[str],
                            allowed_vnums: Set[str] = None) -> Generator[TravelPath, None, None]:
+        if self.use_astar():
+            return self._gen_astar(start_vnum, goal_vnums, avoid_vnums, allowed_vnums)
+
+        return self._gen_dijkstra(start_vnum, goal_vnums, avoid_vnums, allowed_vnums)
+
+    def _get_heuristic(self, start_vnum: str, goal_vnums: Set[str],
+                       special_exits: List[SpecialExit]) -> Optional[Callable[[str], float]]:
+        special_vnums = [se.exit.to_vnum for se in special_exits]
+        wilderness = WildernessHeuristic.for_query(self.world, start_vnum, goal_vnums, special_vnums)
+        return LandmarkHeuristic.for_query(self.world, goal_vnums, special_vnums, wilderness) or wilderness
+
+    def _gen_astar(self, start_vnum: str, goal_vnums: Set[str], avoid_vnums: Set[str],
+                   allowed_vnums: Set[str] = None,
+                   allowed_areas: Set[str] = None) -> Generator[TravelPath, None, None]:
+        goal_vnums = set(goal_vnums)
+        special_exits = self._get_special_exits()
+
+        start_time = time.perf_counter()
+        heuristic = self._get_heuristic(start_vnum, goal_vnums, special_exits)
+        self.metrics = {'search': 'A*', 'heuristic': heuristic.name if heuristic else 'none',
+                        'heuristic ms': round((time.perf_counter() - start_time) * 1000, 1),
+                        'rooms expanded': 0, 'rooms queued': 1, 'goals found': 0}
+
+        # Ordered by estimated total cost, then the deepest first (highest cost so far) to break ties
+        estimate = heuristic(start_vnum) if heuristic else 0
+        frontier = [(estimate, 0, start_vnum)]
+        came_from: Dict[str, (str, Exit, int)] = {start_vnum: (start_vnum, Exit(), 0)}
+        cost_so_far = {start_vnum: 0}
+        expanded = set()
+        # rooms looked up during this search, wilderness rooms are otherwise recreated each time they are seen
+        rooms: Dict[str, Room] = {}
+
+        while frontier and len(expanded) <= self.max_expansions and goal_vnums and not self.cancelled.is_set():
+            _, current_cost, current_vnum = heapq.heappop(frontier)
+            if current_vnum in expanded:
+                continue
+
+            current_cost = -current_cost
+            expanded.add(current_vnum)
+            self.metrics['rooms expanded'] = len(expanded)
+
+            if current_vnum in goal_vnums:
+                goal_vnums.discard(current_vnum)
+                self.metrics['goals found'] += 1
+                self.metrics['search ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+                yield self._convert_came_from_to_path(current_vnum, came_from)
+
+            current_room = rooms.get(current_vnum) or self.world.rooms.get(current_vnum)
+            if current_room is None or current_vnum in avoid_vnums:
+                continue
+
+            if allowed_vnums and current_vnum not in allowed_vnums:
+                continue
+
+            if current_room.deathtrap or current_room.terrain.impassable:
+                continue
+
+            room_se = [se.exit for se in special_exits if se.exit.to_vnum not in expanded and se.check(current_room)]
+
+            for room_exit in chain(list(current_room.exits.values()), room_se):
+                to_vnum = room_exit.to_vnum
+                if to_vnum in expanded or room_exit.locks:
+                    continue
+
+                if not (room_exit.max_level >= self.level >= room_exit.min_level):
+                    continue
+
+                to_room = rooms.get(to_vnum)
+                if to_room is None:
+                    to_room = self.world.rooms.get(to_vnum)
+                    if to_room is None:
+                        continue
+                    rooms[to_vnum] = to_room
+
+                if allowed_areas is not None and to_room.area_name not in allowed_areas:
+                    continue
+
+                new_cost = current_cost + to_room.terrain.weight
+                if to_vnum in cost_so_far and new_cost >= cost_so_far[to_vnum]:
+                    continue
+
+                estimate = heuristic(to_vnum) if heuristic else 0
+                if estimate == inf:
+                    continue
+
+                heapq.heappush(frontier, (new_cost + estimate, -new_cost, to_vnum))
+                self.metrics['rooms queued'] += 1
+                cost_so_far[to_vnum] = new_cost
+                came_from[to_vnum] = (current_vnum, room_exit, new_cost)
+
+        self.metrics['search ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+        if self.cancelled.is_set():
+            self.metrics['cancelled'] = True
+
+    def _gen_dijkstra(self, start_vnum: str, goal_vnums: Set[str], avoid_vnums: Set[str],
+                      allowed_vnums: Set[str] = None) -> Generator[TravelPath, None, None]:
 
         # This is a priority queue using heapq, the lowest weight item will heappop() off the list
         frontier = []
@@ -197,15 +652,21 @@ class TravelGuide:
         # skip_areas = set()
         # self.metrics['skip_areas'] = len(skip_areas)
 
+        self.metrics = {'search': 'Dijkstra'}
+
         n = 0
-        while len(frontier) > 0 and n <= 60000:
+        while len(frontier) > 0 and n <= self.max_expansions:
+            if self.cancelled.is_set():
+                self.metrics['cancelled'] = True
+                break
+
             n += 1
             current_cost, current_vnum = heapq.heappop(frontier)
 
             if current_vnum in goal_vnums:
                 # self.session.debug('NAV: gen examined %d rooms' % len(came_from))
                 # self.metrics['areas skipped'] = len(skip_areas)
-                self.metrics['rooms visited'] = n
+                self.metrics['rooms expanded'] = n
                 yield self._convert_came_from_to_path(current_vnum, came_from)
 
             current_room = self.world.rooms[current_vnum]
@@ -232,7 +693,7 @@ class TravelGuide:
 
             room_se = [se.exit for se in special_exits if se.exit.to_vnum not in came_from and se.check(current_room)]
 
-            for room_exit in chain(current_room.exits.values(), room_se):
+            for room_exit in chain(list(current_room.exits.values()), room_se):
 
                 if room_exit.to_vnum in came_from and room_exit.to_vnum not in goal_vnums:
                     continue
@@ -276,34 +737,29 @@ class TravelGuide:
     def get_reachable_rooms_in_known_area(self, start_vnum: str, area: Area,
                                           allowed_rooms: Set[str] = None, max_steps: int = 999999,
                                           consider_locks_reachable: bool = False) -> set:
-        visited = set()
-        frontier = {start_vnum}
         room: Room = self.world.rooms[start_vnum]
+        area_index = self.world.area_index
+        components = area_index.get_components(area, self.level, consider_locks_reachable)
 
         if area.track_random_portals:
-            vnums = [r.vnum for r in self.world.rooms.values() if r.area_name == room.area_name]
-            vnums = [v for v in vnums if self.is_navigable_room_in_area(area, v)]
-            vnums = [v for v in vnums if allowed_rooms is None or v in allowed_rooms]
-            return set(vnums)
+            vnums = area_index.rooms_in_area(room.area_name) & components.nodes
+            return {v for v in vnums if allowed_rooms is None or v in allowed_rooms}
 
+        if allowed_rooms is None and max_steps > len(components.nodes):
+            return components.reachable(start_vnum)
+
+        visited = set()
+        frontier = {start_vnum}
         while len(frontier) > 0 and max_steps > 0:
             max_steps -= 1
             room_vnum = frontier.pop()
-            if room_vnum not in self.world.rooms:
-                continue
-
             visited.add(room_vnum)
-            # room = self.world.rooms[room_vnum]
-
-            for e in self.world.rooms[room_vnum].exits.values():
-                if not self.is_navigable_room_in_area(area, e.to_vnum):
-                    continue
 
-                if allowed_rooms is not None and e.to_vnum not in allowed_rooms:
+            for to_vnum in components.next_rooms(room_vnum):
+                if allowed_rooms is not None and to_vnum not in allowed_rooms:
                     continue
 
-                unreachable_lock = e.locks and not consider_locks_reachable
-                if e.to_vnum not in visited and e.to_vnum not in frontier and not unreachable_lock:
-                    frontier.add(e.to_vnum)
+                if to_vnum not in visited and to_vnum not in frontier:
+                    frontier.add(to_vnum)
 
         return visited
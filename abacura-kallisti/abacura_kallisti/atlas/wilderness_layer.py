@@ -0,0 +1,207 @@
+"""
+Wilderness rooms held in NumPy arrays indexed by [y, x] of the wilderness grid
+
+The wilderness is a fixed grid of about 58k rooms that differ only in name, terrain, flags and dates,
+and whose exits follow from their position.  Keeping them as arrays instead of Room objects saves
+memory and load time; Room objects are created on demand by get_room().
+"""
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .room import Exit, Room
+from .wilderness import WildernessGrid
+
+WILDERNESS_AREA = 'The Wilderness'
+
+FLAG_FIELDS = ['regen_hp', 'regen_mp', 'regen_sp', 'set_recall', 'peaceful', 'deathtrap', 'silent', 'wild_magic',
+               'bank', 'narrow', 'no_magic', 'no_recall']
+
+
+class WildernessLayer:
+    """Name, terrain, flags and visit dates of every known wilderness room"""
+
+    def __init__(self):
+        self.grid = WildernessGrid()
+        shape = (self.grid.HEIGHT, self.grid.WIDTH)
+        # codes index into terrain_names and names, -1 terrain means there is no known room
+        self.terrain = np.full(shape, -1, dtype=np.int16)
+        self.name = np.zeros(shape, dtype=np.int16)
+        self.flags = np.zeros(shape, dtype=np.uint16)
+        # dates are kept as the strings stored in the database so they round trip exactly
+        self.last_visited = np.full(shape, None, dtype=object)
+        self.last_harvested = np.full(shape, None, dtype=object)
+
+        self.terrain_names: List[str] = []
+        self.names: List[str] = []
+        self._terrain_codes: Dict[str, int] = {}
+        self._name_codes: Dict[str, int] = {}
+        # persisted exits, for the few wilderness rooms that have any
+        self.exits: Dict[str, Dict[str, Exit]] = {}
+        self.count: int = 0
+        self._cells = self.grid.WIDTH * self.grid.HEIGHT
+        self._flag_values: Dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, vnum: str) -> bool:
+        point = self.point(vnum)
+        return point is not None and self.terrain[point[1], point[0]] >= 0
+
+    def point(self, vnum: str) -> Optional[tuple]:
+        """Return the (x, y) of a wilderness vnum, or None if it is not on the grid"""
+        try:
+            v = int(vnum)
+        except (TypeError, ValueError):
+            return None
+
+        # same as WildernessGrid.get_point, everything is shifted due to the hole
+        d = v + (v >= 87523) - self.grid.UPPER_LEFT
+        if not 0 <= d < self._cells:
+            return None
+
+        return d % self.grid.WIDTH, d // self.grid.WIDTH
+
+    def accepts(self, room: Room) -> bool:
+        return room.area_name == WILDERNESS_AREA and self.point(room.vnum) is not None
+
+    def terrain_code(self, terrain_name: str) -> int:
+        code = self._terrain_codes.get(terrain_name)
+        if code is None:
+            code = self._terrain_codes[terrain_name] = len(self.terrain_names)
+            self.terrain_names.append(terrain_name)
+
+        return code
+
+    def name_code(self, name: str) -> int:
+        code = self._name_codes.get(name)
+        if code is None:
+            code = self._name_codes[name] = len(self.names)
+            self.names.append(name)
+
+        return code
+
+    def set_room(self, room: Room):
+        x, y = self.point(room.vnum)
+        if self.terrain[y, x] < 0:
+            self.count += 1
+
+        self.terrain[y, x] = self.terrain_code(room.terrain_name)
+        self.name[y, x] = self.name_code(room.name)
+        self.flags[y, x] = sum(1 << i for i, f in enumerate(FLAG_FIELDS) if getattr(room, f))
+        self.last_visited[y, x] = room.last_visited
+        self.last_harvested[y, x] = room.last_harvested
+
+        if room._exits:
+            self.exits[room.vnum] = room._exits
+        else:
+            self.exits.pop(room.vnum, None)
+
+    def remove(self, vnum: str):
+        point = self.point(vnum)
+        if point is None or self.terrain[point[1], point[0]] < 0:
+            return
+
+        x, y = point
+        self.terrain[y, x] = -1
+        self.last_visited[y, x] = None
+        self.last_harvested[y, x] = None
+        self.exits.pop(vnum, None)
+        self.count -= 1
+
+    def get_room(self, vnum: str) -> Optional[Room]:
+        """Create a Room for vnum, sharing its persisted exits dict with the layer"""
+        point = self.point(vnum)
+        if point is None:
+            return None
+
+        x, y = point
+        terrain = self.terrain[y, x]
+        if terrain < 0:
+            return None
+
+        flags = int(self.flags[y, x])
+        flag_values = self._flag_values.get(flags)
+        if flag_values is None:
+            flag_values = self._flag_values[flags] = tuple(bool(flags & (1 << i)) for i in range(len(FLAG_FIELDS)))
+
+        exits = self.exits.get(vnum)
+        if exits is None:
+            exits = {}
+
+        return Room(vnum, self.names[self.name[y, x]], self.terrain_names[terrain], WILDERNESS_AREA, *flag_values,
+                    self.last_visited[y, x], self.last_harvested[y, x], exits)
+
+    def vnums(self) -> Iterator[str]:
+        ys, xs = np.nonzero(self.terrain >= 0)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            yield self.grid.get_vnum_at_point(x, y)
+
+    def visited_count(self) -> int:
+        """Return how many rooms have been visited"""
+        return int(np.count_nonzero((self.terrain >= 0) & np.not_equal(self.last_visited, None)))
+
+    def vnums_named(self, word: str) -> Iterator[str]:
+        """Yield the vnums of rooms whose name contains word, which must be lower case"""
+        codes = [code for code, name in enumerate(self.names) if word in name.lower()]
+        if not codes:
+            return
+
+        ys, xs = np.nonzero(np.isin(self.name, codes) & (self.terrain >= 0))
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            yield self.grid.get_vnum_at_point(x, y)
+
+    def load_rows(self, room_rows: list, exit_rows: list) -> list:
+        """
+        Fill the arrays from rows of Room and Exit persistent fields, all at once
+
+        Returns the room rows that are not on the wilderness grid.
+        """
+        rejected = []
+        if room_rows:
+            fields = Room.persistent_fields()
+            vnum_index = fields.index('vnum')
+            v = np.array([int(r) if r.isdigit() else -1 for r in (row[vnum_index] for row in room_rows)], dtype=np.int64)
+            # everything is shifted due to the hole
+            v = v + (v >= 87523) - self.grid.UPPER_LEFT
+            on_grid = (v >= 0) & (v < self._cells)
+            if not on_grid.all():
+                rejected = [row for row, ok in zip(room_rows, on_grid.tolist()) if not ok]
+                room_rows = [row for row, ok in zip(room_rows, on_grid.tolist()) if ok]
+                v = v[on_grid]
+
+            columns = list(zip(*room_rows)) if room_rows else [()] * len(fields)
+            ys, xs = v // self.grid.WIDTH, v % self.grid.WIDTH
+
+            self.count += int(np.count_nonzero(self.terrain[ys, xs] < 0))
+            for array, column, encode in ((self.terrain, 'terrain_name', self.terrain_code),
+                                          (self.name, 'name', self.name_code)):
+                values = columns[fields.index(column)]
+                codes = {value: encode(value) for value in set(values)}
+                array[ys, xs] = [codes[value] for value in values]
+
+            flags = np.zeros(len(room_rows), dtype=np.uint16)
+            for i, f in enumerate(FLAG_FIELDS):
+                flags |= np.array(columns[fields.index(f)], dtype=bool).astype(np.uint16) << i
+
+            self.flags[ys, xs] = flags
+            self.last_visited[ys, xs] = columns[fields.index('last_visited')]
+            self.last_harvested[ys, xs] = columns[fields.index('last_harvested')]
+
+        for row in exit_rows:
+            new_exit = Exit(*row)
+            self.exits.setdefault(new_exit.from_vnum, {})[new_exit.direction] = new_exit
+
+        return rejected
+
+    def rows(self) -> tuple:
+        """Return (room rows, exit rows) of persistent fields, the inverse of load_rows"""
+        room_rows = []
+        for vnum in self.vnums():
+            room = self.get_room(vnum)
+            room_rows.append([getattr(room, pf) for pf in room.persistent_fields()])
+
+        exit_rows = [[getattr(e, pf) for pf in e.persistent_fields()]
+                     for exits in self.exits.values() for e in exits.values() if not e.temporary]
+        return room_rows, exit_rows
@@ -1,7 +1,9 @@
 from collections import Counter
 from datetime import datetime
 from functools import lru_cache
-from typing import List, Dict
+from typing import List, Dict, Tuple
+
+import numpy as np
 
 from .terrain import SKILL_TERRAIN, TERRAIN
 from .wilderness import WildernessGrid
@@ -68,7 +70,7 @@ class WildernessMap:
                 if not 0 <= xs < self.grid.WIDTH:
                     continue
 
-                sample_vnum = self.grid.get_vnum(self.grid.UPPER_LEFT, xs, ys)
+                sample_vnum = self.grid.get_vnum_at_point(xs, ys)
                 room = self.world.rooms.get(sample_vnum, None)
                 if room is not None:
                     if room.vnum == you_vnum and not self.sampled_you:
@@ -115,6 +117,145 @@ class WildernessMap:
 
         return sample_terrain, harvestable
 
+    def terrain_codes(self) -> Tuple[np.ndarray, List[str]]:
+        """
+        Return the terrain of every cell of the grid as codes into a list of terrain names, -1 where no room is known
+        Rooms outside of The Wilderness that have a vnum on the grid are included, as sample() would find them
+        """
+        layer = self.world.rooms.wilderness
+        codes = layer.terrain.copy()
+        names = list(layer.terrain_names)
+        name_codes = {name: code for code, name in enumerate(names)}
+
+        for vnum, room in self.world.rooms.regular.items():
+            point = layer.point(vnum)
+            if point is None or self.grid.get_vnum_at_point(*point) != vnum:
+                continue
+
+            if room.terrain_name not in name_codes:
+                name_codes[room.terrain_name] = len(names)
+                names.append(room.terrain_name)
+
+            codes[point[1], point[0]] = name_codes[room.terrain_name]
+
+        return codes, names
+
+    def harvested_since(self, since: datetime) -> np.ndarray:
+        """Return a mask of the grid cells whose room was harvested at or after since"""
+        layer = self.world.rooms.wilderness
+        harvested = np.zeros(layer.terrain.shape, dtype=bool)
+        since = str(since)
+
+        # dates are stored as the str() of a datetime, which sorts the same way
+        ys, xs = np.nonzero(layer.last_harvested.astype(bool))
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            harvested[y, x] = str(layer.last_harvested[y, x]) >= since
+
+        for vnum, room in self.world.rooms.regular.items():
+            point = layer.point(vnum)
+            if point is not None and room.last_harvested and self.grid.get_vnum_at_point(*point) == vnum:
+                harvested[point[1], point[0]] = str(room.last_harvested) >= since
+
+        return harvested
+
+    @staticmethod
+    def summed_area(mask: np.ndarray) -> np.ndarray:
+        """Summed area table of the last two axes of mask, padded with a leading row and column of zeros"""
+        table = np.zeros(mask.shape[:-2] + (mask.shape[-2] + 1, mask.shape[-1] + 1), dtype=np.int32)
+        table[..., 1:, 1:] = mask.cumsum(axis=-2, dtype=np.int32).cumsum(axis=-1)
+        return table
+
+    def sample_map(self, scale_width: int, scale_height: int, skill: str = '', since: datetime = None,
+                   you_vnum: str = '') -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Sample the whole wilderness down to scale_width x scale_height at once, as get_scaled_map() used to by
+        calling sample() for each cell, row by row.
+
+        Every terrain count of every sample window comes from a summed area table of that terrain, and the
+        most common terrain, the landmark overrides and the harvestable counts are then applied to all windows
+        as arrays.  Only windows with a tie for most common terrain are looked at individually, to pick the
+        terrain seen first as Counter.most_common() does.
+
+        :return: (terrain name, harvestable) arrays of shape (scale_height, scale_width)
+        """
+        codes, names = self.terrain_codes()
+        name_codes = {name: code for code, name in enumerate(names)}
+        height, width = codes.shape
+
+        x_scale = self.grid.WIDTH / (scale_width - 1)
+        y_scale = self.grid.HEIGHT / (scale_height - 1)
+        x_radius = x_scale / 2
+        y_radius = y_scale / 2
+
+        # sample() counts the cells from int(center - radius) to int(center + radius) that are on the grid
+        cx = np.array([round(x * x_scale) for x in range(scale_width)])
+        cy = np.array([round(y * y_scale) for y in range(scale_height)])
+        x0 = np.clip(np.trunc(cx - x_radius).astype(int), 0, width)
+        x1 = np.maximum(x0, np.clip(np.trunc(cx + x_radius).astype(int) + 1, 0, width))
+        y0 = np.clip(np.trunc(cy - y_radius).astype(int), 0, height)
+        y1 = np.maximum(y0, np.clip(np.trunc(cy + y_radius).astype(int) + 1, 0, height))
+        y0, y1 = y0[:, np.newaxis], y1[:, np.newaxis]
+
+        def window_sums(table: np.ndarray) -> np.ndarray:
+            return table[..., y1, x1] - table[..., y0, x1] - table[..., y1, x0] + table[..., y0, x0]
+
+        one_hot = codes == np.arange(len(names), dtype=codes.dtype)[:, np.newaxis, np.newaxis]
+        counts = window_sums(self.summed_area(one_hot))
+        sampled_area = np.maximum(1, counts.sum(axis=0))
+
+        top = counts.max(axis=0, initial=0)
+        result = np.where(top > 0, counts.argmax(axis=0), len(names))
+        tied = (top > 0) & ((counts == top).sum(axis=0) > 1)
+
+        # Override based on percent of area for specific terrain types to highlight certain features
+        # Override percentages change with scale of map, the first that applies wins
+        terrain_pct = [('Underground', 0),
+                       ('Lava', 100/sampled_area), ('Arctic', 200/sampled_area), ('Snow', 600/sampled_area),
+                       ('Water', np.maximum(12.0, sampled_area/10)), ('Peak', 400/sampled_area), ('Mountains', 35)]
+        overridden = np.zeros(result.shape, dtype=bool)
+        for t, pct in reversed(terrain_pct):
+            if t in name_codes:
+                override = counts[name_codes[t]] > sampled_area * pct / 100
+                result = np.where(override, name_codes[t], result)
+                overridden |= override
+
+        for y, x in zip(*np.nonzero(tied & ~overridden)):
+            window = codes[y0[y, 0]:y1[y, 0], x0[x]:x1[x]].ravel()
+            window = window[window >= 0]
+            result[y, x] = window[np.argmax(counts[:, y, x][window] == top[y, x])]
+
+        terrain_names = np.array(names + [''], dtype=object)[result]
+
+        # Field Bridge, then You, are only shown in the first sample they are found in
+        self.sampled_gummton = False
+        gummton = -1
+        if 'Field Bridge' in name_codes:
+            found = np.flatnonzero(counts[name_codes['Field Bridge']] > 0)
+            if len(found):
+                self.sampled_gummton = True
+                gummton = found[0]
+                terrain_names.flat[gummton] = 'Field Bridge'
+
+        self.sampled_you = False
+        you_point = self.world.rooms.wilderness.point(you_vnum)
+        if you_point is not None and codes[you_point[1], you_point[0]] >= 0 and \
+                self.grid.get_vnum_at_point(*you_point) == you_vnum:
+            px, py = you_point
+            found = np.flatnonzero((y0 <= py) & (py < y1) & (x0 <= px) & (px < x1))
+            found = found[found != gummton]
+            if len(found):
+                self.sampled_you = True
+                terrain_names.flat[found[0]] = 'You'
+
+        harvestable_terrain = SKILL_TERRAIN.get(skill, [])
+        harvest_cells = np.isin(codes, [name_codes[t] for t in harvestable_terrain if t in name_codes])
+        if since is not None:
+            harvest_cells &= ~self.harvested_since(since)
+
+        harvestable = window_sums(self.summed_area(harvest_cells)) >= 0.4 * sampled_area
+
+        return terrain_names, harvestable
+
     @staticmethod
     def get_bg_color_code(bright: int, bg_color: str) -> str:
         bg_color = bg_color.replace('bright_', '')
@@ -170,27 +311,9 @@ class WildernessMap:
 
     def get_scaled_map(self, scale_width: int = 100, scale_height: int = 30, ruler: bool = False, you_vnum: str = '',
                        skill: str = '', since: datetime = None) -> List[str]:
-        scaled_map = []
         map_lines: List[str] = []
-        self.sampled_you = False
-        self.sampled_gummton = False
-
-        x_scale = self.grid.WIDTH / (scale_width - 1)
-        y_scale = self.grid.HEIGHT / (scale_height - 1)
-        x_radius = x_scale / 2
-        y_radius = y_scale / 2
-        radii = (x_radius, y_radius)
-        area = (2*x_radius+1)*(2*y_radius+1)
-        print("scaled map: ", (scale_width, scale_height), (x_scale, y_scale), radii, area)
-
-        for y in range(scale_height):
-            row = []
-            for x in range(scale_width):
-                cx = round(x * x_scale)
-                cy = round(y * y_scale)
-                center = (cx, cy)
-                row.append(self.sample(center, radii, skill, since, you_vnum))
-            scaled_map.append(row)
+        terrain_names, harvestable = self.sample_map(scale_width, scale_height, skill, since, you_vnum)
+        scaled_map = [list(zip(names, harvest)) for names, harvest in zip(terrain_names.tolist(), harvestable.tolist())]
 
         if ruler:
             x_ruler = [u"\u001b[0;37m\u001b[48;5;0m  "] + ["%d" % (x % 10) for x in range(len(scaled_map[0]))]
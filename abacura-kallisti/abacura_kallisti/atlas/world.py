@@ -1,36 +1,219 @@
+import atexit
+import gc
+import itertools
+import marshal
 import re
 import sqlite3
+import struct
+import threading
+import time
+import weakref
 from dataclasses import fields
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict
+from collections import OrderedDict, defaultdict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import List, Dict, Iterator, Optional, Set, Tuple
 
+from textual import log
+
+from abacura.utils.db_maintenance import db_maintenance
+from abacura.utils.file_writer import atomic_write
+
+from .area_index import AreaIndex
+from .area_router import AreaRouter
+from .landmarks import Landmarks
 from .room import ScannedRoom, Exit, Room
 from .wilderness import WildernessGrid
+from .wilderness_layer import WildernessLayer, WILDERNESS_AREA
 
 
 # TODO: Use the abacura methods for strip_ansi_codes
 ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 
 
+# Persistent (room fields, exit rows) for a room to save, or None to delete it
+RoomRows = Optional[Tuple[list, List[list]]]
+
+# Increment when the layout of the snapshot file changes
+SNAPSHOT_VERSION = 1
+
+
+@contextmanager
+def gc_paused():
+    """Creating tens of thousands of objects would otherwise trigger several full garbage collections"""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+class RoomIndex(MutableMapping):
+    """
+    Rooms by vnum, rooms on the wilderness grid are kept in a WildernessLayer and the rest in a dict
+
+    A Room for a wilderness vnum is created when it is looked up and shared for as long as anything holds on to it.
+    The most recently created are also kept, so repeated path searches through the same area don't recreate them.
+    Changes made to it directly are copied back to the layer by sync(), which World.save_room() calls.  Changes
+    that are not saved are lost once nothing holds the Room and it is no longer among the most recent.
+
+    values() and items() create a Room for every wilderness vnum, scans that only need some rooms should
+    use regular and the wilderness layer instead.
+
+    Path searches look rooms up on worker threads while the event loop saves them, so changes to the index and
+    the wilderness layer, and wilderness lookups, are made holding lock.
+    """
+    def __init__(self, recent_wilderness_rooms: int = 8192):
+        self.regular: Dict[str, Room] = {}
+        self.wilderness = WildernessLayer()
+        self._wilderness_rooms: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._recent: OrderedDict = OrderedDict()
+        self._recent_size = recent_wilderness_rooms
+        self.lock = threading.RLock()
+
+    def __getitem__(self, vnum: str) -> Room:
+        room = self.regular.get(vnum)
+        if room is not None:
+            return room
+
+        with self.lock:
+            room = self._wilderness_rooms.get(vnum)
+            if room is None:
+                room = self.wilderness.get_room(vnum)
+                if room is None:
+                    raise KeyError(vnum)
+
+                self._wilderness_rooms[vnum] = room
+                self._recent[vnum] = room
+                if len(self._recent) > self._recent_size:
+                    self._recent.popitem(last=False)
+
+        return room
+
+    def get(self, vnum: str, default=None) -> Optional[Room]:
+        try:
+            return self[vnum]
+        except KeyError:
+            return default
+
+    def __contains__(self, vnum) -> bool:
+        return vnum in self.regular or vnum in self.wilderness
+
+    def __setitem__(self, vnum: str, room: Room):
+        with self.lock:
+            if room.vnum == vnum and self.wilderness.accepts(room):
+                self.regular.pop(vnum, None)
+                self.wilderness.set_room(room)
+                self._wilderness_rooms[vnum] = room
+                self._recent.pop(vnum, None)
+            else:
+                self.wilderness.remove(vnum)
+                self._wilderness_rooms.pop(vnum, None)
+                self._recent.pop(vnum, None)
+                self.regular[vnum] = room
+
+    def __delitem__(self, vnum: str):
+        with self.lock:
+            if vnum in self.regular:
+                del self.regular[vnum]
+            elif vnum in self.wilderness:
+                self.wilderness.remove(vnum)
+                self._wilderness_rooms.pop(vnum, None)
+                self._recent.pop(vnum, None)
+            else:
+                raise KeyError(vnum)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.regular
+        yield from self.wilderness.vnums()
+
+    def __len__(self) -> int:
+        return len(self.regular) + len(self.wilderness)
+
+    def sync(self, room: Room):
+        """Copy changes made directly to a wilderness Room back to the layer"""
+        with self.lock:
+            if room.vnum in self.wilderness and self.wilderness.accepts(room):
+                self.wilderness.set_room(room)
+
+
 class World:
-    def __init__(self, db_filename: str):
+    """
+    Rooms and exits, held in memory and persisted to sqlite
+
+    save_room() and delete_room() only record the rows to write for the room, replacing any not yet written.
+    A writer thread writes them every flush_interval seconds in a single transaction on its own connection.
+    Call flush() before reading the database directly, it is also called at exit.
+
+    At exit the rooms are also saved to a marshal snapshot next to the database, keyed by the database file's
+    mtime and size (after a checkpoint empties the WAL), the schema version and the room and exit fields.
+    The next start loads the snapshot instead of querying sqlite if the key still matches.  It is not written if
+    another World was open on the same database meanwhile, as its rooms may not match the database.
+    """
+    # the Worlds open on each database file, see close()
+    _open: Dict[str, Set["World"]] = defaultdict(set)
+
+    def __init__(self, db_filename: str, flush_interval: float = 0.5):
         db_path = Path(db_filename).expanduser()
 
-        self.rooms: Dict[str, Room] = {}
+        self.db_path = db_path
+        self.snapshot_path = db_path.with_suffix(".snapshot")
+        self.rooms: RoomIndex = RoomIndex()
         self.wilderness_loaded: bool = False
+        self.load_source: str = "database"
+        self.wilderness_load_time: float = 0
+        # marshalled wilderness (room rows, exit rows) from the snapshot, kept until the wilderness is first entered
+        self._snapshot_wilderness: Optional[bytes] = None
+        self._snapshot_has_wilderness: bool = False
+        # the key of the snapshot as last loaded or written
+        self._snapshot_key: Optional[tuple] = None
+        # bumped whenever rooms, exits or flags change in a way that can change paths
+        self.version: int = 0
+        self.closed: bool = False
+        # set if another World is open on the same database at any time while this one is
+        self.shared: bool = False
+        open_worlds = World._open[str(db_path.resolve())]
+        for other in open_worlds:
+            other.shared = True
+        self.shared = bool(open_worlds)
+        open_worlds.add(self)
 
         # temporary portals do not get persisted
         self.grid = WildernessGrid()
         self.db_conn = sqlite3.connect(db_path)
         self.db_conn.execute("PRAGMA journal_mode=WAL")
+        db_maintenance.register(db_path, self.db_conn)
         self.create_tables()
+        # only databases from before last_visited moved into rooms have room_tracking
+        self.has_room_tracking = self.db_conn.execute("select 1 from sqlite_master where type = 'table' "
+                                                      "and name = 'room_tracking'").fetchone() is not None
+        # changes made through db_conn after this (with #sql) are not reflected in the rooms
+        self._db_conn_changes = self.db_conn.total_changes
+
+        self.flush_interval = flush_interval
+        self.rooms_written: int = 0
+        self.writes_coalesced: int = 0
+        self.transactions_written: int = 0
+        self.pending: Dict[str, RoomRows] = {}
+        self._condition = threading.Condition()
+        self._writing = threading.Lock()
+        self.writer_conn = sqlite3.connect(db_path, check_same_thread=False)
+        db_maintenance.register(db_path, self.writer_conn)
+        self._thread = threading.Thread(target=self._run, name="abacura-world-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
 
         from datetime import datetime
         start_time = datetime.utcnow()
-        self.load()
-        # Future - optimization
-        # self.area_transits = self.get_area_transits()
+        if not self.load_snapshot():
+            self.load()
+        self.landmarks = Landmarks(self)
+        self.area_router = AreaRouter(self)
+        self.area_index = AreaIndex(self)
 
         self.load_time = (datetime.utcnow() - start_time).total_seconds()
 
@@ -49,10 +232,11 @@ class World:
             return
 
         room = self.rooms[vnum]
-        if direction not in room.exits:
+        if direction not in room._exits:
             return
 
-        del room.exits[direction]
+        del room._exits[direction]
+        self.bump_version()
         self.save_room(vnum)
 
     def set_exit(self, vnum: str, direction: str, door: str = '', to_vnum: str = None, commands: str = ''):
@@ -60,28 +244,27 @@ class World:
             return
 
         room = self.rooms[vnum]
-        exit = room.exits.get(direction, Exit(direction=direction, from_vnum=vnum))
+        exit = room._exits.get(direction)
+        if exit is None:
+            # a temporary wilderness exit is shared, so persist a copy of it instead
+            temporary_exit = room.exits.get(direction)
+            exit = Exit(direction=direction, from_vnum=vnum, to_vnum=temporary_exit.to_vnum if temporary_exit else '')
+
         exit.door = door
         exit.commands = commands
 
         if to_vnum is not None:
             exit.to_vnum = to_vnum
 
-        room.exits[direction] = exit
+        room._exits[direction] = exit
 
+        self.bump_version()
         self.save_room(vnum)
 
-        # to_room = self.rooms.get(to_vnum, None)
-        # if to_room is None or to_room.area_name != room.area_name:
-        #     # recompute transits
-        #     self.area_transits = self.get_area_transits()
-
     def search(self, word: str) -> List[Room]:
         word = word.lower()
-        result = []
-        for r in self.rooms.values():
-            if r.name.lower().find(word) >= 0:
-                result.append(r)
+        result = [r for r in self.rooms.regular.values() if r.name.lower().find(word) >= 0]
+        result += [self.rooms[vnum] for vnum in self.rooms.wilderness.vnums_named(word)]
         return result
 
     # def track_kill(self, vnum: str):
@@ -105,6 +288,10 @@ class World:
             existing_room = Room()
             existing_exits = {}
 
+        # the existing exits are updated in place below, so note what paths depend on first
+        before = (existing_room.area_name, existing_room.terrain_name,
+                  {d: (e.to_vnum, e.locks) for d, e in existing_exits.items()})
+
         new_exits = existing_exits.copy()
 
         for d, to_vnum in room_exits.items():
@@ -147,8 +334,13 @@ class World:
                         last_visited=str(datetime.utcnow()),
                         last_harvested=existing_room.last_harvested)
 
+        after = (area_name, terrain, {d: (e.to_vnum, e.locks) for d, e in new_exits.items()})
+        changed = vnum not in self.rooms or after != before
+        if changed:
+            self.bump_version()
+
         self.rooms[vnum] = new_room
-        self.save_room(vnum)
+        self.save_room(vnum, changed)
 
     def create_tables(self):
 
@@ -205,61 +397,242 @@ class World:
         if vnum in self.rooms:
             del self.rooms[vnum]
 
-        self.db_conn.execute("delete from exits where from_vnum = ?", vnum)
-        self.db_conn.execute("delete from exits where to_vnum = ?", vnum)
-        self.db_conn.execute("delete from room_tracking where vnum = ? ", vnum)
-        self.db_conn.execute("delete from rooms where vnum = ? ", vnum)
+        self.bump_version()
+        self.room_changed(vnum)
+        self._schedule(vnum, None)
+
+    def bump_version(self):
+        """Record a change to rooms, exits or flags that can change paths, so cached paths are not used"""
+        self.version += 1
+
+    def room_changed(self, vnum: str):
+        """Let the landmarks, area router and area index know a room or its exits may have changed"""
+        self.landmarks.room_changed(vnum)
+        self.area_router.room_changed(vnum)
+        self.area_index.room_changed(vnum)
 
-    def save_room(self, vnum: str):
+    def save_room(self, vnum: str, changed: bool = True):
+        """Record the rows to write for a room, pass changed=False if nothing that routes depend on changed"""
         if vnum not in self.rooms:
             return
 
         room = self.rooms[vnum]
+        self.rooms.sync(room)
+        if changed:
+            self.room_changed(vnum)
         room_fields = [getattr(room, pf) for pf in room.persistent_fields()]
-        
-        room_binds = ",".join("?" * len(room_fields))
+        exit_rows = [[getattr(room_exit, pf) for pf in room_exit.persistent_fields()]
+                     for room_exit in room.exits.values() if not room_exit.temporary]
 
-        self.db_conn.execute("BEGIN TRANSACTION")
-        self.db_conn.execute(f"INSERT OR REPLACE INTO rooms VALUES({room_binds})", room_fields)
+        self._schedule(vnum, (room_fields, exit_rows))
 
-        self.db_conn.execute(f"DELETE FROM exits WHERE from_vnum = ?", (vnum,))
+    def _schedule(self, vnum: str, rows: RoomRows):
+        with self._condition:
+            if vnum in self.pending:
+                self.writes_coalesced += 1
 
-        for room_exit in room.exits.values():
-            if room_exit.temporary:
-                continue
-            exit_fields = [getattr(room_exit, pf) for pf in room_exit.persistent_fields()]
-            exit_binds = ','.join('?' * len(exit_fields))
-            self.db_conn.execute(f"INSERT INTO exits VALUES({exit_binds})", exit_fields)
+            self.pending[vnum] = rows
+            if len(self.pending) == 1:
+                self._condition.notify()
 
-        self.db_conn.commit()
+    def _write_pending(self):
+        # caller must hold _writing
+        with self._condition:
+            pending, self.pending = self.pending, {}
 
-    def load(self, where_clause: str = "where area_name != 'The Wilderness'"):
-        cursor = self.db_conn.execute(f"select * from rooms {where_clause}")
-        # field_names = [c[0] for c in cursor.description]
-        rows = cursor.fetchall()
-        for row in rows:
-            # d = {name: value for name, value in zip(field_names, row)}
-            new_room = Room(*row)
-            self.rooms[new_room.vnum] = new_room
+        if not pending:
+            return
+
+        try:
+            with self.writer_conn:
+                for vnum, rows in pending.items():
+                    self.writer_conn.execute("DELETE FROM exits WHERE from_vnum = ?", (vnum,))
+                    if rows is None:
+                        self.writer_conn.execute("DELETE FROM exits WHERE to_vnum = ?", (vnum,))
+                        if self.has_room_tracking:
+                            self.writer_conn.execute("DELETE FROM room_tracking WHERE vnum = ?", (vnum,))
+                        self.writer_conn.execute("DELETE FROM rooms WHERE vnum = ?", (vnum,))
+                        continue
+
+                    room_fields, exit_rows = rows
+                    room_binds = ",".join("?" * len(room_fields))
+                    self.writer_conn.execute(f"INSERT OR REPLACE INTO rooms VALUES({room_binds})", room_fields)
+                    if exit_rows:
+                        exit_binds = ",".join("?" * len(exit_rows[0]))
+                        self.writer_conn.executemany(f"INSERT INTO exits VALUES({exit_binds})", exit_rows)
+
+            self.rooms_written += len(pending)
+            self.transactions_written += 1
+        except sqlite3.Error as exc:
+            log.error(f"Unable to save {len(pending)} rooms: {exc!r}")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self.pending:
+                    self._condition.wait()
+
+            # let changes accumulate so a speedwalk is written in one transaction
+            time.sleep(self.flush_interval)
+            with self._writing:
+                self._write_pending()
+
+    def flush(self):
+        """Write all pending room changes now on the calling thread"""
+        with self._writing:
+            self._write_pending()
 
-        # print(len(rows), "rooms loaded from db")
+    def load(self, where_clause: str = "where area_name != 'The Wilderness'"):
+        room_rows = self.db_conn.execute(f"select * from rooms {where_clause}").fetchall()
 
         sql = f"select e.* from exits e join rooms r on e.from_vnum = r.vnum {where_clause}"
-        cursor = self.db_conn.execute(sql)
-        rows = cursor.fetchall()
+        exit_rows = self.db_conn.execute(sql).fetchall()
+
+        self.build_rooms(room_rows, exit_rows)
+
+    def build_rooms(self, room_rows: list, exit_rows: list):
+        """Create rooms and their exits from rows of persistent fields, wilderness rooms go to the layer"""
+        wilderness = self.rooms.wilderness
+        area_index = Room.persistent_fields().index('area_name')
+
+        with gc_paused(), self.rooms.lock:
+            wilderness_rows = [row for row in room_rows if row[area_index] == WILDERNESS_AREA]
+            if wilderness_rows:
+                # rooms off the wilderness grid come back to be created as usual
+                room_rows = [row for row in room_rows if row[area_index] != WILDERNESS_AREA]
+                room_rows += wilderness.load_rows(wilderness_rows, [])
+
+            for row in room_rows:
+                new_room = Room(*row)
+                self.rooms.regular[new_room.vnum] = new_room
+
+            wilderness_exit_rows = []
+            for row in exit_rows:
+                room = self.rooms.regular.get(row[0])
+                if room is not None:
+                    new_exit = Exit(*row)
+                    room._exits[new_exit.direction] = new_exit
+                elif row[0] in wilderness:
+                    wilderness_exit_rows.append(row)
+
+            wilderness.load_rows([], wilderness_exit_rows)
+
+    def snapshot_key(self) -> Optional[tuple]:
+        """Identify the database contents, returns None if the WAL holds changes not yet in the database file"""
+        wal_path = Path(str(self.db_path) + "-wal")
+        if wal_path.exists() and wal_path.stat().st_size > 0:
+            return None
+
+        st = self.db_path.stat()
+        user_version = self.db_conn.execute("pragma user_version").fetchone()[0]
+        return (SNAPSHOT_VERSION, user_version, tuple(Room.persistent_fields()), tuple(Exit.persistent_fields()),
+                st.st_mtime_ns, st.st_size)
+
+    def load_snapshot(self) -> bool:
+        """Load rooms from the snapshot, returns False if there is none or it does not match the database"""
+        try:
+            key = self.snapshot_key()
+            if key is None or not self.snapshot_path.exists():
+                return False
+
+            # marshal.load() on a file reads in tiny pieces, it is much faster to read it all first
+            key_data, rooms_data, wilderness_data = self.split_snapshot(self.snapshot_path.read_bytes())
+            if marshal.loads(key_data) != key:
+                return False
+
+            with gc_paused():
+                self.build_rooms(*marshal.loads(rooms_data))
+        except (OSError, EOFError, ValueError, TypeError, struct.error) as exc:
+            log.warning(f"Unable to load world snapshot {self.snapshot_path}: {exc!r}")
+            return False
+
+        # the wilderness is only decoded when it is first entered
+        self._snapshot_wilderness = bytes(wilderness_data) if len(wilderness_data) else None
+        self._snapshot_has_wilderness = self._snapshot_wilderness is not None
+        self._snapshot_key = key
+        self.load_source = "snapshot"
+        return True
+
+    @staticmethod
+    def split_snapshot(data: bytes) -> List[memoryview]:
+        """Split a snapshot into its key, rooms and wilderness sections, each preceded by its length"""
+        data = memoryview(data)
+        sections = []
+        offset = 0
+        while offset < len(data):
+            length, = struct.unpack_from("<I", data, offset)
+            sections.append(data[offset + 4:offset + 4 + length])
+            offset += 4 + length
+
+        return sections
+
+    def checkpoint(self) -> Optional[tuple]:
+        """Write pending rooms and move the WAL into the database file, returns the snapshot key or None if busy"""
+        with self._writing:
+            self._write_pending()
+            busy, _, _ = self.writer_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+
+        return None if busy else self.snapshot_key()
+
+    def save_snapshot(self, key: Optional[tuple] = None):
+        """Write the rooms to the snapshot file, with the key checkpoint() returns if not given"""
+        if key is None:
+            key = self.checkpoint()
+            if key is None:
+                return
+
+        rows = {True: self.rooms.wilderness.rows(), False: ([], [])}
+        for room in self.rooms.regular.values():
+            room_rows, exit_rows = rows[room.area_name == WILDERNESS_AREA]
+            room_rows.append([getattr(room, pf) for pf in room.persistent_fields()])
+            exit_rows.extend([getattr(e, pf) for pf in e.persistent_fields()]
+                             for e in room._exits.values() if not e.temporary)
+
+        if self.wilderness_loaded:
+            wilderness_data = marshal.dumps(rows[True])
+        else:
+            wilderness_data = self._snapshot_wilderness or b''
 
-        for row in rows:
-            new_exit = Exit(*row)
-            if new_exit.from_vnum in self.rooms:
-                self.rooms[new_exit.from_vnum].exits[new_exit.direction] = new_exit
+        sections = [marshal.dumps(key), marshal.dumps(rows[False]), wilderness_data]
+        atomic_write(self.snapshot_path, b''.join(struct.pack("<I", len(s)) + s for s in sections))
+        self._snapshot_has_wilderness = len(wilderness_data) > 0
+        self._snapshot_key = key
 
-        # print(len(rows), "exits loaded from db")
+    def close(self):
+        """Write pending rooms and landmarks and, if they changed since the snapshot was written, a new snapshot"""
+        if self.closed:
+            return
+
+        self.closed = True
+        atexit.unregister(self.close)
+        World._open[str(self.db_path.resolve())].discard(self)
+        self.flush()
+        # landmarks computed on the background thread are saved to the database there
+        self.landmarks.wait()
+        self.landmarks.save()
+
+        if self.shared or self.db_conn.total_changes != self._db_conn_changes:
+            # Another World or #sql changed the database, so these rooms may not match it
+            return
+
+        try:
+            # the key is taken after every write, so it still matches the database at the next start
+            key = self.checkpoint()
+            wilderness_added = self.wilderness_loaded and not self._snapshot_has_wilderness
+            if key is None or (key == self._snapshot_key and not wilderness_added):
+                return
+
+            self.save_snapshot(key)
+        except (OSError, sqlite3.Error) as exc:
+            log.error(f"Unable to save world snapshot {self.snapshot_path}: {exc!r}")
 
     def get_area_transits(self):
         """Return a list of rooms you can get to from each area"""
         area_transits = {}
 
-        for r in self.rooms.values():
+        # wilderness exits only lead out of the wilderness if they are persisted
+        wilderness_rooms = [self.rooms[vnum] for vnum in self.rooms.wilderness.exits]
+        for r in itertools.chain(self.rooms.regular.values(), wilderness_rooms):
             area_name = r.area_name
             for e in r._exits.values():
                 try:
@@ -275,5 +648,14 @@ class World:
 
     def load_wilderness(self):
         if not self.wilderness_loaded:
-            self.load("where area_name = 'The Wilderness'")
+            start = time.perf_counter()
+            if self._snapshot_wilderness is not None:
+                with gc_paused():
+                    self.build_rooms(*marshal.loads(self._snapshot_wilderness))
+                self._snapshot_wilderness = None
+            else:
+                self.load("where area_name = 'The Wilderness'")
+
             self.wilderness_loaded = True
+            self.bump_version()
+            self.wilderness_load_time = time.perf_counter() - start
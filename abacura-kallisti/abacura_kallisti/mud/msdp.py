@@ -1,10 +1,17 @@
 from dataclasses import dataclass, field
+from abacura.plugins.events import AbacuraMessage
 from abacura_kallisti.mud.group import Group
 from abacura_kallisti.mud.affect import Affect
 from abacura_kallisti.mud.skills import SKILL_COMMANDS, SKILLS
 from typing import List, Dict
 import re
 
+@dataclass
+class TypedMSDPUpdate(AbacuraMessage):
+    """Dispatched once per MSDP burst after the TypedMSDP fields have been updated"""
+    changed: List[str] = field(default_factory=list)
+    event_type: str = "lok.msdp.updated"
+
 
 @dataclass(slots=True)
 class TypedMSDP:
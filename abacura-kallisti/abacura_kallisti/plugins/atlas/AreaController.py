@@ -7,6 +7,7 @@ import abacura.utils.renderables as tblt
 from abacura.plugins import command, CommandError
 from abacura.utils.renderables import tabulate, AbacuraPropertyGroup, AbacuraPanel, Group
 from abacura_kallisti.atlas.wilderness import WildernessGrid
+from abacura_kallisti.atlas.wilderness_layer import WILDERNESS_AREA
 from abacura_kallisti.atlas.world import Room, Exit
 from abacura_kallisti.plugins import LOKPlugin
 
@@ -32,16 +33,18 @@ class AreaController(LOKPlugin):
             else:
                 raise CommandError('Unknown area')
         else:
-            areas = {r.area_name: True for r in self.world.rooms.values()}
-            match_areas = [a for a in areas.keys() if a.lower().startswith(area.lower())]
+            areas = {r.area_name for r in self.world.rooms.regular.values()}
+            if len(self.world.rooms.wilderness):
+                areas.add(WILDERNESS_AREA)
+            match_areas = [a for a in areas if a.lower().startswith(area.lower())]
             match_areas.sort(key=lambda a: 100 - abs(len(a) - len(area)))
             if len(match_areas) == 0:
                 raise CommandError('Unknown area %s' % area)
             area = match_areas[0]
 
-        rooms = [r for r in self.world.rooms.values() if r.area_name == area]
-
-        sorted_rooms = list(sorted(rooms, key=lambda x: x.vnum))[:300]
+        # only the rooms shown are looked up, the wilderness has tens of thousands
+        vnums = self.world.area_index.rooms_in_area(area)
+        sorted_rooms = [self.world.rooms[vnum] for vnum in sorted(vnums)[:300]]
 
         rows = []
         r: Room
@@ -54,10 +57,13 @@ class AreaController(LOKPlugin):
                 rows.append([r.vnum, self.world.strip_ansi_codes(r.name), e.direction, e.to_vnum,
                              bool(e.closes), bool(e.locks), known, visited])
 
-        num_visited = len([r for r in rooms if r.last_visited])
+        if area == WILDERNESS_AREA:
+            num_visited = self.world.rooms.wilderness.visited_count()
+        else:
+            num_visited = len([v for v in vnums if self.world.rooms.regular[v].last_visited])
         headers = ("_Room", "Name", "Direction", "_To Room", "Closes", "Locks", "Known", "Visited")
         table = tabulate(rows, headers=headers,
-                         caption=f"{len(sorted_rooms)} of {len(rooms)} rooms shown.   {num_visited} visited")
+                         caption=f"{len(sorted_rooms)} of {len(vnums)} rooms shown.   {num_visited} visited")
         self.output(AbacuraPanel(table, title=f"Rooms in '{area}'"))
 
     @command()
@@ -123,6 +123,7 @@ class WorldController(LOKPlugin):
                 ("Flags: ", Style(color=OutputColors.field, bold=True)),
                 (str(self.get_room_flags(location)), OutputColors.value))
             self.output(AbacuraPanel(txt, title=f"Room [ {location.vnum} ] Flags"))
+            self.world.bump_version()
             self.world.save_room(location.vnum)
             return
 
@@ -238,6 +239,7 @@ class WorldController(LOKPlugin):
         :param query: The sql query to run
         :param _max_rows: Maximum rows to display
         """
+        self.world.flush()
         try:
             cursor = self.world.db_conn.execute(query)
         except Exception as e:
@@ -245,6 +247,8 @@ class WorldController(LOKPlugin):
             return
 
         if not cursor.description:
+            # the writer thread uses its own connection, so don't leave a write transaction open
+            self.world.db_conn.commit()
             self.output("executed")
             return
 
@@ -260,3 +264,35 @@ class WorldController(LOKPlugin):
             results = tabulate(rows, headers=headers, title="Results", caption=caption, expand=True)
 
         self.output(AbacuraPanel(Group(pview, Text(), results), "SQL Query", expand=True))
+
+    @command
+    def landmarks(self, rebuild: bool = False):
+        """
+        Show the landmark rooms used to bound path search costs
+
+        :param rebuild: Pick the landmarks and compute their costs again
+        """
+        landmarks = self.world.landmarks
+        if rebuild:
+            if not self.world.wilderness_loaded:
+                self.session.show_error("Landmarks wait until the wilderness is loaded")
+                return
+
+            landmarks.ready()
+            landmarks.wait()
+            landmarks.start_compute()
+
+        ready = landmarks.ready()
+        status = {"ready": ready, "computing": landmarks.computing, "landmarks": len(landmarks.landmarks),
+                  "rooms off grid": len(landmarks.vnums),
+                  "compute seconds": round(landmarks.compute_seconds, 1),
+                  "repairs": landmarks.repairs, "rooms repaired": landmarks.rooms_repaired}
+        pview = AbacuraPropertyGroup(status, title="Status")
+
+        rows = []
+        for vnum in landmarks.landmarks if ready else []:
+            room = self.world.rooms.get(vnum)
+            rows.append([vnum, room.name if room else '', room.area_name if room else ''])
+
+        results = tabulate(rows, headers=["Vnum", "Name", "Area"], title="Landmarks")
+        self.output(AbacuraPanel(Group(pview, Text(), results), "Landmarks", expand=True))
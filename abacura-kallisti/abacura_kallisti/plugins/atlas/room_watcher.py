@@ -288,6 +288,7 @@ class RoomWatcher(LOKPlugin):
                 r.no_magic = True
                 r.no_recall = True
                 self.output(f'[orange1]Marked room no recall/magic [{r.vnum}]', markup=True)
+                self.world.bump_version()
                 self.world.save_room(r.vnum)
 
     @action("^Your lips move,* but no sound")
@@ -297,6 +298,7 @@ class RoomWatcher(LOKPlugin):
             if not r.silent:
                 r.silent = True
                 self.output(f'[orange1]Marked room silent [{r.vnum}]', markup=True)
+                self.world.bump_version()
                 self.world.save_room(r.vnum)
 
     @action(r"^\[\* You see your target's tracks leading (\w+)\.")
@@ -53,7 +53,8 @@ class TravelHelper(LOKPlugin):
         tbl = tabulate(rows, headers=("_Vnum", "_To Vnum", "Commands", "Direction", "Door",
                                       "Closes", "Locks", "Cost", "Terrain"),
                        title=f"Steps",
-                       caption=f" Path computed in {1000 * path_elapsed_time:.1f}ms",
+                       caption=f" Path computed in {1000 * path_elapsed_time:.1f}ms, "
+                               f"{nav.metrics.get('rooms expanded', 0)} rooms expanded",
                        show_footer=True)
 
         tbl.columns[7].footer = str(nav_path.get_travel_cost())
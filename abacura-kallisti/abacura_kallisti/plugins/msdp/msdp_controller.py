@@ -2,39 +2,95 @@
 from __future__ import annotations
 
 from dataclasses import asdict, fields
+from typing import Any, Callable, Dict, List
 
 from rich.panel import Panel
 from rich.pretty import Pretty
 
 from abacura_kallisti.mud.affect import Affect
+from abacura_kallisti.mud.msdp import TypedMSDP, TypedMSDPUpdate
 from abacura_kallisti.plugins import LOKPlugin
 
-from abacura.mud.options.msdp import MSDPMessage
+from abacura.mud.options.msdp import MSDPBatchMessage
 from abacura.plugins import command, CommandError
 from abacura.plugins.events import event
 
 
+MSDPSetter = Callable[[TypedMSDP, Any], None]
+
+# MSDP variable names that are not simply the upper case TypedMSDP field name
+MSDP_NAMES = {'cls': 'CLASS', 'str_': 'STR', 'int_': 'INT'}
+
+# TypedMSDP fields nothing reads, not REPORTed unless a core.msdp.<VAR> listener asks for them.
+# SERVER_TIME, UPTIME and WORLD_TIME tick constantly, the rest describe the client and server.
+NOT_REPORTED = {'ANSI_COLORS', 'CLIENT_ID', 'CLIENT_VERSION', 'MXP', 'PLUGIN_ID', 'SERVER_ID', 'SERVER_TIME',
+                'SNIPPET_VERSION', 'SOUND', 'UPTIME', 'UTF_8', 'WORLD_TIME', 'XTERM_256_COLORS'}
+
+
+def msdp_name(field_name: str) -> str:
+    return MSDP_NAMES.get(field_name, field_name.upper())
+
+
+def _int_value(value) -> int:
+    return int(value) if value else 0
+
+
+def _field_setter(name: str, convert: Callable[[Any], Any] | None) -> MSDPSetter:
+    if convert is None:
+        return lambda msdp, value: setattr(msdp, name, value)
+
+    return lambda msdp, value: setattr(msdp, name, convert(value))
+
+
+def _set_group(msdp: TypedMSDP, value):
+    msdp.group.update_members_from_msdp(value)
+
+
+def _set_affects(msdp: TypedMSDP, value):
+    msdp.affects = sorted([Affect(name, int(hrs)) for name, hrs in value.items()], key=lambda a: a.name)
+
+
+def build_msdp_setters() -> Dict[str, MSDPSetter]:
+    """Map each MSDP variable name to a function that converts and stores its value in TypedMSDP"""
+    converters = {int: _int_value, str: str}
+    setters = {}
+    for f in fields(TypedMSDP):
+        setters[msdp_name(f.name)] = _field_setter(f.name, converters.get(f.type))
+
+    setters['GROUP'] = _set_group
+    setters['AFFECTS'] = _set_affects
+    return setters
+
+
 # TODO: disable the abacura @msdp command and let's implement it here
 class LOKMSDPController(LOKPlugin):
     """Converts core MSDP into typed LOK MSDP variables"""
     def __init__(self):
         super().__init__()
-        self.msdp_types = {f.name: f.type for f in fields(self.msdp)}
-        print(self.msdp_types)
+        self.setters: Dict[str, MSDPSetter] = build_msdp_setters()
+        self.core_msdp.require("TypedMSDP", {msdp_name(f.name) for f in fields(TypedMSDP)} - NOT_REPORTED)
 
     @command(name="msdp", override=True)
-    def lok_msdp_command(self, variable: str = '', reportable: bool = False, core: bool = False) -> None:
+    def lok_msdp_command(self, variable: str = '', reportable: bool = False, core: bool = False,
+                         report_all: bool = False) -> None:
         """
         Show MSDP values using typed LOK structure
 
         :param variable: Name of msdp variable to view.  Blank to view all
         :param reportable: Show reportable_variables (long list, off by default)
         :param core: Show the abacura core value instead of the typed LOK value
+        :param report_all: Toggle REPORTing every reportable variable instead of only those in use
         """
 
         if not self.msdp.reportable_variables:
             raise CommandError("MSDP not loaded")
 
+        if report_all:
+            self.core_msdp.set_report_all(not self.core_msdp.report_all)
+            state = "every reportable variable" if self.core_msdp.report_all else "only variables in use"
+            self.output(f"[bold]MSDP now reports {state}", markup=True)
+            return
+
         msdp_values = self.core_msdp.values.copy() if core else asdict(self.msdp)
 
         if not reportable:
@@ -49,34 +105,20 @@ class LOKMSDPController(LOKPlugin):
 
         self.session.output(panel, highlight=True, actionable=False)
 
-    @event("core.msdp", priority=1)
-    def update_lok_msdp(self, message: MSDPMessage):
-        # self.msdp.values[message.type] = message.value
-        attr_name = message.subtype.lower()
-
-        renames = {'class': 'cls', 'str': 'str_', 'int': 'int_'}
-        attr_name = renames.get(attr_name, attr_name)
-
-        if attr_name == 'ranged':
-            pass
+    def apply(self, values: Dict[str, Any]) -> List[str]:
+        """Store a batch of core MSDP values in the typed structure, returning the variables applied"""
+        applied = []
+        for var, value in values.items():
+            setter = self.setters.get(var)
+            if setter is None:
+                continue
 
-        # if not hasattr(self.msdp, attr_name):
-        #     self.output(f"[red]Missing msdp attribute {attr_name} {message.type}", markup=True)
-        #     return
+            setter(self.msdp, value)
+            applied.append(var)
 
-        value = message.value
-        if self.msdp_types[attr_name] == int:
-            value = 0 if len(message.value) == 0 else int(message.value)
-        elif self.msdp_types[attr_name] == str:
-            value = str(message.value)
-
-        if attr_name == 'group':
-            self.msdp.group.update_members_from_msdp(value)
-            self.msdp.group.update_members_from_msdp(value)
-        elif attr_name == 'affects' and type(value) is dict:
-            self.msdp.affects = sorted([Affect(name, int(hrs)) for name, hrs in value.items()], key=lambda a: a.name)
-        else:
-            setattr(self.msdp, attr_name, value)
+        return applied
 
-        # if name == 'MSDP_CHARACTER_NAME':
-        #     self.dispatch.dispatch(event.Event(event.NEW_CHARACTER, value))
+    @event(MSDPBatchMessage.event_type, priority=1)
+    def update_lok_msdp(self, message: MSDPBatchMessage):
+        if changed := self.apply(message.values):
+            self.dispatch(TypedMSDPUpdate(changed=changed))
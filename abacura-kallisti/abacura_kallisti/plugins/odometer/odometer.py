@@ -56,7 +56,14 @@ class OdometerController(LOKPlugin):
                          ))
 
         headers = ["#", "Mission", "Start", "Elapsed", "Kills/h", "XP/h", "$/h"]
-        self.output(AbacuraPanel(tabulate(rows, headers=headers), title="Odometers"))
+        caption = f"Last 10 minutes: {human_format(self.recent_rate('EXPERIENCE'))} XP/h, " \
+                  f"{human_format(self.recent_rate('GOLD'))} $/h"
+        self.output(AbacuraPanel(tabulate(rows, headers=headers, caption=caption), title="Odometers"))
+
+    def recent_rate(self, variable: str, minutes: int = 10) -> float:
+        """Hourly rate of change of an MSDP variable from its recorded history"""
+        series = self.core_msdp.timeseries.get(variable)
+        return 0.0 if series is None else series.rate(minutes * 60) * 3600
 
     @ticker(seconds=1, name="Odometer")
     def odometer_ticker(self):
@@ -75,7 +75,16 @@ class TourDemo(LOKPlugin):
         self.advance_tour()
 
     def advance_tour(self):
-        response = self.tour_guide.get_next_step(self.room)
+        # a step still being found for the room before is cancelled, this room replaces it
+        self.session.abacura.run_worker(self.take_tour_step(), group=f"tour-{self.session.name}",
+                                        exclusive=True, exit_on_error=False)
+
+    async def take_tour_step(self):
+        tour_guide = self.tour_guide
+        response = await tour_guide.get_next_step_async(self.room)
+        if tour_guide is not self.tour_guide:
+            # stopped or started again meanwhile
+            return
 
         if response.error:
             self.session.show_error(f"TOUR ERROR {response.error}")
@@ -32,6 +32,9 @@ class TravelResult(AbacuraMessage):
 
 class TravelScript(LOKPlugin):
     """Sends navigation commands after receiving lok.travel.request event"""
+    # seconds to find a path before settling for a quicker search
+    PATH_TIMEOUT = 5
+
     def __init__(self):
         super().__init__()
         self.navigation_path: Optional[TravelPath] = None
@@ -77,8 +80,19 @@ class TravelScript(LOKPlugin):
 
     def start_nav(self, destination: Room, avoid_home: bool = False):
         self.output(f"> start_nav {destination.vnum}")
-        self.travel_guide = TravelGuide(self.world, self.pc, self.msdp.level, avoid_home)
-        nav_path = self.travel_guide.get_path_to_room(self.msdp.room_vnum, destination.vnum, avoid_vnums=set())
+        travel_guide = self.travel_guide = TravelGuide(self.world, self.pc, self.msdp.level, avoid_home)
+        # rooms seen while the path is found don't move along the path before
+        self.navigation_path = None
+        # the path for an earlier request is cancelled, this one replaces it
+        self.session.abacura.run_worker(self.find_nav_path(travel_guide, destination),
+                                        group=f"travel-{self.session.name}", exclusive=True, exit_on_error=False)
+
+    async def find_nav_path(self, travel_guide: TravelGuide, destination: Room):
+        nav_path = await travel_guide.path_async(self.msdp.room_vnum, destination.vnum, timeout=self.PATH_TIMEOUT)
+        if travel_guide is not self.travel_guide:
+            # navigation ended meanwhile
+            return
+
         if not nav_path.destination:
             self.end_nav(False, f"Unable to compute path to {destination.vnum}")
             return
@@ -21,6 +21,9 @@ class XendorianOutpost(LOKPlugin):
                 room = self.world.rooms[self.msdp.room_vnum]
                 room._exits['amorphous'] = Exit(from_vnum=room.vnum, to_vnum=self.XENDORIAN_VNUM,
                                                 direction='amorphous', commands='enter amorphous', _temporary=True)
+                # a new exit can make paths cheaper, which the landmarks and area router need to know about
+                self.world.room_changed(room.vnum)
+                self.world.bump_version()
                 self.debuglog(f'Xendorian Portal: [{self.msdp.room_vnum}]')
 
     @action(r"^A portal stands here, its horizon (\w+) ")
@@ -43,7 +46,8 @@ class XendorianOutpost(LOKPlugin):
         """
         portals = []
 
-        for r in self.world.rooms.values():
+        # none of these areas are in the wilderness
+        for r in self.world.rooms.regular.values():
             if r.area_name in self.PORTAL_AREAS:
                 for d, e in r.exits.items():
                     if e.temporary and e.to_vnum == self.XENDORIAN_VNUM:
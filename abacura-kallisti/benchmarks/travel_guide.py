@@ -0,0 +1,164 @@
+"""
+Benchmark TravelGuide path searches on a synthetic world
+
+The world is a full wilderness of blobs of terrain crossed by a few paths, plus areas of rooms laid out
+in a grid, each entered from a wilderness room and some linked to each other by portals.  Times random
+queries within and between the wilderness and the areas, and long routes across the wilderness, with the
+original search, with A* without a heuristic (so Dijkstra), with A* and the wilderness heuristic alone,
+with that within the corridor of areas picked by the area router, and with A* and landmarks, and reports
+the rooms expanded and the cost of the paths found.  The last queries are then repeated from the path cache.
+
+    python benchmarks/travel_guide.py [queries per kind]
+"""
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from abacura_kallisti.atlas.heuristics import WildernessHeuristic
+from abacura_kallisti.atlas.room import Exit, Room
+from abacura_kallisti.atlas.travel_guide import TravelGuide
+from abacura_kallisti.atlas.wilderness import WildernessGrid
+from abacura_kallisti.atlas.wilderness_layer import WILDERNESS_AREA
+from abacura_kallisti.atlas.world import World
+from abacura_kallisti.mud.player import PlayerCharacter
+
+TERRAIN = ['Field', 'Forest', 'Hills', 'Mountains', 'Water', 'Field', 'Forest', 'Desert']
+AREAS = 40
+AREA_WIDTH = 10
+AREA_HEIGHT = 15
+PORTALS = 10
+
+
+class DijkstraGuide(TravelGuide):
+    def _get_heuristic(self, start_vnum, goal_vnums, special_exits):
+        return None
+
+
+class WildernessGuide(TravelGuide):
+    def _get_heuristic(self, start_vnum, goal_vnums, special_exits):
+        special_vnums = [se.exit.to_vnum for se in special_exits]
+        return WildernessHeuristic.for_query(self.world, start_vnum, goal_vnums, special_vnums)
+
+
+def area_vnum(area: int, x: int, y: int) -> str:
+    return str(1000 * (area + 1) + y * AREA_WIDTH + x)
+
+
+def build_world(world: World, rnd: random.Random):
+    grid = WildernessGrid()
+    noise = np.random.default_rng(1)
+    coarse = noise.integers(0, len(TERRAIN), size=(grid.HEIGHT // 6 + 1, grid.WIDTH // 6 + 1))
+    terrain = coarse.repeat(6, axis=0).repeat(6, axis=1)[:grid.HEIGHT, :grid.WIDTH]
+    peaks = noise.random(terrain.shape) < 0.01
+
+    empty = [False] * (len(Room.persistent_fields()) - 6)
+    room_rows = []
+    for y in range(grid.HEIGHT):
+        for x in range(grid.WIDTH):
+            vnum = grid.get_vnum_at_point(x, y)
+            if vnum == '':
+                continue
+
+            name = 'Path' if x % 50 == 25 or y % 40 == 20 else 'Peak' if peaks[y, x] else TERRAIN[terrain[y, x]]
+            room_rows.append([vnum, name, name, WILDERNESS_AREA] + empty + [None, None])
+
+    exit_rows = []
+    entrances = []
+    for area in range(AREAS):
+        for y in range(AREA_HEIGHT):
+            for x in range(AREA_WIDTH):
+                exits = {}
+                for direction, dx, dy in [('north', 0, -1), ('south', 0, 1), ('east', 1, 0), ('west', -1, 0)]:
+                    if 0 <= x + dx < AREA_WIDTH and 0 <= y + dy < AREA_HEIGHT:
+                        exits[direction] = Exit(area_vnum(area, x, y), direction, area_vnum(area, x + dx, y + dy))
+
+                vnum = area_vnum(area, x, y)
+                world.rooms[vnum] = Room(vnum=vnum, name=f"Room {vnum}", terrain_name='City',
+                                         area_name=f"Area {area}", _exits=exits)
+
+        entrance = area_vnum(area, 0, 0)
+        wild_vnum = grid.get_vnum_at_point(rnd.randrange(grid.WIDTH), rnd.randrange(grid.HEIGHT))
+        world.rooms[entrance]._exits['leave'] = Exit(entrance, 'leave', wild_vnum)
+        exit_rows.append([wild_vnum, 'enter', entrance] + [getattr(Exit(), f) for f in Exit.persistent_fields()[3:]])
+        entrances.append(entrance)
+
+    for _ in range(PORTALS):
+        a, b = rnd.sample(range(AREAS), 2)
+        from_vnum, to_vnum = area_vnum(a, AREA_WIDTH - 1, AREA_HEIGHT - 1), area_vnum(b, AREA_WIDTH - 1, 0)
+        world.rooms[from_vnum]._exits['portal'] = Exit(from_vnum, 'portal', to_vnum)
+
+    world.rooms.wilderness.load_rows(room_rows, exit_rows)
+
+
+def random_room(world: World, rnd: random.Random, wilderness: bool, columns: range = None) -> str:
+    if not wilderness:
+        return area_vnum(rnd.randrange(AREAS), rnd.randrange(AREA_WIDTH), rnd.randrange(AREA_HEIGHT))
+
+    grid = world.rooms.wilderness.grid
+    columns = columns or range(grid.WIDTH)
+    while True:
+        vnum = grid.get_vnum_at_point(rnd.choice(columns), rnd.randrange(grid.HEIGHT))
+        if vnum in world.rooms and not world.rooms[vnum].terrain.impassable:
+            return vnum
+
+
+def run(world: World, queries: int):
+    rnd = random.Random(1)
+    pc = PlayerCharacter()
+    pc.recall_vnum = pc.egress_vnum = area_vnum(2, 0, 0)
+
+    width = world.rooms.wilderness.grid.WIDTH
+    kinds = {'wilderness': (True, True), 'wilderness to area': (True, False),
+             'area to wilderness': (False, True), 'area to area': (False, False), 'long routes': (True, True)}
+
+    for kind, (start_wild, goal_wild) in kinds.items():
+        if kind == 'long routes':
+            pairs = [(random_room(world, rnd, True, range(0, 30)), random_room(world, rnd, True, range(width - 30, width)))
+                     for _ in range(queries)]
+        else:
+            pairs = [(random_room(world, rnd, start_wild), random_room(world, rnd, goal_wild)) for _ in range(queries)]
+
+        guides = {'original': TravelGuide(world, pc, level=50, astar=False),
+                  'Dijkstra': DijkstraGuide(world, pc, level=50, astar=True, hierarchical=False),
+                  'A*': WildernessGuide(world, pc, level=50, astar=True, hierarchical=False),
+                  'A* areas': WildernessGuide(world, pc, level=50, astar=True, hierarchical=True),
+                  'landmarks': TravelGuide(world, pc, level=50)}
+        # the same queries again, from the paths cached by the last guide
+        guides['cached'] = guides['landmarks']
+
+        for name, guide in guides.items():
+            if name != 'cached':
+                # don't reuse paths cached by the guide before
+                world.bump_version()
+
+            elapsed = expanded = cost = found = 0
+            for start_vnum, goal_vnum in pairs:
+                start = time.perf_counter()
+                path = guide.get_path_to_room(start_vnum, goal_vnum, avoid_vnums=set())
+                elapsed += time.perf_counter() - start
+                expanded += guide.metrics.get('rooms expanded', 0)
+                if path.destination:
+                    found += 1
+                    cost += sum(world.rooms[step.exit.to_vnum].terrain.weight for step in path.steps)
+
+            print(f"{kind:20} {name:9} {elapsed / queries * 1000:8.1f} ms/query "
+                  f"{expanded / queries:8.0f} rooms expanded  {found:3} found  cost {cost:7.0f}")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_world = World(str(Path(tmp, "world.db")))
+        build_world(bench_world, random.Random(1))
+        # the landmarks wait for the wilderness, which here is in memory only
+        bench_world.load_wilderness()
+        bench_world.landmarks.ready()
+        bench_world.landmarks.wait()
+        bench_world.landmarks.ready()
+        print(f"{len(bench_world.rooms)} rooms, {len(bench_world.landmarks.landmarks)} landmarks "
+              f"computed in {bench_world.landmarks.compute_seconds:.1f}s")
+        run(bench_world, int(sys.argv[1]) if len(sys.argv) > 1 else 30)
+        bench_world.close()
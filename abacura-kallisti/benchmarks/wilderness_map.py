@@ -0,0 +1,100 @@
+"""
+Benchmark down-sampled wilderness maps
+
+Times WildernessMap.sample_map() against calling sample() for every cell, as get_scaled_map() used to,
+checks that both give the same map, and times the whole get_scaled_map().  Uses the world in the given
+database, or a synthetic wilderness of blobs of terrain with a few landmarks and harvested rooms.
+
+    python benchmarks/wilderness_map.py [world.db]
+"""
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from abacura_kallisti.atlas.room import Room
+from abacura_kallisti.atlas.wilderness import WildernessGrid
+from abacura_kallisti.atlas.wilderness_layer import WILDERNESS_AREA
+from abacura_kallisti.atlas.wilderness_map import WildernessMap
+from abacura_kallisti.atlas.world import World
+
+TERRAIN = ['Field', 'Forest', 'Hills', 'Mountains', 'Water', 'Jungle', 'Swamp', 'Desert', 'Snow', 'Beach']
+LANDMARKS = ['Peak', 'Lava', 'Arctic', 'Underground', 'Field Bridge']
+SIZES = [(100, 30), (200, 60), (352, 167)]
+
+
+def synthetic_rows(since: datetime) -> list:
+    grid = WildernessGrid()
+    rnd = np.random.default_rng(1)
+    # blobs of terrain from a coarse random field, with sparse landmarks on top
+    coarse = rnd.integers(0, len(TERRAIN), size=(grid.HEIGHT // 8 + 1, grid.WIDTH // 8 + 1))
+    terrain = coarse.repeat(8, axis=0).repeat(8, axis=1)[:grid.HEIGHT, :grid.WIDTH]
+    landmarks = rnd.random(terrain.shape) < 0.002
+
+    rows = []
+    empty = [False] * (len(Room.persistent_fields()) - 6)
+    for y in range(grid.HEIGHT):
+        for x in range(grid.WIDTH):
+            vnum = grid.get_vnum_at_point(x, y)
+            if vnum == '' or rnd.random() < 0.05:
+                continue
+
+            name = LANDMARKS[rnd.integers(len(LANDMARKS))] if landmarks[y, x] else TERRAIN[terrain[y, x]]
+            harvested = str(since + timedelta(minutes=int(rnd.integers(-60, 60)))) if rnd.random() < 0.1 else None
+            rows.append([vnum, name, name, WILDERNESS_AREA] + empty + [None, harvested])
+
+    return rows
+
+
+def main(db_filename: str, synthetic: bool):
+    since = datetime(2023, 6, 1)
+    world = World(db_filename)
+    if synthetic:
+        world.rooms.wilderness.load_rows(synthetic_rows(since), [])
+    else:
+        world.load_wilderness()
+
+    wilderness_map = WildernessMap(world)
+    you_vnum = next(iter(world.rooms.wilderness.vnums()))
+    # the stored dates are strings, which sample() compares directly
+    since = str(since)
+    print(f"{len(world.rooms.wilderness)} wilderness rooms")
+
+    for scale_width, scale_height in SIZES:
+        start = time.perf_counter()
+        wilderness_map.sampled_you = wilderness_map.sampled_gummton = False
+        x_scale = wilderness_map.grid.WIDTH / (scale_width - 1)
+        y_scale = wilderness_map.grid.HEIGHT / (scale_height - 1)
+        looped = [[wilderness_map.sample((round(x * x_scale), round(y * y_scale)), (x_scale / 2, y_scale / 2),
+                                         'gather', since, you_vnum)
+                   for x in range(scale_width)] for y in range(scale_height)]
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        terrain_names, harvestable = wilderness_map.sample_map(scale_width, scale_height, 'gather', since, you_vnum)
+        array_time = time.perf_counter() - start
+
+        sampled = [list(zip(*row)) for row in zip(terrain_names.tolist(), harvestable.tolist())]
+        mismatches = sum(a != b for looped_row, row in zip(looped, sampled) for a, b in zip(looped_row, row))
+
+        start = time.perf_counter()
+        wilderness_map.get_scaled_map(scale_width, scale_height, ruler=True, you_vnum=you_vnum, skill='gather',
+                                      since=since)
+        map_time = time.perf_counter() - start
+
+        print(f"{scale_width:3}x{scale_height:<3}  sample() loop {loop_time * 1000:8.1f} ms  "
+              f"sample_map() {array_time * 1000:6.1f} ms  get_scaled_map() {map_time * 1000:6.1f} ms  "
+              f"mismatches {mismatches}")
+
+    world.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1], synthetic=False)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            main(str(Path(tmp, "world.db")), synthetic=True)
@@ -18,6 +18,7 @@ setup(
     install_requires=[
         "abacura~=0.0.13",
         "pillow",
+        "numpy",
         ],
 )
 